@@ -1,21 +1,38 @@
-import os, time, threading, argparse, atexit, random
+import os, sys, time, threading, argparse, atexit, random, resource
+
+# Process start, startup phases and time to first quote are measured from here
+started = time.time()
 
 from typing import Union, Dict
-from flask import Flask
+from concurrent.futures import Future
+from flask import Flask, Response, request
 from multiprocessing import Queue
 from dotenv import load_dotenv
-from apscheduler.schedulers.background import BackgroundScheduler
 
 from rubi import Union, NewLimitOrder, Transaction, OrderSide, EmitTakeEvent, EmitCancelEvent, UpdateLimitOrder
 from rubi import Client, OrderBook, OrderEvent, EmitOfferEvent, NewCancelOrder, OrderType, ERC20
 from _decimal import Decimal
-from web3 import Web3
 
 from transactionLogging import Logger
 from events import OrderBookRequester, LastCancelTimes, PolledOrder
 from pairs import TokenPairs, OrderComparison, BestPrices
-from utils import TokenPrice, get_client, BalanceNotification, ErrorNotification
+from utils import TokenPrice, get_client, BalanceNotification, ErrorNotification, dispatcher
 from swap import Uniswapper
+from rebalancer import InventoryRebalancer
+from store import ColumnarStore
+from batcher import TransactionBatcher, BatchResult, completed_future
+from nonce import NonceManager, TransactionPipeline
+from gas import GasEstimator
+from metrics import metrics
+from tracing import tracer
+from breaker import breakers
+from ratelimit import rate_limiter
+from memory import MemoryMonitor
+from startup import Startup, ChainMetadataCache, LazyERC20
+from journal import Journal
+from pricelevels import PriceLevelIndex
+from shadow import ShadowExchange, ShadowOrderBookRequester, ShadowUniswapper
+from backtest import SimClock, RealClock, SimExchange, SimOrderBookRequester, SimUniswapper, SimNotification, Backtest, BookRecorder, load_events, sim_wallet
 
 
 ##### Read in Argparse/Configurations #####
@@ -31,98 +48,194 @@ parser.add_argument('--swap',  action='store_true', help='uses uniswap')
 parser.add_argument('--no_arb',  action='store_true', help='uses anti-arb loop')
 parser.add_argument('--tack',  action='store_true', help='tack method')
 parser.add_argument('--cancel_all', type=int, help="Number of minutes before every order is cancelled")
+parser.add_argument('--update', action='store_true', help='requotes not-best orders in place instead of placing a new offer')
+parser.add_argument('--batch_window', type=int, help='milliseconds to collect cancels/updates/offers into one batch transaction')
+parser.add_argument('--pipeline', type=int, help='max transactions in flight, submitted with locally managed nonces')
+parser.add_argument('--rebalance', type=int, help='seconds between background uniswap inventory rebalance checks')
+parser.add_argument('--store', type=str, help='directory for the columnar fill/gas/swap/price history')
+parser.add_argument('--reward_rate', type=str, help='dollars of rewards per dollar of volume, skips offers whose gas costs more')
+parser.add_argument('--memory', type=int, help='minutes between tracemalloc memory snapshots')
+parser.add_argument('--memory_alarm', type=float, help='MB of traced memory growth before an alarm email is sent')
+parser.add_argument('--backtest', type=str, help='replays a .jsonl file from --record, or synthetic:HOURS[:SEED], through the strategy offline')
+parser.add_argument('--backtest_log', type=str, default=os.devnull, help='file for the bot output during --backtest')
+parser.add_argument('--record', type=str, help='appends prices, books and takes to a .jsonl file for --backtest')
+parser.add_argument('--trace', type=float, help='traces order_loop/arb_checker stages and logs passes slower than arg seconds')
+parser.add_argument('--sim_chain', action='store_true', help='trades on the simulated exchange in real time, prices, the subgraph and email still go over http')
+parser.add_argument('--shadow', type=str, help='runs on live prices, book and events but only records the offers, cancels and swaps it would send, to this .jsonl file')
+parser.add_argument('--rpc_latency', type=int, default=0, help='milliseconds each simulated transaction (and a tenth for each balance read) takes with --sim_chain')
+parser.add_argument('--rate_limits', type=str, help='requests per second per upstream host shared by every bot process on the machine, as host=rate[/burst],...')
+parser.add_argument('--metadata_cache', type=str, default="./cache/chain_metadata.json", help='file caching token decimals and addresses so later starts skip reading them over RPC')
+parser.add_argument('--rate_limit_dir', type=str, help='directory for the shared rate limit buckets, defaults to a folder in the temp directory')
+parser.add_argument('--journal', type=str, help='directory for the event/decision journal and state snapshots a restart recovers from')
+parser.add_argument('--snapshot_interval', type=int, default=60, help='seconds between --journal snapshots')
+parser.add_argument('--min_depth', type=str, help='base size other makers must quote ahead before their level sets my price, smaller offers in front are ignored')
+parser.add_argument('--journal_retention', type=int, default=2, help='journal segments kept from before the latest snapshot')
 
 
 args = parser.parse_args()
 load_dotenv(".email_env")
 
-token = None
-match args.pair:
-	case "weth_usdc":
-		token = TokenPairs.WETH_USDC
-		token_port = 5000
-		market_price = TokenPrice(token=token)
-		gas_price = market_price
-
-	case "weth_usdt":
-		token = TokenPairs.WETH_USDT
-		token_port = 5001
-		# TODO: fix this
-		market_price = TokenPrice(token=token)
-		gas_price = market_price
-
-	case "weth_dai":
-		token = TokenPairs.WETH_DAI
-		token_port = 5002
-		# TODO: fix this
-		market_price = TokenPrice(token=token)
-		gas_price = market_price
-
-	case "usdc_dai":
-		token = TokenPairs.USDC_DAI
-		token_port = 5003
-		market_price = TokenPrice(token=token)
-		gas_price = TokenPrice(token=TokenPairs.WETH_USDC)
-
-	case "op_usdc":
-		token = TokenPairs.OP_USDC
-		token_port = 5004
-		market_price = TokenPrice(token=token)
-		gas_price = TokenPrice(token=TokenPairs.WETH_USDC)
-
-	case "weth_usdc_arb":
-		token = TokenPairs.WETH_USDC_ARB
-		token_port = 5005
-		market_price = TokenPrice(token=token)
-		gas_price = market_price
-
+token = TokenPairs.from_arg(args.pair)
 if token is None:
 	raise ValueError("Token not correctly set")
+token_port = token.config.port
+market_price = TokenPrice(token=token)
+# Pairs not priced in ETH value gas with another pair's price
+gas_price = market_price if token.config.gas_price_pair == token.name else TokenPrice(token=TokenPairs[token.config.gas_price_pair])
+
+# Every pair process on the machine draws from the same per-host request budget
+rate_limiter.configure(limits=args.rate_limits, directory=args.rate_limit_dir)
 
 ##### Global Objects #####
 
+startup = Startup(started)
+startup.mark("imports")
+
 # Loggers, clients, and notifiers
 app = Flask(__name__)
-my_logger = Logger(token=token)
-balance_notifier = BalanceNotification(args.alert_time)
-gas_notifier = BalanceNotification(args.alert_time)
-error_notifier = ErrorNotification()
-cancel_times = LastCancelTimes(args.cancel_old)
+if args.backtest:
+	args.journal = None
+journal = Journal(os.path.join(args.journal, token.value.lower()), retention=args.journal_retention) if args.journal else None
+my_logger = Logger(token=token, store=ColumnarStore(os.path.join(args.store, token.value.lower())) if args.store else None, journal=journal)
+cancel_times = LastCancelTimes(args.cancel_old, journal=journal)
 my_queue = Queue()
-client = get_client(queue=my_queue, pair=token)
+if args.backtest:
+	# Simulated exchange on simulated time, nothing touches the network or sends email
+	os.environ.setdefault("WALLET", sim_wallet)
+	args.pipeline = args.batch_window = args.record = args.shadow = None
+	sim_clock = SimClock()
+	breakers.call_later = sim_clock.call_later
+	client = SimExchange(clock=sim_clock, token=token, wallet=os.getenv("WALLET"), on_event=lambda order: on_order(order))
+	balance_notifier = SimNotification()
+	gas_notifier = SimNotification()
+	error_notifier = SimNotification()
+else:
+	if args.sim_chain:
+		# Simulated exchange on real time, events arrive on my_queue like the live listener's
+		os.environ.setdefault("WALLET", sim_wallet)
+		args.pipeline = args.batch_window = None
+		client = SimExchange(clock=RealClock(), token=token, wallet=os.getenv("WALLET"), on_event=my_queue.put,
+							 latency=args.rpc_latency/1000, read_latency=args.rpc_latency/10000)
+	else:
+		client = get_client(queue=my_queue, pair=token)
+	if args.shadow:
+		# Live reads and events, would-be transactions are recorded instead of sent
+		client = ShadowExchange(client=client, token=token, gas_price=gas_price, path=args.shadow, on_event=my_queue.put)
+	balance_notifier = BalanceNotification(args.alert_time)
+	gas_notifier = BalanceNotification(args.alert_time)
+	error_notifier = ErrorNotification()
+sim_chain = args.backtest or args.sim_chain
+startup.mark("client")
+recorder = BookRecorder(args.record, wallet=os.getenv("WALLET")) if args.record else None
+
+# Transaction pipeline and batcher
+pipeline = TransactionPipeline(NonceManager(w3=client.network.w3, wallet=client.wallet), max_in_flight=args.pipeline) if args.pipeline else None
+batcher = TransactionBatcher(client=client, window=args.batch_window/1000, pipeline=pipeline) if args.batch_window else None
+
+# With --pipeline order_loop returns before its offers are mined and the next
+# poll doesn't show them yet, so a side is left alone until its reciepts arrive
+sides_in_flight = {}  # order side: offers and updates submitted but not mined
+sides_in_flight_lock = threading.Lock()
 
 # Balance Estimation 
-base_erc20 = ERC20.from_network(token.sign_list()[0], network=client.network)
-quote_erc20 = ERC20.from_network(token.sign_list()[1], network=client.network)
+# One ERC20 per symbol, shared by the poller, Uniswapper, rebalancer and gas checks.
+# Live runs answer decimals and addresses from the metadata cache and connect on first use.
+metadata_cache = ChainMetadataCache(args.metadata_cache) if not sim_chain else None
+erc20s = {}
+def get_erc20(symbol: str) -> ERC20:
+	if symbol not in erc20s:
+		if sim_chain:
+			erc20s[symbol] = client.erc20(symbol)
+		else:
+			erc20s[symbol] = metadata_cache.erc20(token.network.name, symbol, build=lambda: ERC20.from_network(symbol, network=client.network))
+	return erc20s[symbol]
+
+base_erc20 = get_erc20(token.config.base.symbol)
+quote_erc20 = get_erc20(token.config.quote.symbol)
 
 # TODO: 2. figure out how to measure gas on arbitrum
-if token==TokenPairs.WETH_USDC_ARB:
-	gas_erc20 = ERC20.from_network("WETH", network=client.network)
-else:
-	gas_erc20 = ERC20.from_network("ETH", network=client.network)
+gas_erc20 = get_erc20(token.network.gas_token)
+
+# Pre-trade gas cost estimation
+gas_estimator = GasEstimator(w3=client.network.w3,
+							 gas_decimal=gas_erc20.decimal,
+							 gas_price=gas_price,
+							 reward_rate=Decimal(args.reward_rate),
+							 l1_oracle=token.network.l1_fees) if args.reward_rate else None
 
 gas_warning_threshold = Decimal('5') # in USD
 gas_error_threshold = Decimal('1') # in USD
 
-base_allowance = token.target_allowances()
+base_allowance = token.config.target_allowance
 start_spread_buffer = Decimal("3") 
 
 # Orderbook Poller
-order_book_poller = OrderBookRequester(client=client,token=token)
+if args.backtest:
+	order_book_poller = SimOrderBookRequester(exchange=client, token=token, base_erc20=base_erc20, quote_erc20=quote_erc20)
+elif args.shadow:
+	order_book_poller = ShadowOrderBookRequester(exchange=client, token=token, base_erc20=base_erc20, quote_erc20=quote_erc20, recorder=recorder)
+else:
+	order_book_poller = OrderBookRequester(client=client,token=token, base_erc20=base_erc20, quote_erc20=quote_erc20, recorder=recorder)
 
 # Uniswap client
-uniswapper = Uniswapper(pair=token, 
+if sim_chain:
+	uniswapper_class, uniswapper_args = SimUniswapper, {"exchange": client.client if args.shadow else client}
+elif args.shadow:
+	uniswapper_class, uniswapper_args = ShadowUniswapper, {"shadow": client}
+else:
+	uniswapper_class, uniswapper_args = Uniswapper, {"nonce_manager": pipeline.nonce_manager if pipeline is not None else None}
+uniswapper = uniswapper_class(pair=token, 
 			quoteERC20=quote_erc20, 
 			baseERC20=base_erc20, 
 			gasERC20=gas_erc20, 
 			market_price=market_price, 
 			gas_price=gas_price, 
 			beta=token.beta(),
-			logger=my_logger)
+			logger=my_logger,
+			on_confirmed=lambda receipt: on_swap_confirmed(receipt),
+			**uniswapper_args)
+
+# Background inventory rebalancing
+rebalancer = InventoryRebalancer(uniswapper=uniswapper,
+				baseERC20=base_erc20,
+				quoteERC20=quote_erc20,
+				market_price=market_price,
+				base_allowance=base_allowance,
+				logger=my_logger) if args.rebalance else None
+
+# Memory snapshots for long runs
+memory_monitor = MemoryMonitor(notifier=error_notifier, token=token, growth_alarm=args.memory_alarm) if args.memory else None
+if memory_monitor is not None:
+	memory_monitor.track("ErrorNotification.total_errors", lambda: len(error_notifier.total_errors))
+	memory_monitor.track("Event queue", lambda: my_queue.qsize())
+
+# Stage tracing of each order_loop/arb_checker pass
+if args.trace is not None:
+	tracer.enable(slow_threshold=args.trace)
+
+# Prometheus metrics, gauges are read from state the bot already keeps at scrape time
+metrics.const_labels = {"pair": token.sign()}
+metrics.gauge("event_queue_depth", lambda: my_queue.qsize(), "Orderbook events waiting to be handled")
+metrics.gauge("market_price", lambda: market_price.price or 0, "Last market price of the base token")
+metrics.gauge("swap_pending", lambda: int(uniswapper.swap_pending()), "1 while a Uniswap swap is confirming")
+metrics.gauge("fill_volume_dollars", lambda: {(("side", "BUY"),): my_logger.bid_fills.volume, (("side", "SELL"),): my_logger.ask_fills.volume}, "Volume filled since start")
+metrics.gauge("fill_arb_dollars", lambda: {(("side", "BUY"),): my_logger.bid_fills.arb, (("side", "SELL"),): my_logger.ask_fills.arb}, "Arb lost on fills since start")
+metrics.gauge("gas_fees_dollars", lambda: {(("action", "offer"),): my_logger.offers_gas_fees.total,
+										   (("action", "update"),): my_logger.update_gas_fees.total,
+										   (("action", "batch_cancel"),): my_logger.cancel_gas_fees.total}, "Gas paid since start")
+metrics.gauge("memory_traced_bytes", lambda: memory_monitor.traced if memory_monitor else 0, "Traced Python memory at the last memory check")
+metrics.gauge("memory_max_rss_bytes", lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, "Peak resident set size")
+metrics.gauge("notification_queue_depth", lambda: dispatcher.queue.qsize(), "Notification emails waiting to be sent")
+metrics.gauge("time_to_first_quote_seconds", lambda: startup.first_quote or 0, "Seconds from process start to the first offer sent or orders found best")
+metrics.gauge("breaker_state", breakers.states, "Circuit breaker per dependency, 0 closed, 1 half open, 2 open")
+metrics.gauge("swap_loss_dollars", lambda: my_logger.uniswapper_losses.total, "Value lost on Uniswap swaps since start")
+
+startup.mark("globals")
 
 # Threshold percentage calculations
-alpha = token.alpha() # Larger alpha is more aggressive
-gamma = token.gamma() # Larger gamma is more aggressive
+alpha = token.config.alpha # Larger alpha is more aggressive
+gamma = token.config.gamma # Larger gamma is more aggressive
+min_depth = Decimal(args.min_depth) if args.min_depth else None # base size, dust smaller than this doesn't set my price
 ask_thresh_percent = Decimal(1) - alpha
 bid_thresh_percent = Decimal(1) + alpha
 
@@ -137,16 +250,54 @@ if gamma >= alpha:
 
 # Calls update of market/gas price objects
 def update_market_price() -> None:
-	if token == TokenPairs.USDC_DAI or token == TokenPairs.OP_USDC:
+	if gas_price is not market_price:
 		gas_price.update_price()
 	market_price.update_price()
+	my_logger.record_price(market_price.price)
+	if recorder is not None:
+		recorder.price(market_price.price, gas_price.price)
+
+# Writes a consumed event or a decision to the --journal
+def journal_entry(kind: str, **values) -> None:
+	if journal is not None:
+		journal.append(kind, **values)
+
+# State a --journal snapshot holds, the logger, cancel timing and last polled book
+def journal_state() -> dict:
+	return {"logger": my_logger.snapshot(), "cancel_times": cancel_times.snapshot(), "book": order_book_poller.snapshot()}
+
+def take_snapshot() -> None:
+	try:
+		journal.snapshot(journal_state)
+	except Exception as e:
+		print(f"ERROR - take_snapshot: {e}")
+
+# Loads the last snapshot and replays the journal written after it
+def recover_journal() -> None:
+	start_time = time.time()
+	snapshot, entries = journal.recover()
+	if snapshot is not None:
+		my_logger.restore(snapshot["state"]["logger"])
+		cancel_times.restore(snapshot["state"]["cancel_times"])
+		order_book_poller.restore(snapshot["state"]["book"])
+	replayed = 0
+	for entry in entries:
+		if my_logger.replay(entry) or cancel_times.replay(entry):
+			replayed += 1
+	snapshot_age = f"{time.time() - snapshot['time']:.0f}s old snapshot" if snapshot is not None else "no snapshot"
+	print(f"\t\trecover_journal: {snapshot_age}, replayed {replayed} of {len(entries)} entries in {(time.time() - start_time)*1000:.1f}ms")
 
 # Listens for events on orderbook
 def rubicon_listener(queue: Queue) -> None: 
 	while True:
 		message: Union[OrderBook, OrderEvent] = queue.get(block=True)
 		if isinstance(message, OrderEvent):
+			metrics.counter("events_total", "Orderbook events received").inc(order_type=message.order_type.name)
+			if recorder is not None and message.pair_name == token.sign():
+				recorder.take(message)
 			if message.pair_name == token.sign():
+				journal_entry("event", order_type=message.order_type.name, side=message.order_side.name, price=message.price, size=message.size,
+							  limit_order_owner=message.limit_order_owner, market_order_owner=message.market_order_owner)
 				on_order(order=message)
 		else:
 			raise Exception("rubicon_listener: Unexpected message fetched from queue")
@@ -170,6 +321,64 @@ def price_to_ints(price: Decimal, size: Decimal, side: OrderSide, set_closest: b
 		ints = int(ints_unrounded) + 1
 	return ints
 
+# Id of my best order on a side to requote in place, None if a new offer should be placed
+def get_update_id(order_side: OrderSide, is_not_best: bool) -> Union[None, str]:
+	if not args.update or not is_not_best:
+		return None
+	if order_side == OrderSide.BUY and order_book_poller.my_best_bid is not None:
+		return order_book_poller.my_best_bid.limit_order_id
+	elif order_side == OrderSide.SELL and order_book_poller.my_best_ask is not None:
+		return order_book_poller.my_best_ask.limit_order_id
+	return None
+
+# With --min_depth my order counts as best while less than that much size is queued ahead of it
+def only_dust_ahead(levels: PriceLevelIndex, my_order: PolledOrder) -> bool:
+	if min_depth is None:
+		return False
+	position = levels.queue_position(my_order.limit_order_id)
+	return position is not None and position[1] < min_depth
+
+# Book price my offers on a side are placed against. With --min_depth it is the
+# first level other makers have that much size up to, falling back to the book best.
+def reference_price(levels: PriceLevelIndex, book_best: Decimal) -> Decimal:
+	if min_depth is None:
+		return book_best
+	price = levels.price_at_depth(min_depth)
+	return book_best if price is None else price
+
+# True if the volume an order earns is worth the gas to place it
+def worth_gas(order_side: OrderSide, price: Decimal, size: Decimal, is_not_best: bool) -> bool:
+	if gas_estimator is None:
+		return True
+	action = "update" if get_update_id(order_side, is_not_best) is not None else "offer"
+	return gas_estimator.worth_it(action, volume=price*size)
+
+# True if an offer at about the market price is worth the gas of the steps
+# (cancels, swaps) needed to fund it as well as its own. Checked before the
+# first step, paying for a cancel only to gate the offer leaves the side empty.
+def worth_gas_with(order_side: OrderSide, steps: tuple) -> bool:
+	if gas_estimator is None:
+		return True
+	with tracer.stage("gas_estimate"):
+		is_worth_gas = gas_estimator.worth_it(steps + ("offer",), volume=market_price.price*base_allowance)
+	if not is_worth_gas:
+		print(f"\t\tset_limit: funding an offer on {order_side} not worth the gas")
+		my_logger.gas_gated += 1
+	return is_worth_gas
+
+# Records a reciept's gas usage for future estimates
+def observe_gas(action: str, transaction_result, batch_size: int = 1) -> None:
+	if gas_estimator is not None and transaction_result.status == 1:
+		gas_estimator.observe(action, gas_used=transaction_result.gas_used, l1_fee=transaction_result.l1_fee, batch_size=batch_size)
+
+# Called from the swap confirmer once a swap is mined
+def on_swap_confirmed(receipt) -> None:
+	if gas_estimator is not None:
+		l1_fee = receipt.get('l1Fee', 0)
+		gas_estimator.observe("swap", gas_used=receipt['gasUsed'], l1_fee=int(l1_fee, 16) if isinstance(l1_fee, str) else l1_fee)
+	print("\t\ton_swap_confirmed: swap confirmed, requoting")
+	order_loop()
+
 # Returns true if action required for a side (no order of not best)
 def requires_action(order_comparison:OrderComparison) -> bool:
 	return order_comparison == OrderComparison.NO_ORDERS or order_comparison == OrderComparison.NOT_BEST
@@ -181,7 +390,7 @@ def globals_are_none() -> bool:
 # Check for adequate gas and send necesssary message
 def enough_gas() -> bool:
 	# TODO: GAS remove this
-	if token==TokenPairs.WETH_USDC_ARB:
+	if not token.network.l1_fees:
 		return True
 	
 	# In Eth
@@ -251,14 +460,125 @@ def balance_notification(order_side: OrderSide) -> None:
 		balance_notifier.send_notification(subject=subject, message=message)
 
 def get_volume(order: OrderEvent):
-	if order.order_side == OrderSide.BUY:
-		my_logger.bid_my_price.append(order.price)
-		my_logger.bid_volume.append(order.size)
-		my_logger.bid_market_price.append(market_price.price)
-	elif order.order_side == OrderSide.SELL:
-		my_logger.ask_my_price.append(order.price)
-		my_logger.ask_volume.append(order.size)
-		my_logger.ask_market_price.append(market_price.price)
+	my_logger.record_fill(side=order.order_side, price=order.price, size=order.size, market_price=market_price.price)
+
+# Gas paid (in dollars) by a successful transaction, None where gas isn't measured.
+# batch_size splits the fee between the callers that shared a batch transaction.
+def get_gas_fee(transaction_result, batch_size: int = 1) -> Union[None, Decimal]:
+	if not token.network.l1_fees:
+		return None
+	return Decimal(str(transaction_result.l1_fee*(.1**gas_erc20.decimal))) * gas_price.price / batch_size
+
+# Latency from submission to reciept and outcome of offer, update and cancel transactions
+def record_transaction(action: str, start_time: float, status: str) -> None:
+	metrics.histogram("transaction_seconds", "Time from submission to reciept").observe(time.time() - start_time, action=action)
+	metrics.counter("transactions_total", "Transactions by action and outcome").inc(action=action, status=status)
+
+##### Transaction Submission #####
+# Each returns a future resolving to a BatchResult. Without --batch_window or
+# --pipeline the transaction is sent right away and the future is already complete.
+
+# send is called as send(nonce, fees)
+def send_transaction(send) -> Future:
+	rpc_send = lambda nonce, fees: breakers.get("rpc").call(send, nonce, fees)
+	if pipeline is not None:
+		return pipeline.submit(rpc_send)
+	return completed_future(rpc_send)
+
+def submit_cancels(orders: list) -> Future:
+	journal_entry("cancel_sent", order_ids=[order.order_id for order in orders])
+	if batcher is not None:
+		return batcher.cancel(token.sign(), orders)
+	return send_transaction(lambda nonce, fees: client.batch_cancel_limit_orders(Transaction(orders=orders, nonce=nonce, **fees)))
+
+def submit_update(order: Dict) -> Future:
+	update = UpdateLimitOrder(pair_name=token.sign(),
+							  order_side=order['order_side'],
+							  order_id=int(order['update_id'],16),
+							  size=order['size'],
+							  price=order['price'])
+	journal_entry("update_sent", order_id=order['update_id'], side=order['order_side'].name, size=order['size'], price=order['price'])
+	if batcher is not None:
+		return batcher.update(token.sign(), [update])
+	return send_transaction(lambda nonce, fees: client.batch_update_limit_orders(Transaction(orders=[update], nonce=nonce, **fees)))
+
+def submit_offer(pay_amt: int, pay_gem: str, buy_amt: int, buy_gem: str) -> Future:
+	journal_entry("offer_sent", pay_amt=pay_amt, pay_gem=pay_gem, buy_amt=buy_amt, buy_gem=buy_gem)
+	if batcher is not None:
+		return batcher.offer(token.sign(), pay_amt=pay_amt, pay_gem=pay_gem, buy_amt=buy_amt, buy_gem=buy_gem)
+	return send_transaction(lambda nonce, fees: client.market.offer(pay_amt=pay_amt, pay_gem=pay_gem, buy_amt=buy_amt, buy_gem=buy_gem, nonce=nonce, **fees))
+
+def mark_in_flight(order_side: OrderSide, count: int) -> None:
+	with sides_in_flight_lock:
+		sides_in_flight[order_side] = sides_in_flight.get(order_side, 0) + count
+		if sides_in_flight[order_side] <= 0:
+			del sides_in_flight[order_side]
+
+def side_in_flight(order_side: OrderSide) -> bool:
+	with sides_in_flight_lock:
+		return order_side in sides_in_flight
+
+# Records a pipelined reciept when it arrives and frees its side for the next order_loop
+def on_pipelined_result(future: Future, on_result, start_time: float, order_side: OrderSide) -> None:
+	try:
+		on_result(future, start_time)
+	finally:
+		mark_in_flight(order_side, -1)
+
+# Records the outcome of an in-place update of a not-best order
+def on_update_result(future: Future, start_time: float) -> bool:
+	try:
+		result: BatchResult = future.result()
+		transaction_result = result.receipt
+		my_logger.update_latency.append(time.time() - start_time)
+		observe_gas("update", transaction_result, result.batch_size)
+
+		if transaction_result.status == 1:
+			my_logger.record_gas("update", get_gas_fee(transaction_result, result.batch_size))
+			record_transaction("update", start_time, "success")
+			print("\t\ton_update_result: Update Transaction Succeeded")
+			my_logger.update_placed += 1
+			return True
+		else:
+			record_transaction("update", start_time, "failed")
+			print("ERROR - on_update_result: Update Transaction Failed")
+			my_logger.update_fail += 1
+			error_notifier.error_occured(transaction_result.transaction_hash, token)
+			return False
+
+	except Exception as e:
+		record_transaction("update", start_time, "error")
+		print(f"ERROR - on_update_result: update error {e}")
+		my_logger.update_fail += 1
+		return False
+
+# Records the outcome of a new offer
+def on_offer_result(future: Future, start_time: float) -> bool:
+	try:
+		result: BatchResult = future.result()
+		transaction_result = result.receipt
+		my_logger.offer_latency.append(time.time() - start_time)
+		observe_gas("offer", transaction_result, result.batch_size)
+
+		if transaction_result.status == 1:
+			my_logger.record_gas("offer", get_gas_fee(transaction_result, result.batch_size))
+			record_transaction("offer", start_time, "success")
+			print("\t\torder_loop: Offer Transaction Succeeded")
+			my_logger.offer_placed += 1
+		else:
+			record_transaction("offer", start_time, "failed")
+			print("ERROR - order_loop: Offer Transaction Failed")
+			my_logger.offer_fail += 1
+			error_notifier.error_occured(transaction_result.transaction_hash, token)
+		print(f"order_loop offer transaction result: {transaction_result}")
+		print("\n\n\n ")
+		return transaction_result.status == 1
+
+	except Exception as e:
+		record_transaction("offer", start_time, "error")
+		print(f"ERROR - order_loop: new offer error {e}")
+		my_logger.offer_fail += 1
+		return False
 
 ##### Order Triggers #####
 
@@ -315,23 +635,27 @@ def on_order(order: OrderEvent) -> None:
 			order_loop()
 
 # Check that by orders are the best on the market
+@metrics.timed("check_best")
+@tracer.traced("check_best")
 def check_best(order_side: OrderSide, size: Decimal) -> OrderComparison:
 
-	poll_trys = 0
-	while True:
+	# Fail fast while the node or the subgraph is down. Instead of sleeping between
+	# polls order_loop is run again on a timer once the breaker's backoff has passed.
+	if breakers.get("rpc").is_open():
+		print(f"ERROR - check_best: rpc circuit open, not quoting on {order_side}.")
+		breakers.get("rpc").retry_later("order_loop", lambda: order_loop())
+		return OrderComparison.ERROR_RETRIEVING
+
+	with tracer.stage("poll_book"):
 		poll_success = order_book_poller.poll_book()
-		if poll_trys >= 10:
-			print(f"ERROR - check_best: could not retrieve orderbook orders after {poll_trys} trys.")
-			return OrderComparison.ERROR_RETRIEVING
-		if poll_success:
-			break
-		poll_trys += 1
-		print(f"WARNING - check_best: polled {poll_trys} times.")
-		time.sleep(5)
+	if not poll_success:
+		print(f"ERROR - check_best: could not retrieve orderbook orders, subgraph circuit {breakers.get('subgraph').state}.")
+		breakers.get("subgraph").retry_later("order_loop", lambda: order_loop())
+		return OrderComparison.ERROR_RETRIEVING
 		
 	# Double check that prices were recent
 	if not order_book_poller.is_poll_recent():
-		print(f"ERROR - check_best: could not retrieve orderbook orders after {poll_trys} trys.")
+		print(f"ERROR - check_best: orderbook poll is stale.")
 		return OrderComparison.ERROR_RETRIEVING
 
 	# Check that asks/bids are not sitting below/above threshold values
@@ -346,7 +670,8 @@ def check_best(order_side: OrderSide, size: Decimal) -> OrderComparison:
 			return OrderComparison.NO_ORDERS
 		
 		# Not the best order on the market
-		elif order_book_poller.my_best_bid.price < order_book_poller.book_best_bid.price:
+		elif order_book_poller.my_best_bid.price < order_book_poller.book_best_bid.price and \
+			 not only_dust_ahead(order_book_poller.bids, order_book_poller.my_best_bid):
 			return OrderComparison.NOT_BEST
 		
 	elif order_side == OrderSide.SELL:
@@ -356,13 +681,15 @@ def check_best(order_side: OrderSide, size: Decimal) -> OrderComparison:
 			return OrderComparison.NO_ORDERS
 		
 		# Not the best order on the market
-		elif order_book_poller.my_best_ask.price > order_book_poller.book_best_ask.price:
+		elif order_book_poller.my_best_ask.price > order_book_poller.book_best_ask.price and \
+			 not only_dust_ahead(order_book_poller.asks, order_book_poller.my_best_ask):
 			return OrderComparison.NOT_BEST
 		
 	# I have the best orders
 	return OrderComparison.BEST
 
 # -1 means error, 0 means no orders to cancel, 1 means success
+@tracer.traced("cancel_orders")
 def cancel_orders(order_side: OrderSide) -> int:
 
 	# Check --cancel_old argument
@@ -386,15 +713,22 @@ def cancel_orders(order_side: OrderSide) -> int:
 	for order in cancel_orders:
 		all_cancel_transactions.append(NewCancelOrder(token.sign(),order_id = int(order.limit_order_id,16)))
 
-	transaction=Transaction(orders=all_cancel_transactions)
-	transaction_reciept = client.batch_cancel_limit_orders(transaction)
+	start_time = time.time()
+	with tracer.stage("receipt"):
+		result = submit_cancels(all_cancel_transactions).result()
+	transaction_reciept = result.receipt
+	my_logger.cancel_latency.append(time.time() - start_time)
+	observe_gas("batch_cancel", transaction_reciept, result.batch_size)
 	print("cancel transaction reciept=", transaction_reciept)
 
 	if transaction_reciept.status == 1:
+		record_transaction("batch_cancel", start_time, "success")
 		print(f"\t\tcancel_orders: succesfully cancelled orders on {order_side} side.")
-		my_logger.cancel.append(order_side)
+		my_logger.record_cancel(order_side, count=len(all_cancel_transactions))
+		my_logger.record_gas("batch_cancel", get_gas_fee(transaction_reciept, result.batch_size))
 		return 1
 	else:
+		record_transaction("batch_cancel", start_time, "failed")
 		print(f"\t\tcancel_orders: failed to cancel orders on {order_side} side.")
 		my_logger.cancel_failed += 1
 		return -1
@@ -407,6 +741,7 @@ def cancel_all():
 # def cancel_not_best(order_side: OrderSide) -> bool:
 # 	return False
 
+@tracer.trace_pass("arb_checker")
 def arb_checker():
 	# Check that global variables have been set:
 	if globals_are_none():
@@ -414,18 +749,12 @@ def arb_checker():
 		my_logger.price_api_error += 1
 		return 
 
-	# TODO: make this apart of the poll_book function
-	poll_trys = 0
-	while True:
+	with tracer.stage("poll_book"):
 		poll_success = order_book_poller.poll_book()
-		if poll_trys >= 10:
-			print(f"ERROR - check_best: could not retrieve orderbook orders after {poll_trys} trys.")
-			return OrderComparison.ERROR_RETRIEVING
-		if poll_success:
-			break
-		poll_trys += 1
-		print(f"WARNING - check_best: polled {poll_trys} times.")
-		time.sleep(2)
+	if not poll_success:
+		print(f"ERROR - arb_checker: could not retrieve orderbook orders, subgraph circuit {breakers.get('subgraph').state}.")
+		breakers.get("subgraph").retry_later("arb_checker", lambda: arb_checker())
+		return OrderComparison.ERROR_RETRIEVING
 	
 	orders_to_cancel = []
 	
@@ -438,24 +767,33 @@ def arb_checker():
 			orders_to_cancel.append(NewCancelOrder(token.sign(),order_id = int(my_bid.limit_order_id,16)))
 
 	if len(orders_to_cancel) > 0:
+		start_time = time.time()
 		try:
-			transaction=Transaction(orders=orders_to_cancel)
-			transaction_reciept = client.batch_cancel_limit_orders(transaction)
+			with tracer.stage("receipt"):
+				result = submit_cancels(orders_to_cancel).result()
+			transaction_reciept = result.receipt
+			observe_gas("batch_cancel", transaction_reciept, result.batch_size)
 			print("arbitrage cancel reciept=", transaction_reciept)
 
 			if transaction_reciept.status == 1:
+				record_transaction("batch_cancel", start_time, "success")
 				print(f"\t\tarb_checker: succesfully cancelled {len(orders_to_cancel)} orders. ")
-				my_logger.arb_cancel += len(orders_to_cancel)
+				my_logger.record_arb_cancel(count=len(orders_to_cancel))
+				my_logger.record_gas("batch_cancel", get_gas_fee(transaction_reciept, result.batch_size))
 			else:
+				record_transaction("batch_cancel", start_time, "failed")
 				print(f"\t\tarb_checker: failed to cancel {orders_to_cancel}")
 				my_logger.cancel_failed += 1
 		except Exception as e:
+			record_transaction("batch_cancel", start_time, "error")
 			print(f"\t\tarb_checker: error cancelling {orders_to_cancel}")
 			print(e)
 			my_logger.cancel_failed += 1	
 	# else:
 	# 	print(f"\t\tarb_checker: No orders cancelled")
 
+@metrics.timed("set_limit")
+@tracer.traced("set_limit")
 def set_limit(order_side: OrderSide, order_quality_status: OrderComparison, set_closest: bool) -> Union[None, Dict]:
 
 	print(f"\t\tset_limit: called on {order_side}")
@@ -486,6 +824,9 @@ def set_limit(order_side: OrderSide, order_quality_status: OrderComparison, set_
 			my_logger.thresholds += 1
 			return 
 
+	# Not-best orders are requoted in place with --update unless they get cancelled below
+	can_update = is_not_best
+
 	# Check that global variables have been set:
 	if globals_are_none():
 		print(f"ERROR - set_limit: globals are none.")
@@ -493,15 +834,24 @@ def set_limit(order_side: OrderSide, order_quality_status: OrderComparison, set_
 		return 
 
 	# Check if enough gas to execute trade
-	if not enough_gas():
+	with tracer.stage("balance"):
+		has_gas = enough_gas()
+		has_balance = has_gas and enough_balance(order_side=order_side)
+	if not has_gas:
 		print(f"ERROR - set_limit: not enough gas.")
 		my_logger.insufficient_gas += 1
 		return
 
 	# Enough funds to execute trade
-	if enough_balance(order_side=order_side):
+	if has_balance:
 		order_size = base_allowance
 	
+	# Balance is arriving from a swap that hasn't confirmed yet
+	elif uniswapper.swap_pending():
+		print(f"\t\tset_limit: Balance is low on {order_side}, waiting on pending swap.")
+		my_logger.swap_pending += 1
+		return
+
 	# Not enough funds to execute trade
 	else:
 		print(f"\t\tset_limit: Balance is low on {order_side}, cancel/swap.")
@@ -513,12 +863,21 @@ def set_limit(order_side: OrderSide, order_quality_status: OrderComparison, set_
 			print(f"ERROR - set_limit: Cancel prevented and balance is low on {order_side}.")
 			return
 		
+		if not worth_gas_with(order_side, ("batch_cancel",)):
+			return
+
 		# Cancel orders on order_side and record success
 		print(f"\t\tset_limit: attempting to cancel orders on {order_side} side")
 		successful_cancel = cancel_orders(order_side=order_side)
+		# The poller still lists the cancelled orders, none of them can be requoted in place
+		can_update = False
 		
 		# Cancel function either had an error, no orders to cancel, or still not enough funds
-		if not enough_balance(order_side=order_side) and args.swap:
+		with tracer.stage("balance"):
+			has_balance = enough_balance(order_side=order_side)
+		if not has_balance and args.swap:
+			if not worth_gas_with(order_side, ("swap",)):
+				return
 			print(f"\t\tset_limit: attempting uniswap on {order_side} side")
 			trade_amt = get_remainder(order_side=order_side)
 			result = uniswapper.swap(side=order_side, trade_amt=trade_amt, base_allowance=base_allowance, set_closest=set_closest)
@@ -528,6 +887,11 @@ def set_limit(order_side: OrderSide, order_quality_status: OrderComparison, set_
 				print(f"\t\tset_limit: uniswap on {order_side} side error occured")
 				my_logger.swap_error += 1
 				return
+
+			# Uniswap price is outside of beta
+			elif result == -2:
+				print(f"\t\tset_limit: uniswap price on {order_side} side too low, not placing")
+				return
 			
 			# Not enough funds to swap
 			elif result == 0:
@@ -545,19 +909,26 @@ def set_limit(order_side: OrderSide, order_quality_status: OrderComparison, set_
 					swap_cancel_side = OrderSide.SELL
 				elif order_side==OrderSide.SELL:
 					swap_cancel_side = OrderSide.BUY
+				if not worth_gas_with(order_side, ("batch_cancel", "swap")):
+					return
 				successful_cancel = cancel_orders(order_side=swap_cancel_side)
 
 				# If orders were succesfully cancelled, uniswap again
 				if successful_cancel == 1:
-					print(f"\t\tset_limit: swap-cancel on {swap_cancel_side} side succesful. Sleeping and placing")
-					time.sleep(5)
-					result = uniswapper.swap(side=order_side, base_allowance=base_allowance, set_closest=set_closest)
+					print(f"\t\tset_limit: swap-cancel on {swap_cancel_side} side succesful. Swapping again")
+					trade_amt = get_remainder(order_side=order_side)
+					result = uniswapper.swap(side=order_side, trade_amt=trade_amt, base_allowance=base_allowance, set_closest=set_closest)
 
 					# Uniswap error occurred
 					if result == -1:
 						print(f"\t\tset_limit: uniswap on {order_side} side error occured")
 						my_logger.swap_error += 1
 						return
+
+					# Uniswap price is outside of beta
+					elif result == -2:
+						print(f"\t\tset_limit: uniswap price on {order_side} side too low, not placing")
+						return
 					
 					# Still not enough funds for some reason, this would happen if uniswap was slow or cancel orders were partially filled
 					elif result == 0:
@@ -568,16 +939,22 @@ def set_limit(order_side: OrderSide, order_quality_status: OrderComparison, set_
 					my_logger.cancel_then_swaps += 1
 					print(f"\t\tset_limit: WOW! Specific cancel, then swap condition succeeded!")
 
-			print(f"\t\tset_limit: uniswap on {order_side} side successful")
+			# The swap confirms in the background and calls order_loop again once mined
+			print(f"\t\tset_limit: uniswap on {order_side} side submitted, placing once confirmed")
 			my_logger.uniswap_sides.append(order_side)
+			return
 		order_size = base_allowance
 	
-	# Get book best asks/bids
+	# Get book best asks/bids, only my own side skips dust so the other side is never crossed
 	best_ask = order_book_poller.book_best_ask.price 
 	best_bid = order_book_poller.book_best_bid.price
+	if order_side == OrderSide.SELL:
+		best_ask = reference_price(order_book_poller.asks, best_ask)
+	else:
+		best_bid = reference_price(order_book_poller.bids, best_bid)
 	
 	# Get spread in ints
-	spread = order_book_poller.book_best_ask.price  - order_book_poller.book_best_bid.price
+	spread = best_ask - best_bid
 	spread_buffer_price = convert_spread_ints(quote_ints=start_spread_buffer, size=order_size)
 
 	if args.tack:
@@ -662,18 +1039,25 @@ def set_limit(order_side: OrderSide, order_quality_status: OrderComparison, set_
 		print(f"\t\t book ask = {order_book_poller.book_best_ask.price}, book buy_amt = {order_book_poller.book_best_ask.quote_amt}, book pay_amt = {order_book_poller.book_best_ask.quote_amt}")
 		print(f"\t\t my proposed ask = {price}, book buy_amt = {buy_amt}, book pay_amt = {pay_amt}")
 
-		if price >= order_book_poller.book_best_ask.price:
+		if price >= best_ask:
 			print("HUGE ERROR - set_limit: ask price generated is >= book best ask")
-			print(f"HUGE ERROR cont. - set_limit: proposed price = {price}, book best price { order_book_poller.book_best_ask.price} ")
+			print(f"HUGE ERROR cont. - set_limit: proposed price = {price}, book best price {best_ask} ")
 			return 
+		print(f"\t\tset_limit: {order_book_poller.asks.depth(price)} base ahead of proposed ask over {len(order_book_poller.asks)} asks")
 		
+		with tracer.stage("gas_estimate"):
+			is_worth_gas = worth_gas(order_side, price, order_size, can_update)
+		if not is_worth_gas:
+			my_logger.gas_gated += 1
+			return
+
 		if is_not_best:
 			my_logger.not_best += 1
 		else: 
 			my_logger.no_offer += 1
 		print(f"\t\tset_limit: Limit ask created for {base_allowance} WETH at price of: {limit_ask_price}")
-		return {'pay_amt': pay_amt, 'pay_gem': list(token.poll_orderside().keys())[0], 'buy_amt': buy_amt, 'buy_gem': list(token.poll_orderside().keys())[1],
-				 'order_side':order_side, 'price':price, 'size':order_size }
+		return {'pay_amt': pay_amt, 'pay_gem': token.config.base.checksum, 'buy_amt': buy_amt, 'buy_gem': token.config.quote.checksum,
+				 'order_side':order_side, 'price':price, 'size':order_size, 'update_id': get_update_id(order_side, can_update) }
 		
 	elif order_side == OrderSide.BUY:
 		# Condition 0: set_limit is true and best_ask is not going to get me arbed
@@ -705,55 +1089,79 @@ def set_limit(order_side: OrderSide, order_quality_status: OrderComparison, set_
 		print(f"\t\t book bid = {order_book_poller.book_best_bid.price}, book buy_amt = {order_book_poller.book_best_bid.base_amt}, book pay_amt = {order_book_poller.book_best_bid.quote_amt}")
 		print(f"\t\t my proposed bid = {price}, book buy_amt = {buy_amt}, book pay_amt = {pay_amt}")
 
-		if price <= order_book_poller.book_best_bid.price:
+		if price <= best_bid:
 			print("HUGE ERROR - set_limit: bid price generated is <= book best bid")
-			print(f"HUGE ERROR cont. - set_limit: proposed price = {price}, book best price { order_book_poller.book_best_bid.price} ")
+			print(f"HUGE ERROR cont. - set_limit: proposed price = {price}, book best price {best_bid} ")
 			return 
+		print(f"\t\tset_limit: {order_book_poller.bids.depth(price)} base ahead of proposed bid over {len(order_book_poller.bids)} bids")
+
+		with tracer.stage("gas_estimate"):
+			is_worth_gas = worth_gas(order_side, price, order_size, can_update)
+		if not is_worth_gas:
+			my_logger.gas_gated += 1
+			return
 
 		if is_not_best:
 			my_logger.not_best += 1
 		else: 
 			my_logger.no_offer += 1
 		print(f"\t\tset_limit: Limit bid created for {base_allowance} WETH at price of: {limit_bid_price}")          
-		return {'pay_amt': pay_amt, 'pay_gem': list(token.poll_orderside().keys())[1], 'buy_amt': buy_amt, 'buy_gem': list(token.poll_orderside().keys())[0],
-				 'order_side':order_side , 'price':price, 'size':order_size}
+		return {'pay_amt': pay_amt, 'pay_gem': token.config.quote.checksum, 'buy_amt': buy_amt, 'buy_gem': token.config.base.checksum,
+				 'order_side':order_side , 'price':price, 'size':order_size, 'update_id': get_update_id(order_side, can_update)}
 
 # Main loop that triggers orders
+@tracer.trace_pass("order_loop")
 def order_loop() -> None:
 
 	# See what sides need updating
 	sell_check = check_best(OrderSide.SELL, size=base_allowance)
 	buy_check = check_best(OrderSide.BUY, size=base_allowance)
 
+	# Sides with offers still being mined are skipped, the book doesn't show them yet
+	sell_busy = side_in_flight(OrderSide.SELL)
+	buy_busy = side_in_flight(OrderSide.BUY)
+	if sell_busy or buy_busy:
+		print(f"\t\torder_loop: offers still in flight, skipping{' ask' if sell_busy else ''}{' bid' if buy_busy else ''}")
+
 	candidate_orders = []
 	if requires_action(sell_check) and buy_check == OrderComparison.BEST and args.min_spread:
-		print("\t\torder_loop: using set_closest on ask")
-		my_logger.best_offer += 1
-		my_logger.set_limit += 1
-		candidate_orders.append(set_limit(OrderSide.SELL, order_quality_status=sell_check, set_closest=True))
+		if not sell_busy:
+			print("\t\torder_loop: using set_closest on ask")
+			my_logger.best_offer += 1
+			my_logger.set_limit += 1
+			candidate_orders.append(set_limit(OrderSide.SELL, order_quality_status=sell_check, set_closest=True))
 	elif sell_check == OrderComparison.BEST and requires_action(buy_check) and args.min_spread:
-		print("\t\torder_loop: using set_closest on buy")
-		my_logger.best_offer += 1
-		my_logger.set_limit += 1
-		candidate_orders.append(set_limit(OrderSide.BUY, order_quality_status=buy_check, set_closest=True))
+		if not buy_busy:
+			print("\t\torder_loop: using set_closest on buy")
+			my_logger.best_offer += 1
+			my_logger.set_limit += 1
+			candidate_orders.append(set_limit(OrderSide.BUY, order_quality_status=buy_check, set_closest=True))
 	else:
 		print("\t\torder_loop: placing order on both sides")
-		candidate_orders.append(set_limit(OrderSide.BUY, order_quality_status=buy_check, set_closest=False))
-		candidate_orders.append(set_limit(OrderSide.SELL, order_quality_status=sell_check, set_closest=False))
+		if not buy_busy:
+			candidate_orders.append(set_limit(OrderSide.BUY, order_quality_status=buy_check, set_closest=False))
+		if not sell_busy:
+			candidate_orders.append(set_limit(OrderSide.SELL, order_quality_status=sell_check, set_closest=False))
 
 	# print(candidate_orders)
 	offer_pay_amts = []
 	offer_pay_gems = []
 	offer_buy_amts = []
 	offer_buy_gems = []
+	offer_orders = []
 
 	for order in candidate_orders:
 		if order is None:
 			continue
+		offer_orders.append(order)
 		offer_pay_amts.append(order['pay_amt'])
-		offer_pay_gems.append(Web3.to_checksum_address(order['pay_gem']))
+		offer_pay_gems.append(order['pay_gem'])
 		offer_buy_amts.append(order['buy_amt'])
-		offer_buy_gems.append(Web3.to_checksum_address(order['buy_gem']))
+		offer_buy_gems.append(order['buy_gem'])
+
+	# Time to first quote is to the first pass that sends offers or finds mine already best
+	if startup.first_quote is None and not args.backtest and (len(offer_pay_amts) > 0 or sell_check == buy_check == OrderComparison.BEST):
+		startup.quoted()
 
 	if len(offer_pay_amts) > 0:
 		print("\t\torder_loop: starting offer...")
@@ -762,32 +1170,43 @@ def order_loop() -> None:
 			print(f"HUGE ERROR cont. - order_loop: pay_amts[1] = {offer_pay_amts[1]} | buy_amts[0] = ({offer_buy_amts[0]})")
 			return
 
-		for i in range(len(offer_pay_amts)):
-			try:
-				print("\t\torder_loop: Placing Order.")
-				transaction_result = client.market.offer(pay_amt=offer_pay_amts[i],
-															pay_gem=offer_pay_gems[i],
-															buy_amt=offer_buy_amts[i],
-															buy_gem=offer_buy_gems[i])
-
-				if transaction_result.status == 1:
-					if token != TokenPairs.WETH_USDC_ARB:
-						my_logger.offers_gas_fees.append(Decimal(str(transaction_result.l1_fee*(.1**gas_erc20.decimal))) * gas_price.price)
-					print("\t\torder_loop: Offer Transaction Succeeded")
-					my_logger.offer_placed += 1
+		# Submit every side before waiting so they can share a batch transaction
+		pending = []
+		with tracer.stage("submit"):
+			for i in range(len(offer_pay_amts)):
+				start_time = time.time()
+				if pipeline is not None:
+					mark_in_flight(offer_orders[i]['order_side'], 1)
+				# Requote the existing not-best order in place
+				if offer_orders[i]['update_id'] is not None:
+					print(f"\t\torder_loop: Updating order {offer_orders[i]['update_id']} on {offer_orders[i]['order_side']}.")
+					pending.append((offer_orders[i], start_time, submit_update(offer_orders[i])))
 				else:
-					print("ERROR - order_loop: Offer Transaction Failed")
-					my_logger.offer_fail += 1
-					error_notifier.error_occured(transaction_result.transaction_hash, token)
-				print(f"order_loop offer transaction result: {transaction_result}")
-				print("\n\n\n ")
-
-			except Exception as e:
-				print(f"ERROR - order_loop: new offer error {e}")
-				my_logger.offer_fail += 1
+					print("\t\torder_loop: Placing Order.")
+					pending.append((offer_orders[i], start_time, submit_offer(pay_amt=offer_pay_amts[i],
+																		   pay_gem=offer_pay_gems[i],
+																		   buy_amt=offer_buy_amts[i],
+																		   buy_gem=offer_buy_gems[i])))
+
+		# With --pipeline the reciepts are recorded by the watcher when they arrive
+		for order, start_time, future in pending:
+			if order['update_id'] is not None:
+				on_result = on_update_result
+			else:
+				on_result = on_offer_result
+			if pipeline is not None:
+				future.add_done_callback(lambda done, on_result=on_result, start_time=start_time, order_side=order['order_side']: on_pipelined_result(done, on_result, start_time, order_side))
+			else:
+				with tracer.stage("receipt"):
+					on_result(future, start_time)
 	else:
 		print("\t\torder_loop: No new offer order was placed.")
 	short_summary()
+
+# Would-be transactions are attributed to the pass that decided them
+if args.shadow:
+	order_loop = client.shadow_pass("order_loop")(order_loop)
+	arb_checker = client.shadow_pass("arb_checker")(arb_checker)
 	
 def short_summary() -> None:
 	print(f"\t\tPrice of {token.sign_list()[0]}: {market_price.price}")
@@ -809,15 +1228,36 @@ def long_summary() -> None:
 	# Import data to logger object
 	my_logger.wallet_value = uniswapper.calculate_wallet_value()
 	my_logger.orders_value = order_book_poller.order_value
-	my_logger.uniswapper_losses = uniswapper.swap_losses
+	my_logger.uni_quote_hits = uniswapper.quote_cache.hits
+	my_logger.uni_quote_misses = uniswapper.quote_cache.misses
+	if batcher is not None:
+		my_logger.batched_actions = batcher.actions_batched
+		my_logger.batch_transactions = batcher.transactions_sent
+	if pipeline is not None:
+		my_logger.transactions_replaced = pipeline.replaced
+		my_logger.nonce_resyncs = pipeline.nonce_manager.resyncs
 
 	# Print Summary
 	print(my_logger)
+	if memory_monitor is not None:
+		print(memory_monitor.report())
+	print(breakers.report())
+	print(rate_limiter.report())
+	if journal is not None:
+		print(journal)
+	if args.shadow:
+		print(client.report())
 
 	# Write to logs
 	if my_logger.times_printed % 1 == 0:
 		with open(os.path.join("./logs",token.get_log_path()), 'a') as file:
 			file.write(str(my_logger))
+			if memory_monitor is not None:
+				file.write(memory_monitor.report())
+			file.write(breakers.report())
+			file.write(rate_limiter.report())
+			if args.shadow:
+				file.write(client.report())
 			file.write("\n\n\n")
 
 
@@ -825,23 +1265,132 @@ def long_summary() -> None:
 def main() -> None:
 	pass
 
+# Prometheus scrape endpoint, no RPC or subgraph calls
+@app.route('/metrics')
+def prometheus_metrics() -> Response:
+	return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Latest memory check
+@app.route('/memory')
+def memory_report() -> Response:
+	if memory_monitor is None:
+		return Response("memory monitoring is off, start with --memory\n", status=404, content_type="text/plain; charset=utf-8")
+	return Response(memory_monitor.report(), content_type="text/plain; charset=utf-8")
+
+# Per-stage averages and the slow-pass log
+@app.route('/trace')
+def trace_report() -> Response:
+	return Response(tracer.report(), content_type="text/plain; charset=utf-8")
+
+# Best price levels on each side and my queue position, ?levels=N
+@app.route('/book')
+def book_report() -> Response:
+	n = int(request.args.get("levels", 5))
+	out = ""
+	for name, levels, my_best in (("Asks", order_book_poller.asks, order_book_poller.my_best_ask), ("Bids", order_book_poller.bids, order_book_poller.my_best_bid)):
+		out += f"{name}: {len(levels)} offers\n"
+		cumulative = Decimal(0)
+		for price, size, offers in levels.levels(n):
+			cumulative += size
+			out += f"\t{price:.6f} || size: {size:.6f} || offers: {offers} || cumulative: {cumulative:.6f}\n"
+		position = levels.queue_position(my_best.limit_order_id) if my_best is not None else None
+		if position is not None:
+			out += f"\tMy best is behind {position[0]} offers and {position[1]:.6f} base\n"
+	return Response(out, content_type="text/plain; charset=utf-8")
+
+# Circuit breaker state per dependency
+@app.route('/breakers')
+def breaker_report() -> Response:
+	return Response(breakers.report(), content_type="text/plain; charset=utf-8")
+
+# Would-be transactions, fill rates and decision latency of --shadow
+@app.route('/shadow')
+def shadow_report() -> Response:
+	if not args.shadow:
+		return Response("shadow mode is off, start with --shadow\n", status=404, content_type="text/plain; charset=utf-8")
+	return Response(client.report(), content_type="text/plain; charset=utf-8")
+
+# Toggles the sampling profiler, stopping it returns the collapsed stacks
+@app.route('/profile/start')
+def profile_start() -> Response:
+	interval = float(request.args.get("interval", 0.005))
+	if not tracer.start_profile(interval=interval):
+		return Response("profiler already running\n", status=409, content_type="text/plain; charset=utf-8")
+	return Response(f"profiler started, sampling every {interval}s\n", content_type="text/plain; charset=utf-8")
+
+@app.route('/profile/stop')
+def profile_stop() -> Response:
+	return Response(tracer.stop_profile(), content_type="text/plain; charset=utf-8")
+
+# Replays --backtest events through the strategy and reports the logger metrics
+def run_backtest() -> None:
+	jobs = []
+	if args.no_arb:
+		jobs.append((15, arb_checker))
+	if rebalancer is not None:
+		jobs.append((args.rebalance, rebalancer.check))
+	backtest = Backtest(clock=sim_clock,
+						exchange=client,
+						market_price=market_price,
+						gas_price=gas_price,
+						order_loop=order_loop,
+						loop_time=60*args.loop_time,
+						jobs=jobs,
+						base_allowance=base_allowance)
+
+	print(f"Backtesting {token.sign()} on {args.backtest}, bot output in {args.backtest_log}")
+	stdout = sys.stdout
+	with open(args.backtest_log, 'w') as log:
+		sys.stdout = log
+		try:
+			backtest.run(load_events(args.backtest, token, base_allowance))
+		finally:
+			sys.stdout = stdout
+
+	if market_price.price is not None:
+		my_logger.wallet_value = uniswapper.calculate_wallet_value()
+	# On replay time so windowed --store totals cover the replay
+	sim_clock.install()
+	print(my_logger)
+	sim_clock.uninstall()
+	print(backtest.report())
+
+# True once the market and gas prices are in
+def prepare_price() -> bool:
+	update_market_price()
+	return market_price.price is not None and gas_price.price is not None
+
 if __name__ == '__main__':
+	if args.backtest:
+		run_backtest()
+		sys.exit(0)
+
 	# Run the Flask app
+	from apscheduler.schedulers.background import BackgroundScheduler
 	scheduler = BackgroundScheduler()
 
 	print(f"Starting spread converted is {convert_spread_ints(start_spread_buffer,size=base_allowance)}")
 
+	# Pick up where the last run stopped before any new events are consumed
+	if journal is not None:
+		recover_journal()
+		startup.mark("journal")
+
 	# Listen for events
 	thread = threading.Thread(target=rubicon_listener, args=(my_queue,))
 	thread.daemon = True  # Set the thread as a daemon so it doesn't block program termination
 	thread.start()
 
-	# updates price of eth
-	update_market_price()
+	# Prices, the first book and the token contracts load at once, the first
+	# order_loop waits until they are in rather than for a fixed time
+	lazy_erc20s = {symbol: erc20 for symbol, erc20 in erc20s.items() if isinstance(erc20, LazyERC20)}
+	startup.requires("price", "book", *lazy_erc20s)
+	startup.prepare("price", prepare_price)
+	startup.prepare("book", order_book_poller.poll_book)
+	for symbol, erc20 in lazy_erc20s.items():
+		startup.prepare(symbol, erc20.warm)
 	scheduler.add_job(func=update_market_price, trigger="interval", seconds=16)
-
-	# Wait for global variables to populate
-	time.sleep(2)
+	startup.wait(timeout=30)
 
 	order_loop()
 	scheduler.add_job(func=order_loop, trigger="interval", seconds=60*args.loop_time)
@@ -852,12 +1401,26 @@ if __name__ == '__main__':
 	if args.no_arb:
 		scheduler.add_job(func=arb_checker, trigger="interval", seconds=15)
 
+	if rebalancer is not None:
+		scheduler.add_job(func=rebalancer.check, trigger="interval", seconds=args.rebalance)
+
+	if memory_monitor is not None:
+		memory_monitor.start()
+		scheduler.add_job(func=memory_monitor.check, trigger="interval", seconds=60*args.memory)
+
 	long_summary()
+	print(startup.report())
 	scheduler.add_job(func=long_summary, trigger="interval", seconds=60*30)
 
+	if journal is not None:
+		scheduler.add_job(func=take_snapshot, trigger="interval", seconds=args.snapshot_interval)
+
 	scheduler.start()
 
 	# Shut down the scheduler when exiting the app
 	atexit.register(lambda: scheduler.shutdown())
+	if journal is not None:
+		# Runs before the scheduler shutdown, a clean restart replays nothing
+		atexit.register(take_snapshot)
 
 	app.run(port=token_port)
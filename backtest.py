@@ -0,0 +1,703 @@
+import os, sys, json, math, time, heapq, random, itertools, threading
+from decimal import Decimal
+from typing import Callable, Iterator
+
+from rubi import OrderSide, OrderType, OrderEvent
+
+from pairs import TokenPairs, pair_configs
+from events import OrderBookRequester
+from gas import default_gas_used
+from utils import ErrorNotification
+
+# Decimals of every token the bot trades
+token_decimals = {"ETH": 18, **{token.symbol: token.decimals for pair in pair_configs.values() for token in [pair.base, pair.quote]}}
+
+# Wallet used when WALLET isn't set
+sim_wallet = "0x00000000000000000000000000000000000b0b00"
+other_maker = "0x0000000000000000000000000000000000000001"
+
+# Simulated chain costs
+sim_l1_fee = 5 * 10**13         # wei of l1 fee charged per transaction
+sim_l1_base_fee = 2 * 10**10    # wei, what the l1 fee oracle returns
+sim_l2_gas_price = 10**6        # wei
+event_delay = 2                 # seconds for an orderbook event to reach the listener
+swap_delay = 4                  # seconds for a uniswap swap to be mined
+
+# The gas token's price for pairs not priced in ETH, starting prices are each pair's reference_price
+synthetic_gas_price = 1800
+
+real_time = time.time
+real_sleep = time.sleep
+
+# Simulated time. Once installed time.time and time.sleep read and advance this
+# clock, so cancel_old waits, poll retries and summaries all run on replay time.
+class SimClock:
+    def __init__(self, now: float = 0):
+        self.now = now
+        self.jobs = []
+        self.sequence = itertools.count()
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+    def install(self) -> None:
+        time.time = self.time
+        time.sleep = self.sleep
+
+    def uninstall(self) -> None:
+        time.time = real_time
+        time.sleep = real_sleep
+
+    def call_later(self, delay: float, func: Callable, *args) -> None:
+        heapq.heappush(self.jobs, (self.now + delay, next(self.sequence), func, args))
+
+    # Runs every job due at or before until, in time order
+    def run_until(self, until: float) -> None:
+        while self.jobs and self.jobs[0][0] <= until:
+            due, _, func, args = heapq.heappop(self.jobs)
+            self.now = max(self.now, due)
+            func(*args)
+        self.now = max(self.now, until)
+
+# Real time counterpart of SimClock for running the simulated exchange live
+class RealClock:
+    @property
+    def now(self) -> float:
+        return time.time()
+
+    def time(self) -> float:
+        return time.time()
+
+    def call_later(self, delay: float, func: Callable, *args) -> None:
+        timer = threading.Timer(delay, func, args)
+        timer.daemon = True
+        timer.start()
+
+##### Simulated chain #####
+
+class SimReceipt:
+    def __init__(self, status: int, transaction_hash: str, gas_used: int, l1_fee: int):
+        self.status = status
+        self.transaction_hash = transaction_hash
+        self.gas_used = gas_used
+        self.l1_fee = l1_fee
+
+    def __repr__(self):
+        return f"SimReceipt(status={self.status}, transaction_hash={self.transaction_hash})"
+
+# Order event in the shape the listener hands to on_order
+class SimOrderEvent(OrderEvent):
+    def __init__(self, order_type: OrderType, pair_name: str, order_side: OrderSide, price: Decimal, size: Decimal,
+                 limit_order_id: str, limit_order_owner: str, market_order_owner: str = None):
+        self.created = time.time()
+        self.order_type = order_type
+        self.pair_name = pair_name
+        self.order_side = order_side
+        self.price = price
+        self.size = size
+        self.limit_order_id = limit_order_id
+        self.limit_order_owner = limit_order_owner
+        self.market_order_owner = market_order_owner
+
+    def __repr__(self):
+        return f"SimOrderEvent({self.order_type}, {self.order_side}, price={self.price}, size={self.size})"
+
+class SimOrder:
+    def __init__(self, order_id: int, side: OrderSide, pay_amt: int, buy_amt: int, maker: str):
+        self.order_id = order_id
+        self.side = side
+        self.pay_amt = pay_amt
+        self.buy_amt = buy_amt
+        self.paid_amt = 0
+        self.bought_amt = 0
+        self.maker = maker
+
+    # Base left to trade, in ints
+    def remaining_base(self) -> int:
+        if self.side == OrderSide.SELL:
+            return self.pay_amt - self.paid_amt
+        return self.buy_amt - self.bought_amt
+
+class SimERC20:
+    def __init__(self, exchange, symbol: str):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.decimal = token_decimals[symbol]
+
+    def balance_of(self, account: str) -> int:
+        if self.exchange.read_latency:
+            time.sleep(self.exchange.read_latency)
+        return self.exchange.balances[self.symbol]
+
+    def to_decimal(self, number: int) -> Decimal:
+        return Decimal(number) / Decimal(10**self.decimal)
+
+    def to_integer(self, number: Decimal) -> int:
+        return int(number * Decimal(10**self.decimal))
+
+# Just enough of web3 for GasEstimator
+class SimEth:
+    def __init__(self, clock: SimClock):
+        self.clock = clock
+        self.gas_price = sim_l2_gas_price
+
+    @property
+    def block_number(self) -> int:
+        return int(self.clock.now // 2)
+
+    def contract(self, address, abi):
+        return SimOracle()
+
+class SimOracle:
+    def __init__(self):
+        self.functions = self
+
+    def l1BaseFee(self):
+        return self
+
+    def call(self) -> int:
+        return sim_l1_base_fee
+
+class SimW3:
+    def __init__(self, clock: SimClock):
+        self.eth = SimEth(clock)
+
+class SimNetwork:
+    def __init__(self, clock: SimClock):
+        self.w3 = SimW3(clock)
+
+# Stands in for the rubi Client and the Rubicon market. Holds the other makers'
+# book from the last snapshot plus my orders, escrows funds like the market
+# contract does, charges gas per transaction and matches takes against the book.
+# Events are delivered to on_event event_delay seconds later, like the listener.
+# latency and read_latency (seconds) stand in for the node's round trips.
+class SimExchange:
+    def __init__(self, clock: SimClock, token: TokenPairs, wallet: str, on_event: Callable = None,
+                 latency: float = 0, read_latency: float = 0, on_transaction: Callable = None):
+        self.clock = clock
+        self.token = token
+        self.wallet = wallet.lower()
+        self.on_event = on_event
+        self.network = SimNetwork(clock)
+        self.market = self
+        self.lock = threading.RLock()
+
+        self.latency = latency
+        self.read_latency = read_latency
+        self.event_delay = event_delay
+        self.on_transaction = on_transaction # called with the action as each transaction is sent
+
+        self.base, self.quote = token.config.base.symbol, token.config.quote.symbol
+        self.base_gem, self.quote_gem = [address.lower() for address in token.config.gems]
+        self.gas = token.network.gas_token
+        self.balances = {self.base: 0, self.quote: 0, self.gas: 0}
+
+        self.others = {}    # order_id: SimOrder from the last book snapshot
+        self.mine = {}      # order_id: SimOrder
+        self.next_id = itertools.count(1)
+
+        # Stats
+        self.transactions = {}
+        self.failed_transactions = 0
+        self.my_fills = 0
+        self.takes = 0
+
+    def erc20(self, symbol: str) -> SimERC20:
+        return SimERC20(self, symbol)
+
+    def fund(self, base: Decimal, quote: Decimal, gas: Decimal) -> None:
+        self.balances[self.base] += int(base * Decimal(10**token_decimals[self.base]))
+        self.balances[self.quote] += int(quote * Decimal(10**token_decimals[self.quote]))
+        self.balances[self.gas] += int(gas * Decimal(10**token_decimals[self.gas]))
+
+    def price(self, order: SimOrder) -> Decimal:
+        base_decimal = Decimal(10**token_decimals[self.base])
+        quote_decimal = Decimal(10**token_decimals[self.quote])
+        if order.side == OrderSide.SELL:
+            return (Decimal(order.buy_amt) / quote_decimal) / (Decimal(order.pay_amt) / base_decimal)
+        return (Decimal(order.pay_amt) / quote_decimal) / (Decimal(order.buy_amt) / base_decimal)
+
+    def emit(self, order_type: OrderType, order: SimOrder, size: Decimal, market_order_owner: str = None) -> None:
+        if self.on_event is None:
+            return
+        event = SimOrderEvent(order_type=order_type,
+                              pair_name=self.token.sign(),
+                              order_side=order.side,
+                              price=self.price(order),
+                              size=size,
+                              limit_order_id=hex(order.order_id),
+                              limit_order_owner=os.getenv("WALLET") if order.maker == self.wallet else order.maker,
+                              market_order_owner=market_order_owner)
+        self.clock.call_later(self.event_delay, self.on_event, event)
+
+    ##### Transactions #####
+
+    def _send(self, action: str) -> None:
+        if self.on_transaction is not None:
+            self.on_transaction(action)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _receipt(self, action: str, status: int) -> SimReceipt:
+        self.balances[self.gas] -= sim_l1_fee
+        self.transactions[action] = self.transactions.get(action, 0) + 1
+        if status != 1:
+            self.failed_transactions += 1
+        return SimReceipt(status=status,
+                          transaction_hash=f"0x{sum(self.transactions.values()):064x}",
+                          gas_used=default_gas_used[action],
+                          l1_fee=sim_l1_fee)
+
+    def _open(self, pay_amt: int, pay_gem: str, buy_amt: int) -> bool:
+        side = OrderSide.SELL if pay_gem.lower() == self.base_gem else OrderSide.BUY
+        pay_symbol = self.base if side == OrderSide.SELL else self.quote
+        if self.balances[pay_symbol] < pay_amt:
+            return False
+        self.balances[pay_symbol] -= pay_amt
+        order = SimOrder(next(self.next_id), side, pay_amt, buy_amt, self.wallet)
+        self.mine[order.order_id] = order
+        self.emit(OrderType.LIMIT, order, Decimal(order.remaining_base()) / Decimal(10**token_decimals[self.base]))
+        return True
+
+    def _close(self, order_id: int) -> bool:
+        order = self.mine.pop(order_id, None)
+        if order is None:
+            return False
+        pay_symbol = self.base if order.side == OrderSide.SELL else self.quote
+        self.balances[pay_symbol] += order.pay_amt - order.paid_amt
+        self.emit(OrderType.CANCEL, order, Decimal(order.remaining_base()) / Decimal(10**token_decimals[self.base]))
+        return True
+
+    def offer(self, pay_amt: int, pay_gem: str, buy_amt: int, buy_gem: str, nonce: int = None, **fees) -> SimReceipt:
+        self._send("offer")
+        with self.lock:
+            return self._receipt("offer", 1 if self._open(pay_amt, pay_gem, buy_amt) else 0)
+
+    def batch_offer(self, pay_amts: list, pay_gems: list, buy_amts: list, buy_gems: list, nonce: int = None, **fees) -> SimReceipt:
+        self._send("offer")
+        with self.lock:
+            opened = [self._open(pay_amt, pay_gem, buy_amt) for pay_amt, pay_gem, buy_amt in zip(pay_amts, pay_gems, buy_amts)]
+            return self._receipt("offer", 1 if all(opened) else 0)
+
+    def batch_cancel_limit_orders(self, transaction) -> SimReceipt:
+        self._send("batch_cancel")
+        with self.lock:
+            closed = [self._close(order.order_id) for order in transaction.orders]
+            return self._receipt("batch_cancel", 1 if all(closed) else 0)
+
+    def batch_update_limit_orders(self, transaction) -> SimReceipt:
+        self._send("update")
+        base_decimal = Decimal(10**token_decimals[self.base])
+        quote_decimal = Decimal(10**token_decimals[self.quote])
+        status = 1
+        with self.lock:
+            for update in transaction.orders:
+                if not self._close(update.order_id):
+                    status = 0
+                    continue
+                base_amt = int(update.size * base_decimal)
+                quote_amt = int(update.size * update.price * quote_decimal)
+                if update.order_side == OrderSide.SELL:
+                    opened = self._open(base_amt, self.base_gem, quote_amt)
+                else:
+                    opened = self._open(quote_amt, self.quote_gem, base_amt)
+                if not opened:
+                    status = 0
+            return self._receipt("update", status)
+
+    ##### Market #####
+
+    # Replaces the other makers' orders with a snapshot of (price, size) levels
+    def set_book(self, asks: list, bids: list) -> None:
+        with self.lock:
+            base_decimal = Decimal(10**token_decimals[self.base])
+            quote_decimal = Decimal(10**token_decimals[self.quote])
+            self.others = {}
+            for side, levels in [(OrderSide.SELL, asks), (OrderSide.BUY, bids)]:
+                for price, size in levels:
+                    base_amt = int(Decimal(size) * base_decimal)
+                    quote_amt = int(Decimal(size) * Decimal(price) * quote_decimal)
+                    if base_amt <= 0 or quote_amt <= 0:
+                        continue
+                    if side == OrderSide.SELL:
+                        order = SimOrder(next(self.next_id), side, base_amt, quote_amt, other_maker)
+                    else:
+                        order = SimOrder(next(self.next_id), side, quote_amt, base_amt, other_maker)
+                    self.others[order.order_id] = order
+
+    # A taker hits orders on side priced at or better than price, up to size in base.
+    # Other makers fill first at the same price since they were there first.
+    def take(self, side: OrderSide, price: Decimal, size: Decimal) -> None:
+        with self.lock:
+            self.takes += 1
+            base_decimal = Decimal(10**token_decimals[self.base])
+            remaining = int(size * base_decimal)
+
+            candidates = []
+            for order in list(self.others.values()) + list(self.mine.values()):
+                order_price = self.price(order)
+                if order.side != side:
+                    continue
+                if side == OrderSide.SELL and order_price <= price:
+                    candidates.append((order_price, order.maker == self.wallet, order.order_id, order))
+                elif side == OrderSide.BUY and order_price >= price:
+                    candidates.append((-order_price, order.maker == self.wallet, order.order_id, order))
+            candidates.sort(key=lambda candidate: candidate[:3])
+
+            for _, is_mine, _, order in candidates:
+                if remaining <= 0:
+                    break
+                base_amt = min(order.remaining_base(), remaining)
+                remaining -= base_amt
+                if order.side == OrderSide.SELL:
+                    quote_amt = base_amt * order.buy_amt // order.pay_amt
+                    order.paid_amt += base_amt
+                    order.bought_amt += quote_amt
+                    bought_symbol = self.quote
+                else:
+                    quote_amt = base_amt * order.pay_amt // order.buy_amt
+                    order.bought_amt += base_amt
+                    order.paid_amt += quote_amt
+                    bought_symbol = self.base
+
+                if not is_mine:
+                    if order.remaining_base() <= 0:
+                        del self.others[order.order_id]
+                    continue
+
+                self.my_fills += 1
+                self.balances[bought_symbol] += quote_amt if bought_symbol == self.quote else base_amt
+                self.emit(OrderType.LIMIT_TAKEN, order, Decimal(base_amt) / base_decimal, market_order_owner=other_maker)
+                if order.remaining_base() <= 0:
+                    del self.mine[order.order_id]
+                    self.emit(OrderType.LIMIT_DELETED, order, Decimal(0), market_order_owner=other_maker)
+
+    # Another maker places an order, the listener sees it as a LIMIT event
+    def place_other(self, side: OrderSide, price: Decimal, size: Decimal) -> int:
+        base_decimal = Decimal(10**token_decimals[self.base])
+        quote_decimal = Decimal(10**token_decimals[self.quote])
+        base_amt = int(size * base_decimal)
+        quote_amt = int(size * price * quote_decimal)
+        with self.lock:
+            if side == OrderSide.SELL:
+                order = SimOrder(next(self.next_id), side, base_amt, quote_amt, other_maker)
+            else:
+                order = SimOrder(next(self.next_id), side, quote_amt, base_amt, other_maker)
+            self.others[order.order_id] = order
+            self.emit(OrderType.LIMIT, order, size)
+            return order.order_id
+
+    # Another maker cancels one of its orders
+    def cancel_other(self, order_id: int) -> bool:
+        with self.lock:
+            order = self.others.pop(order_id, None)
+            if order is None:
+                return False
+            self.emit(OrderType.CANCEL, order, Decimal(order.remaining_base()) / Decimal(10**token_decimals[self.base]))
+            return True
+
+    # Open offers in the subgraph's response format
+    def book_data(self) -> dict:
+        with self.lock:
+            asks, bids = [], []
+            for order in list(self.others.values()) + list(self.mine.values()):
+                pay_gem, buy_gem = (self.base_gem, self.quote_gem) if order.side == OrderSide.SELL else (self.quote_gem, self.base_gem)
+                offer = {"id": hex(order.order_id),
+                         "pay_gem": pay_gem,
+                         "buy_gem": buy_gem,
+                         "pay_amt": str(order.pay_amt),
+                         "buy_amt": str(order.buy_amt),
+                         "paid_amt": str(order.paid_amt),
+                         "bought_amt": str(order.bought_amt),
+                         "price": str(self.price(order)),
+                         "maker": {"id": order.maker}}
+                (asks if order.side == OrderSide.SELL else bids).append(offer)
+            return {"data": {"asks": asks, "bids": bids}}
+
+# OrderBookRequester reading the simulated book instead of the subgraph
+class SimOrderBookRequester(OrderBookRequester):
+    def __init__(self, exchange: SimExchange, token: TokenPairs, base_erc20: SimERC20, quote_erc20: SimERC20):
+        super().__init__(client=exchange, token=token, base_erc20=base_erc20, quote_erc20=quote_erc20)
+        self.exchange = exchange
+
+    def fetch_book(self) -> dict:
+        return self.exchange.book_data()
+
+# Uniswapper stand-in. Swaps fill at the market price less the pool fee and a
+# fixed price impact, and are mined swap_delay seconds later.
+class SimUniswapper:
+    def __init__(self, exchange: SimExchange, pair: TokenPairs, baseERC20: SimERC20, quoteERC20: SimERC20, gasERC20: SimERC20,
+                 market_price, gas_price, beta: Decimal, logger, on_confirmed: Callable = None, impact: Decimal = Decimal("0.0005")):
+        self.exchange = exchange
+        self.pair = pair
+        self.baseERC20 = baseERC20
+        self.quoteERC20 = quoteERC20
+        self.gasERC20 = gasERC20
+        self.market_price = market_price
+        self.gas_price = gas_price
+        self.beta = beta
+        self.logger = logger
+        self.on_confirmed = on_confirmed
+        self.cost = Decimal(pair.config.uniswap_fee or 500) / Decimal(10**6) + impact
+        self.pending = False
+
+        # Read by long_summary
+        self.quote_cache = self
+        self.hits = 0
+        self.misses = 0
+
+    def swap_pending(self) -> bool:
+        return self.pending
+
+    def swap(self, side: OrderSide, trade_amt: int, base_allowance: Decimal, set_closest: bool, next_fee: bool = False, grow: bool = True) -> int:
+        if self.pending:
+            return 0
+        price = self.market_price.price
+        # Same direction as Uniswapper.swap, side is the rubicon side that needs funds
+        if side == OrderSide.BUY:
+            erc20_in, erc20_out = self.baseERC20, self.quoteERC20
+            amt = int(base_allowance * Decimal(10 ** self.baseERC20.decimal) * Decimal("1.05"))
+        else:
+            erc20_in, erc20_out = self.quoteERC20, self.baseERC20
+            amt = int(price * base_allowance * Decimal(10 ** self.quoteERC20.decimal) * Decimal("1.05"))
+
+        reserve = 0 if set_closest else amt
+        if self.exchange.balances[erc20_in.symbol] < trade_amt + reserve:
+            return 0
+
+        if side == OrderSide.BUY:
+            output = erc20_out.to_integer(erc20_in.to_decimal(trade_amt) * price * (1 - self.cost))
+            loss = erc20_in.to_decimal(trade_amt) * price - erc20_out.to_decimal(output)
+        else:
+            output = erc20_out.to_integer(erc20_in.to_decimal(trade_amt) / price * (1 - self.cost))
+            loss = erc20_in.to_decimal(trade_amt) - erc20_out.to_decimal(output) * price
+
+        if self.cost > self.beta:
+            self.logger.expected_uni_losses_not_taken.append(loss)
+            return -2
+
+        self.logger.expected_uni_losses_taken.append(loss)
+        self.exchange.balances[erc20_in.symbol] -= trade_amt
+        self.exchange.balances[self.exchange.gas] -= sim_l1_fee
+        self.exchange.transactions["swap"] = self.exchange.transactions.get("swap", 0) + 1
+        self.pending = True
+        self.exchange.clock.call_later(swap_delay, self.confirm, erc20_out.symbol, output, loss)
+        return 1
+
+    def confirm(self, symbol: str, output: int, loss: Decimal) -> None:
+        self.exchange.balances[symbol] += output
+        self.pending = False
+        gas = self.gasERC20.to_decimal(sim_l1_fee) * (self.gas_price.price or 0)
+        self.logger.record_swap_loss(loss + gas)
+        if self.on_confirmed is not None:
+            self.on_confirmed({"status": 1, "gasUsed": default_gas_used["swap"], "l1Fee": sim_l1_fee})
+
+    def calculate_wallet_value(self) -> Decimal:
+        base_value = self.baseERC20.to_decimal(number=self.baseERC20.balance_of(account=os.getenv("WALLET")))*self.market_price.price
+        quote_value = self.quoteERC20.to_decimal(number=self.quoteERC20.balance_of(account=os.getenv("WALLET")))
+        if not self.pair.network.l1_fees:
+            gas_value = 0
+        else:
+            gas_value = self.gasERC20.to_decimal(number=self.gasERC20.balance_of(account=os.getenv("WALLET")))*self.gas_price.price
+        return base_value + quote_value + gas_value
+
+# Notifier that prints instead of emailing
+class SimNotification(ErrorNotification):
+    def send_notification(self, subject: str, message: str, final=False) -> None:
+        print(f"\t\tSimNotification: {subject} || {message}")
+
+##### Replay #####
+
+# Feeds price, book and take events through the strategy on simulated time.
+# order_loop and jobs, a list of (seconds, function), run on the same intervals
+# as the live scheduler.
+class Backtest:
+    def __init__(self, clock: SimClock, exchange: SimExchange, market_price, gas_price,
+                 order_loop: Callable, loop_time: float = 60, jobs: list = [],
+                 start_orders: Decimal = Decimal("10"), base_allowance: Decimal = Decimal("1"), start_gas: Decimal = Decimal("0.05")):
+        self.clock = clock
+        self.exchange = exchange
+        self.market_price = market_price
+        self.gas_price = gas_price
+        self.order_loop = order_loop
+        self.loop_time = loop_time
+        self.jobs = jobs
+        self.start_orders = start_orders        # orders worth of base and quote in the starting wallet
+        self.base_allowance = base_allowance
+        self.start_gas = start_gas              # in the gas token
+
+        self.started = False
+        self.events = 0
+        self.loops = 0
+        self.start_balances = None
+        self.start_ts = None
+        self.wall_time = 0
+
+    def every(self, interval: float, func: Callable) -> None:
+        def run():
+            func()
+            self.clock.call_later(interval, run)
+        self.clock.call_later(interval, run)
+
+    def counted_order_loop(self) -> None:
+        self.loops += 1
+        self.order_loop()
+
+    def start(self) -> None:
+        self.started = True
+        base = self.start_orders * self.base_allowance
+        self.exchange.fund(base=base, quote=base * self.market_price.price, gas=self.start_gas)
+        self.start_balances = dict(self.exchange.balances)
+        self.counted_order_loop()
+        self.every(self.loop_time, self.counted_order_loop)
+        for interval, func in self.jobs:
+            self.every(interval, func)
+
+    def apply(self, event: dict) -> None:
+        match event["type"]:
+            case "price":
+                self.market_price.price = Decimal(str(event["price"]))
+                if "gas_price" in event and self.gas_price is not self.market_price:
+                    self.gas_price.price = Decimal(str(event["gas_price"]))
+            case "book":
+                self.exchange.set_book(asks=event["asks"], bids=event["bids"])
+            case "take":
+                self.exchange.take(side=OrderSide[event["side"]], price=Decimal(str(event["price"])), size=Decimal(str(event["size"])))
+
+    def run(self, events: Iterator[dict]) -> None:
+        wall_start = real_time()
+        self.clock.install()
+        try:
+            for event in events:
+                if self.start_ts is None:
+                    self.start_ts = event["ts"]
+                    self.clock.now = event["ts"]
+                self.clock.run_until(event["ts"])
+                self.apply(event)
+                self.events += 1
+                # Start once there is a price and a book, like waiting for globals at startup
+                if not self.started and self.market_price.price is not None and self.gas_price.price is not None and len(self.exchange.others) > 0:
+                    self.start()
+            # Let anything already in flight finish
+            self.clock.run_until(self.clock.now + max(event_delay, swap_delay))
+        finally:
+            self.clock.uninstall()
+            self.wall_time = real_time() - wall_start
+
+    # Value of balances at the current prices
+    def value(self, balances: dict) -> Decimal:
+        exchange = self.exchange
+        value = Decimal(balances[exchange.base]) / Decimal(10**token_decimals[exchange.base]) * self.market_price.price
+        value += Decimal(balances[exchange.quote]) / Decimal(10**token_decimals[exchange.quote])
+        if exchange.gas not in [exchange.base, exchange.quote]:
+            value += Decimal(balances[exchange.gas]) / Decimal(10**token_decimals[exchange.gas]) * self.gas_price.price
+        return value
+
+    def report(self) -> str:
+        if self.start_balances is None:
+            return "Backtest: never started, no price or book events\n"
+        exchange = self.exchange
+        # Funds in open orders are still mine
+        balances = dict(exchange.balances)
+        for order in exchange.mine.values():
+            pay_symbol = exchange.base if order.side == OrderSide.SELL else exchange.quote
+            balances[pay_symbol] += order.pay_amt - order.paid_amt
+        end_value = self.value(balances)
+        hold_value = self.value(self.start_balances)
+        simulated = self.clock.now - self.start_ts
+
+        lines = ["Backtest",
+                 f"\tSimulated: {simulated / 3600:.1f} hours in {self.wall_time:.1f}s ({simulated / max(self.wall_time, 1e-9):.0f}x real time)",
+                 f"\tEvents: {self.events} || order loops: {self.loops} || takes: {exchange.takes} || my fills: {exchange.my_fills}",
+                 f"\tTransactions: {exchange.transactions} || failed: {exchange.failed_transactions}",
+                 f"\tWallet value incl. open orders: {end_value:.2f} || holding the starting wallet: {hold_value:.2f} || difference: {end_value - hold_value:.2f}"]
+        return "\n".join(lines) + "\n"
+
+# Events from a .jsonl file written by BookRecorder, or synthetic:HOURS[:SEED]
+def load_events(source: str, token: TokenPairs, base_allowance: Decimal) -> Iterator[dict]:
+    if source.startswith("synthetic:"):
+        parts = source.split(":")
+        return synthetic_events(token=token, hours=float(parts[1]), size=float(base_allowance), seed=int(parts[2]) if len(parts) > 2 else 0)
+    return read_events(source)
+
+def read_events(path: str) -> Iterator[dict]:
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+# Random walk price with a noisy book around it and randomly sized takes
+def synthetic_events(token: TokenPairs, hours: float, size: float, seed: int = 0,
+                     volatility: float = 0.6, half_spread: float = 0.001, takes_per_hour: float = 30,
+                     start_ts: float = 1672531200) -> Iterator[dict]:
+    rng = random.Random(seed)
+    price = float(token.config.reference_price)
+    tick = 16 # seconds, the live price update interval
+    sigma = volatility * math.sqrt(tick / (365 * 24 * 3600))
+    take_chance = takes_per_hour * tick / 3600
+    gas_price = None if token.config.gas_price_pair == token.name else synthetic_gas_price
+
+    ts = start_ts
+    for step in range(int(hours * 3600 / tick)):
+        ts += tick
+        price *= math.exp(rng.gauss(0, sigma))
+        event = {"type": "price", "ts": ts, "price": f"{price:.6f}"}
+        if gas_price is not None:
+            event["gas_price"] = gas_price
+        yield event
+
+        if step % 2 == 0:
+            asks = [[f"{price * (1 + half_spread * (level + rng.random())):.6f}", f"{size * (1 + 4 * rng.random()):.6f}"] for level in range(3)]
+            bids = [[f"{price * (1 - half_spread * (level + rng.random())):.6f}", f"{size * (1 + 4 * rng.random()):.6f}"] for level in range(3)]
+            yield {"type": "book", "ts": ts + 1, "asks": asks, "bids": bids}
+
+        if rng.random() < take_chance:
+            side = rng.choice(["BUY", "SELL"])
+            reach = half_spread * 3 * rng.random()
+            take_price = price * (1 + reach) if side == "SELL" else price * (1 - reach)
+            yield {"type": "take", "ts": ts + 2, "side": side, "price": f"{take_price:.6f}", "size": f"{size * 2 * rng.expovariate(1):.6f}"}
+
+##### Recording #####
+
+# Appends live prices, other makers' books and other wallets' takes as .jsonl for --backtest
+class BookRecorder:
+    def __init__(self, path: str, wallet: str):
+        self.path = path
+        self.wallet = wallet.lower()
+        self.file = open(path, 'a', buffering=1)
+
+    def write(self, event: dict) -> None:
+        event["ts"] = time.time()
+        self.file.write(json.dumps(event) + "\n")
+
+    def price(self, price: Decimal, gas_price: Decimal) -> None:
+        if price is None:
+            return
+        event = {"type": "price", "price": str(price)}
+        if gas_price is not None:
+            event["gas_price"] = str(gas_price)
+        self.write(event)
+
+    def book(self, data: dict, requester: OrderBookRequester) -> None:
+        base_decimal = Decimal(10**requester.base_erc20.decimal)
+        quote_decimal = Decimal(10**requester.quote_erc20.decimal)
+        asks, bids = [], []
+        for ask in data['data']['asks']:
+            if ask['maker']['id'] == self.wallet:
+                continue
+            price = (Decimal(ask['buy_amt']) / quote_decimal) / (Decimal(ask['pay_amt']) / base_decimal)
+            asks.append([str(price), str((Decimal(ask['pay_amt']) - Decimal(ask['paid_amt'])) / base_decimal)])
+        for bid in data['data']['bids']:
+            if bid['maker']['id'] == self.wallet:
+                continue
+            price = (Decimal(bid['pay_amt']) / quote_decimal) / (Decimal(bid['buy_amt']) / base_decimal)
+            bids.append([str(price), str((Decimal(bid['buy_amt']) - Decimal(bid['bought_amt'])) / base_decimal)])
+        self.write({"type": "book", "asks": asks, "bids": bids})
+
+    def take(self, order) -> None:
+        if order.order_type != OrderType.LIMIT_TAKEN or str(order.market_order_owner).lower() == self.wallet:
+            return
+        self.write({"type": "take", "side": order.order_side.name, "price": str(order.price), "size": str(order.size)})
@@ -0,0 +1,131 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+from rubi import Transaction
+
+from breaker import breakers
+
+# Result handed back to each caller. batch_size is how many actions shared the
+# transaction so gas can be split between them.
+class BatchResult:
+    def __init__(self, receipt, batch_size: int):
+        self.receipt = receipt
+        self.batch_size = batch_size
+
+# Runs a transaction immediately and wraps it in an already completed future.
+# send is called as send(nonce, fees) like a TransactionPipeline send.
+def completed_future(send: Callable) -> Future:
+    future = Future()
+    try:
+        future.set_result(BatchResult(send(None, {}), 1))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+# Collects cancels, updates and offers over a short window and sends them as
+# one batch transaction per action type per market. When a pipeline is given
+# the batch transactions are submitted through it without waiting.
+class TransactionBatcher:
+    def __init__(self, client, window: float, pipeline=None):
+        self.client = client
+        self.window = window # seconds
+        self.pipeline = pipeline
+
+        self.lock = threading.Lock()
+        self.timer = None
+        self.pending = {}
+
+        # Stats
+        self.actions_batched = 0
+        self.transactions_sent = 0
+
+    def cancel(self, pair_name: str, orders: list) -> Future:
+        return self._add(pair_name, "cancel", orders)
+
+    def update(self, pair_name: str, orders: list) -> Future:
+        return self._add(pair_name, "update", orders)
+
+    def offer(self, pair_name: str, pay_amt: int, pay_gem: str, buy_amt: int, buy_gem: str) -> Future:
+        return self._add(pair_name, "offer", [(pay_amt, pay_gem, buy_amt, buy_gem)])
+
+    def _add(self, pair_name: str, kind: str, items: list) -> Future:
+        future = Future()
+        with self.lock:
+            market = self.pending.setdefault(pair_name, {"cancel": [], "update": [], "offer": []})
+            market[kind].append((items, future))
+            self.actions_batched += 1
+            if self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        return future
+
+    def flush(self) -> None:
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            self.timer = None
+
+        for pair_name, market in pending.items():
+            # Cancels go first so freed balance is available to the offers
+            self._send(market["cancel"], self._send_cancels)
+            self._send(self._drop_cancelled(market["update"], market["cancel"]), self._send_updates)
+            self._send(market["offer"], self._send_offers)
+
+    # Updates to orders cancelled in the same window would revert the whole update
+    # batch once the cancel is mined. They are left out and their callers failed.
+    def _drop_cancelled(self, updates: list, cancels: list) -> list:
+        cancelled = {order.order_id for orders, _ in cancels for order in orders}
+        kept = []
+        for orders, future in updates:
+            orders = [order for order in orders if order.order_id not in cancelled]
+            if len(orders) == 0:
+                future.set_exception(Exception("order cancelled in the same batch window, not updated"))
+            else:
+                kept.append((orders, future))
+        return kept
+
+    def _send(self, requests: list, send: Callable) -> None:
+        if len(requests) == 0:
+            return
+        items = [item for request_items, _ in requests for item in request_items]
+        self.transactions_sent += 1
+        print(f"\t\tTransactionBatcher: sending {len(items)} actions from {len(requests)} callers in one transaction")
+        send_items = lambda nonce, fees: breakers.get("rpc").call(send, items, nonce, fees)
+        if self.pipeline is not None:
+            batch_future = self.pipeline.submit(send_items, batch_size=len(requests))
+        else:
+            batch_future = Future()
+            try:
+                batch_future.set_result(BatchResult(send_items(None, {}), len(requests)))
+            except Exception as e:
+                batch_future.set_exception(e)
+        batch_future.add_done_callback(lambda done: self._resolve(requests, done))
+
+    # Routes the batch transaction's result back to every caller in it
+    def _resolve(self, requests: list, batch_future: Future) -> None:
+        error = batch_future.exception()
+        for _, future in requests:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(batch_future.result())
+
+    def _send_cancels(self, orders: list, nonce: int, fees: dict):
+        # arb_checker and cancel_orders can both ask for the same order
+        unique_orders = {order.order_id: order for order in orders}
+        return self.client.batch_cancel_limit_orders(Transaction(orders=list(unique_orders.values()), nonce=nonce, **fees))
+
+    def _send_updates(self, orders: list, nonce: int, fees: dict):
+        return self.client.batch_update_limit_orders(Transaction(orders=orders, nonce=nonce, **fees))
+
+    def _send_offers(self, offers: list, nonce: int, fees: dict):
+        if len(offers) == 1:
+            pay_amt, pay_gem, buy_amt, buy_gem = offers[0]
+            return self.client.market.offer(pay_amt=pay_amt, pay_gem=pay_gem, buy_amt=buy_amt, buy_gem=buy_gem, nonce=nonce, **fees)
+        return self.client.market.batch_offer(pay_amts=[offer[0] for offer in offers],
+                                              pay_gems=[offer[1] for offer in offers],
+                                              buy_amts=[offer[2] for offer in offers],
+                                              buy_gems=[offer[3] for offer in offers],
+                                              nonce=nonce, **fees)
@@ -0,0 +1,219 @@
+import os, sys, io, json, time, random, argparse, platform, statistics, subprocess, contextlib
+from decimal import Decimal
+
+# Microbenchmarks for the bot's hot paths. app is imported in --backtest mode so
+# set_limit and the listener run against the simulated exchange, fully offline.
+#
+#   python bench.py --save bench.json
+#   python bench.py --baseline bench.json
+#
+# Results are seconds per call. With --baseline each result is compared to the
+# baseline's and the run exits 1 if any got slower by more than --threshold.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--save', type=str, help='writes results as json to this file')
+parser.add_argument('--baseline', type=str, help='json results to compare against')
+parser.add_argument('--threshold', type=float, default=0.1, help='slowdown vs baseline counted as a regression, 0.1 is 10%%')
+parser.add_argument('--book_fixture', type=str, help='recorded subgraph response (json) to also benchmark poll_book decoding on')
+parser.add_argument('--only', type=str, help='only runs benchmarks whose name contains this')
+parser.add_argument('--quick', action='store_true', help='skips the largest sizes')
+bench_args = parser.parse_args()
+
+sys.argv = ["app.py", "--pair", "weth_usdc", "--backtest", "synthetic:0", "--loop_time", "1", "--cancel"]
+with contextlib.redirect_stdout(io.StringIO()):
+    import app
+
+from rubi import OrderSide, OrderType, OrderEvent
+from pairs import TokenPairs, OrderComparison
+from transactionLogging import Logger
+from backtest import SimExchange, SimClock, SimOrderBookRequester, other_maker
+
+token = TokenPairs.WETH_USDC
+wallet = os.getenv("WALLET")
+devnull = open(os.devnull, 'w')
+
+# Seconds per call of func, best and median of repeat runs of number calls
+def measure(func, number: int, repeat: int = 5) -> dict:
+    runs = []
+    with contextlib.redirect_stdout(devnull):
+        func()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            runs.append((time.perf_counter() - start) / number)
+    return {"min": min(runs), "median": statistics.median(runs), "number": number, "repeat": repeat}
+
+##### poll_book decoding #####
+
+# Subgraph response with offers split between asks and bids, one in twenty mine
+def book_fixture(offers: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    exchange = SimExchange(clock=SimClock(), token=token, wallet=wallet)
+    asks = [[str(1800 * (1 + rng.random() / 100)), str(0.01 + rng.random())] for _ in range(offers // 2)]
+    bids = [[str(1800 * (1 - rng.random() / 100)), str(0.01 + rng.random())] for _ in range(offers - offers // 2)]
+    exchange.set_book(asks=asks, bids=bids)
+    for order in list(exchange.others.values())[::20]:
+        order.maker = exchange.wallet
+    return json.dumps(exchange.book_data())
+
+def bench_poll_book(results: dict) -> None:
+    exchange = SimExchange(clock=SimClock(), token=token, wallet=wallet)
+    requester = SimOrderBookRequester(exchange=exchange, token=token, base_erc20=exchange.erc20("WETH"), quote_erc20=exchange.erc20("USDC"))
+    sizes = [100, 1000] if bench_args.quick else [100, 1000, 10000]
+    fixtures = {f"poll_book_decode_{size}": (book_fixture(size), size) for size in sizes}
+    if bench_args.book_fixture:
+        with open(bench_args.book_fixture) as file:
+            text = file.read()
+        data = json.loads(text)["data"]
+        fixtures["poll_book_decode_recorded"] = (text, len(data["asks"]) + len(data["bids"]))
+    for name, (text, offers) in fixtures.items():
+        results[name] = measure(lambda: requester.parse_book(json.loads(text)), number=max(1, 2000 // offers))
+
+##### set_limit pricing #####
+
+# (name, side, set_closest, market price, asks, bids, text printed by the branch)
+set_limit_cases = [
+    ("set_limit_condition_0_ask", OrderSide.SELL, True, "1800", [["1801", "1"]], [["1799", "1"]], "condition 0"),
+    ("set_limit_condition_0_bid", OrderSide.BUY, True, "1800", [["1801", "1"]], [["1799", "1"]], "condition 0"),
+    ("set_limit_condition_1_ask", OrderSide.SELL, False, "1800", [["1801", "1"]], [["1799", "1"]], "condition 1"),
+    ("set_limit_condition_1_bid", OrderSide.BUY, False, "1800", [["1801", "1"]], [["1799", "1"]], "condition 1"),
+    ("set_limit_condition_2a_ask", OrderSide.SELL, False, "1800", [["1810", "1"]], [["1805", "1"]], "condition 2a"),
+    ("set_limit_condition_2a_bid", OrderSide.BUY, False, "1800", [["1810", "1"]], [["1805", "1"]], "condition 2a"),
+    ("set_limit_condition_2b_ask", OrderSide.SELL, False, "1800", [["1795", "1"]], [["1790", "1"]], "condition 2b"),
+    ("set_limit_condition_2b_bid", OrderSide.BUY, False, "1800", [["1795", "1"]], [["1790", "1"]], "condition 2b"),
+    ("set_limit_small_spread", OrderSide.SELL, False, "1800", [["1800.00005", "1"]], [["1800", "1"]], "very small spread"),
+]
+
+def bench_set_limit(results: dict) -> None:
+    app.client.fund(base=Decimal(100), quote=Decimal(200000), gas=Decimal(1))
+    app.gas_price.price = Decimal(1800)
+    for name, side, set_closest, price, asks, bids, expected in set_limit_cases:
+        app.market_price.price = Decimal(price)
+        app.client.set_book(asks=asks, bids=bids)
+        app.order_book_poller.poll_book()
+
+        # Make sure the case takes the branch it is named after
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            app.set_limit(side, order_quality_status=OrderComparison.NO_ORDERS, set_closest=set_closest)
+        if expected not in output.getvalue().lower():
+            print(f"WARNING - bench: {name} did not hit {expected}")
+
+        results[name] = measure(lambda: app.set_limit(side, order_quality_status=OrderComparison.NO_ORDERS, set_closest=set_closest), number=2000)
+
+    results["price_to_ints"] = measure(lambda: app.price_to_ints(price=Decimal("1800.123456"), size=Decimal("0.025"), side=OrderSide.BUY, set_closest=True), number=20000)
+
+##### Logger.__str__ #####
+
+def bench_logger(results: dict) -> None:
+    sizes = [10000] if bench_args.quick else [10000, 1000000]
+    rng = random.Random(0)
+    for size in sizes:
+        logger = Logger(token=token)
+        for i in range(size):
+            side = OrderSide.BUY if i % 2 else OrderSide.SELL
+            logger.record_fill(side=side, price=Decimal(1800 + rng.random()), size=Decimal("0.025"), market_price=Decimal(1800))
+        results[f"logger_str_{size}_fills"] = measure(lambda: str(logger), number=50)
+
+##### rubicon_listener dispatch #####
+
+class Drained(Exception):
+    pass
+
+# Hands out the same events then stops rubicon_listener
+class ReplayQueue:
+    def __init__(self, events: list):
+        self.events = events
+        self.index = 0
+
+    def get(self, block: bool = True):
+        if self.index >= len(self.events):
+            raise Drained()
+        self.index += 1
+        return self.events[self.index - 1]
+
+def order_event(order_type: OrderType, pair_name: str, limit_order_owner: str, market_order_owner: str) -> OrderEvent:
+    event = OrderEvent.__new__(OrderEvent)
+    event.__dict__.update(order_type=order_type, pair_name=pair_name, order_side=OrderSide.SELL, price=Decimal("1800.5"),
+                          size=Decimal("0.025"), limit_order_id="0x1", limit_order_owner=limit_order_owner, market_order_owner=market_order_owner)
+    return event
+
+def bench_listener(results: dict) -> None:
+    app.market_price.price = Decimal(1800)
+    app.client.set_book(asks=[["1801", "1"]], bids=[["1799", "1"]])
+    cases = {
+        "listener_other_pair": order_event(OrderType.LIMIT, "WETH/DAI", other_maker, other_maker),
+        "listener_limit_placed": order_event(OrderType.LIMIT, token.sign(), other_maker, other_maker),
+        "listener_my_fill": order_event(OrderType.LIMIT_TAKEN, token.sign(), wallet, other_maker),
+        "listener_cancel_requote": order_event(OrderType.CANCEL, token.sign(), other_maker, other_maker),
+    }
+    # The listener's fixed 0.1s sleep per message is left out
+    sleep = time.sleep
+    time.sleep = lambda seconds: None
+    try:
+        for name, event in cases.items():
+            number = 20 if "requote" in name else 2000
+            def dispatch():
+                try:
+                    app.rubicon_listener(ReplayQueue([event] * number))
+                except Drained:
+                    pass
+            result = measure(dispatch, number=1)
+            result["min"] /= number
+            result["median"] /= number
+            result["number"] = number
+            results[name] = result
+    finally:
+        time.sleep = sleep
+
+##### Results #####
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return ""
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    print(f"\n{'benchmark':<32} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<32} {'-':>12} {result['median']*1e6:>10.1f}us {'new':>8}")
+            continue
+        before = baseline[name]["median"]
+        change = result["median"] / before - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = " REGRESSION"
+        print(f"{name:<32} {before*1e6:>10.1f}us {result['median']*1e6:>10.1f}us {change:>+7.1%}{flag}")
+    return regressions
+
+if __name__ == '__main__':
+    results = {}
+    for bench in [bench_poll_book, bench_set_limit, bench_logger, bench_listener]:
+        if bench_args.only and bench_args.only not in bench.__name__:
+            continue
+        bench(results)
+
+    for name, result in results.items():
+        print(f"{name:<32} min {result['min']*1e6:>10.1f}us || median {result['median']*1e6:>10.1f}us")
+
+    output = {"commit": git_commit(),
+              "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "python": platform.python_version(),
+              "machine": platform.platform(),
+              "results": results}
+    if bench_args.save:
+        with open(bench_args.save, 'w') as file:
+            json.dump(output, file, indent=2)
+
+    if bench_args.baseline:
+        with open(bench_args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = compare(results, baseline, bench_args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,155 @@
+import time, random, threading
+from typing import Callable
+
+from metrics import metrics
+
+# Raised instead of calling a dependency whose breaker is open
+class CircuitOpen(Exception):
+    pass
+
+# Raised by calls that gave up before reaching the dependency, e.g. held back
+# by our own rate limit. They count as neither a success nor a failure.
+class NotAttempted(Exception):
+    pass
+
+state_values = {"closed": 0, "half_open": 1, "open": 2}
+
+def timer_call_later(delay: float, func: Callable) -> None:
+    timer = threading.Timer(delay, func)
+    timer.daemon = True
+    timer.start()
+
+# Trips open after failure_threshold failures in a row. While open calls fail
+# fast until a jittered exponential backoff has passed, then one probe call is
+# let through (half open) and its outcome closes the breaker or opens it again
+# for twice as long.
+class CircuitBreaker:
+    def __init__(self, registry, name: str, failure_threshold: int = 3, base_backoff: float = 2, max_backoff: float = 300, jitter: float = 0.25):
+        self.registry = registry
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff    # seconds
+        self.max_backoff = max_backoff      # seconds
+        self.jitter = jitter                # fraction of the backoff added or taken away at random
+        self.lock = threading.Lock()
+
+        self.state = "closed"
+        self.failures = 0                   # in a row
+        self.backoff = base_backoff
+        self.retry_at = 0
+        self.probing = False
+        self.scheduled = set()              # keys of pending retry_later calls
+
+        # Stats
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() >= self.retry_at:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            self.rejected += 1
+        metrics.counter("breaker_rejections_total", "Calls failed fast by an open breaker").inc(dependency=self.name)
+        return False
+
+    # True while calls would fail fast, without using up the half open probe
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.state == "open" and time.time() < self.retry_at
+
+    def record(self, success: bool) -> None:
+        with self.lock:
+            if success:
+                if self.state != "closed":
+                    print(f"\t\tCircuitBreaker: {self.name} closed")
+                self.state = "closed"
+                self.failures = 0
+                self.backoff = self.base_backoff
+                self.probing = False
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self._trip()
+
+    # Gives back a half open probe that never reached the dependency
+    def release(self) -> None:
+        with self.lock:
+            self.probing = False
+
+    def _trip(self) -> None:
+        delay = self.backoff * (1 + random.uniform(-self.jitter, self.jitter))
+        self.retry_at = time.time() + delay
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+        self.state = "open"
+        self.probing = False
+        self.trips += 1
+        print(f"WARNING - CircuitBreaker: {self.name} open after {self.failures} failures, retrying in {delay:.1f}s")
+        metrics.counter("breaker_trips_total", "Times a breaker opened").inc(dependency=self.name)
+
+    # Calls func through the breaker, raises CircuitOpen while it is open
+    def call(self, func: Callable, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpen(f"{self.name} circuit open")
+        try:
+            result = func(*args, **kwargs)
+        except NotAttempted:
+            self.release()
+            raise
+        except Exception:
+            self.record(False)
+            raise
+        self.record(True)
+        return result
+
+    # Runs func on a timer once the dependency is worth trying again, with the
+    # backoff growing per failure in a row. Only one retry per key is pending at a time.
+    def retry_later(self, key: str, func: Callable) -> None:
+        with self.lock:
+            if key in self.scheduled:
+                return
+            self.scheduled.add(key)
+            backoff = min(self.base_backoff * 2 ** max(self.failures - 1, 0), self.max_backoff)
+            delay = max(self.retry_at - time.time(), backoff * (1 + random.uniform(-self.jitter, self.jitter)))
+
+        def run():
+            with self.lock:
+                self.scheduled.discard(key)
+            func()
+        self.registry.call_later(delay, run)
+
+    def __str__(self) -> str:
+        retry = f" || retry in {max(self.retry_at - time.time(), 0):.1f}s" if self.state == "open" else ""
+        return f"{self.name}: {self.state} || failures in a row: {self.failures} || trips: {self.trips} || rejected: {self.rejected}{retry}"
+
+# One breaker per external dependency. call_later schedules retries and can be
+# swapped for a simulated clock's.
+class Breakers:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.breakers = {}
+        self.call_later = timer_call_later
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self.lock:
+            if name not in self.breakers:
+                self.breakers[name] = CircuitBreaker(self, name)
+            return self.breakers[name]
+
+    # {labels tuple: state value} for the breaker_state gauge
+    def states(self) -> dict:
+        with self.lock:
+            return {(("dependency", name),): state_values[breaker.state] for name, breaker in self.breakers.items()}
+
+    def report(self) -> str:
+        with self.lock:
+            breakers = list(self.breakers.values())
+        return "\n".join(["Circuit breakers"] + [f"\t{breaker}" for breaker in breakers]) + "\n"
+
+# Shared by every module in the process
+breakers = Breakers()
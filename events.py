@@ -2,21 +2,26 @@ from rubi import OrderSide, ERC20
 import requests
 import json
 import time, os
+from contextlib import nullcontext
+from typing import Union
 from decimal import Decimal
 
 from pairs import TokenPairs
+from metrics import metrics
+from breaker import breakers
+from ratelimit import rate_limiter, RateLimited
+from pricelevels import PriceLevelIndex
 
 # Poll rubicon orderbook and find my best offers and market's best.
 class OrderBookRequester:
-    def __init__(self, client, token : TokenPairs):
+    def __init__(self, client, token : TokenPairs, base_erc20: ERC20 = None, quote_erc20: ERC20 = None, recorder=None):
         self.client = client
         self.token = token
+        self.recorder = recorder # writes each fetched book for --backtest replays
 
-        # Aribtrum case
-        if token==TokenPairs.WETH_USDC_ARB:
-            self.url = "https://api.rubicon.finance/subgraphs/name/RubiconV2_Arbitrum_One"
-        else:
-            self.url = "https://api.rubicon.finance/subgraphs/name/RubiconV2_Optimism_Mainnet"
+        self.url = token.network.subgraph_url
+        # RUBICON_SUBGRAPH_URL points the poller at another subgraph, e.g. a local stand-in
+        self.url = os.getenv("RUBICON_SUBGRAPH_URL", self.url)
             
         # Track my best and orderbook best bids/ask
         self.my_best_bid = None
@@ -27,16 +32,45 @@ class OrderBookRequester:
         self.book_best_ask = None
         self.last_poll_time = 0
 
+        # Every open offer by price level, for depth and queue position
+        self.asks = PriceLevelIndex(OrderSide.SELL)
+        self.bids = PriceLevelIndex(OrderSide.BUY)
+
         # Create ERC20 to get decimal and calculate price
-        self.base_erc20 = ERC20.from_network(self.token.sign_list()[0], network=self.client.network)
-        self.quote_erc20 = ERC20.from_network(self.token.sign_list()[1], network=self.client.network)
-        self.asset = list(self.token.poll_orderside().keys())[0]
-        self.quote = list(self.token.poll_orderside().keys())[1]
+        self.base_erc20 = base_erc20 if base_erc20 is not None else ERC20.from_network(self.token.config.base.symbol, network=self.client.network)
+        self.quote_erc20 = quote_erc20 if quote_erc20 is not None else ERC20.from_network(self.token.config.quote.symbol, network=self.client.network)
+        self.asset, self.quote = self.token.config.gems
 
         # Store total value of existing orders
         self.order_value = None
 
+    # False if the subgraph could not be queried, or failed fast while its breaker
+    # is open. Polls held back by our own rate limit don't count against the subgraph.
+    @metrics.timed("poll_book")
     def poll_book(self) -> bool:
+        breaker = breakers.get("subgraph")
+        if not breaker.allow():
+            return False
+        try:
+            data = self.fetch_book()
+        except RateLimited as e:
+            breaker.release()
+            print(f"WARNING - OrderBookRequest.poll_book: {e}, skipping poll.")
+            return False
+        except Exception as e:
+            print(f"WARNING - OrderBookRequest.poll_book: {e}")
+            data = None
+        breaker.record(data is not None)
+        if data is None:
+            return False
+        if self.recorder is not None:
+            self.recorder.book(data, self)
+        self.parse_book(data)
+        return True
+
+    # Queries the subgraph for open offers, None if the query failed. Raises
+    # RateLimited when the shared budget would hold it back longer than max_wait.
+    def fetch_book(self) -> Union[None, dict]:
 
         headers = {'Content-Type': 'application/json'}
 
@@ -78,13 +112,19 @@ class OrderBookRequester:
         """
 
         headers = {'Content-Type': 'application/json'}
-        response = requests.post(self.url, headers=headers, data=json.dumps({'query': query}))
+        if not rate_limiter.acquire(self.url):
+            raise RateLimited("over the subgraph rate limit")
+        response = requests.post(self.url, headers=headers, data=json.dumps({'query': query}), timeout=10)
 
+        if response.status_code == 429:
+            rate_limiter.throttled(self.url, response)
         if response.status_code != 200:
             print("WARNING - OrderBookRequest.poll_book: JSON query failed.")
-            return False
-    
-        data = response.json()
+            return None
+        return response.json()
+
+    # Finds the book's and my best offers from a subgraph response
+    def parse_book(self, data: dict) -> None:
         # print(data)
         asks = data['data']['asks']
         bids = data['data']['bids']
@@ -94,7 +134,7 @@ class OrderBookRequester:
         self.all_my_asks = []
 
         for ask in asks:
-            price = (Decimal(ask['buy_amt']) / Decimal(10**self.quote_erc20.decimal)) / (Decimal(ask['pay_amt'])/Decimal(10**self.base_erc20.decimal))
+            price = self.ask_price(ask)
             is_book_best_ask = False
             # calculate best price and add to self.best_ask
             if self.book_best_ask is None or self.book_best_ask.price > price:
@@ -134,7 +174,7 @@ class OrderBookRequester:
         self.all_my_bids = []
 
         for bid in bids:
-            price = (Decimal(bid['pay_amt']) / Decimal(10**self.quote_erc20.decimal)) / (Decimal(bid['buy_amt'])/Decimal(10**self.base_erc20.decimal))
+            price = self.bid_price(bid)
 
             # calculate best price and add to self.best_bid
             is_book_best_bid = False
@@ -169,6 +209,14 @@ class OrderBookRequester:
                     else:
                         self.my_best_bid = my_order
 
+        # Remaining size in base of every offer, kept in the price level indexes
+        wallet = os.getenv("WALLET").lower()
+        base_decimal = Decimal(10**self.base_erc20.decimal)
+        self.asks.sync([(ask['id'], self.ask_price(ask), (Decimal(ask['pay_amt']) - Decimal(ask['paid_amt'])) / base_decimal,
+                         int(ask['id'], 16), ask['maker']['id'] == wallet) for ask in asks])
+        self.bids.sync([(bid['id'], self.bid_price(bid), (Decimal(bid['buy_amt']) - Decimal(bid['bought_amt'])) / base_decimal,
+                         int(bid['id'], 16), bid['maker']['id'] == wallet) for bid in bids])
+
         # On the off chance there are no orders on that side
         if self.book_best_bid is None:
             self.book_best_bid = PolledOrder.get_empty()
@@ -188,11 +236,25 @@ class OrderBookRequester:
         self.order_value = value
 
         self.last_poll_time = time.time()
-        return True
+
+    def ask_price(self, ask: dict) -> Decimal:
+        return (Decimal(ask['buy_amt']) / Decimal(10**self.quote_erc20.decimal)) / (Decimal(ask['pay_amt'])/Decimal(10**self.base_erc20.decimal))
+
+    def bid_price(self, bid: dict) -> Decimal:
+        return (Decimal(bid['pay_amt']) / Decimal(10**self.quote_erc20.decimal)) / (Decimal(bid['buy_amt'])/Decimal(10**self.base_erc20.decimal))
 
     def is_poll_recent(self, allowable_time=10) -> bool:
         return time.time() < self.last_poll_time + allowable_time
 
+    # Book as of the last poll, for journal snapshots
+    def snapshot(self) -> dict:
+        return {name: getattr(self, name) for name in book_fields}
+
+    # A restored book is only used until the first poll replaces it
+    def restore(self, state: dict) -> None:
+        for name in book_fields:
+            setattr(self, name, state[name])
+
     # def remove_order(self, limit_order_id):
     #     idx = 0
     #     for my_ask in self.all_my_asks:
@@ -208,6 +270,8 @@ class OrderBookRequester:
     #         idx += 1
 
 
+book_fields = ("my_best_bid", "my_best_ask", "all_my_bids", "all_my_asks", "book_best_bid", "book_best_ask", "asks", "bids", "last_poll_time", "order_value")
+
 # Used to hold data from Orderbook poll
 class PolledOrder:
     def __init__(self, 
@@ -238,20 +302,45 @@ class PolledOrder:
 
 # Holds time of last cancel
 class LastCancelTimes:
-    def __init__(self, min_wait_time):
+    def __init__(self, min_wait_time, journal=None):
         self.last_bid_cancel = 0
         self.last_ask_cancel = 0
         self.min_wait_time = min_wait_time * 60 if min_wait_time else 0
+        self.journal = journal # optional Journal each cancel time is written to
     
     def can_cancel(self, order_side: OrderSide) -> bool:
         if order_side == OrderSide.BUY:
             if self.last_bid_cancel + self.min_wait_time < time.time():
-                self.last_bid_cancel = time.time()
+                self.set_cancel_time(order_side, time.time())
                 return True
         elif order_side == OrderSide.SELL:
             if self.last_ask_cancel + self.min_wait_time < time.time():
-                self.last_ask_cancel = time.time()
+                self.set_cancel_time(order_side, time.time())
                 return True
         else:
             raise ValueError("LastCancelTimes.can_cancel: bad order_side value")
-        return False
\ No newline at end of file
+        return False
+
+    def set_cancel_time(self, order_side: OrderSide, cancel_time: float) -> None:
+        with nullcontext() if self.journal is None else self.journal.entry("cancel_time", side=order_side.value, time=cancel_time):
+            if order_side == OrderSide.BUY:
+                self.last_bid_cancel = cancel_time
+            else:
+                self.last_ask_cancel = cancel_time
+
+    def snapshot(self) -> dict:
+        return {"last_bid_cancel": self.last_bid_cancel, "last_ask_cancel": self.last_ask_cancel}
+
+    def restore(self, state: dict) -> None:
+        self.last_bid_cancel = state["last_bid_cancel"]
+        self.last_ask_cancel = state["last_ask_cancel"]
+
+    def replay(self, entry: dict) -> bool:
+        if entry["k"] != "cancel_time":
+            return False
+        journal, self.journal = self.journal, None
+        try:
+            self.set_cancel_time(OrderSide(entry["side"]), entry["time"])
+        finally:
+            self.journal = journal
+        return True
\ No newline at end of file
@@ -0,0 +1,103 @@
+import time, threading
+from decimal import Decimal
+
+from web3 import Web3
+
+# Optimism L1 fee oracle
+gas_price_oracle = "0x420000000000000000000000000000000000000F"
+gas_price_oracle_abi = [
+    {"inputs": [], "name": "l1BaseFee", "outputs": [{"type": "uint256"}], "stateMutability": "view", "type": "function"},
+]
+
+# Gas used per action before any reciepts have been seen
+default_gas_used = {
+    "offer": 250000,
+    "update": 200000,
+    "batch_cancel": 120000,
+    "swap": 180000,
+}
+
+# Caches gas inputs per block and estimates the dollar cost of an action before it is sent
+class GasEstimator:
+    def __init__(self, w3, gas_decimal: int, gas_price, reward_rate: Decimal, l1_oracle: bool = True, block_time: float = 2):
+        self.w3 = w3
+        self.gas_decimal = gas_decimal
+        self.gas_price = gas_price          # TokenPrice of the gas token
+        self.reward_rate = reward_rate      # dollars of rewards per dollar of volume
+        self.block_time = block_time        # seconds between block number checks
+
+        self.oracle = w3.eth.contract(address=Web3.to_checksum_address(gas_price_oracle), abi=gas_price_oracle_abi) if l1_oracle else None
+
+        self.lock = threading.Lock()
+        self.block = None
+        self.block_checked = 0
+        self.l2_gas_price = None
+        self.l1_base_fee = None
+
+        # Running averages per action type
+        self.gas_used = dict(default_gas_used)
+        self.l1_fee = {}            # l1 fee in wei, scaled to l1_base_fee when seen
+        self.alpha = Decimal("0.2") # weight of newest reciept
+
+        # Stats
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.gated = 0
+
+    # Refresh cached inputs at most once per block. If the node can't be read
+    # the last values are kept, before any are read estimates leave gas out.
+    def refresh(self) -> None:
+        with self.lock:
+            now = time.time()
+            if self.block_checked and now < self.block_checked + self.block_time:
+                return
+            self.block_checked = now
+            try:
+                block = self.w3.eth.block_number
+                if block == self.block:
+                    return
+                l2_gas_price = self.w3.eth.gas_price
+                l1_base_fee = self.oracle.functions.l1BaseFee().call() if self.oracle is not None else None
+            except Exception as e:
+                self.refresh_errors += 1
+                print(f"WARNING - GasEstimator.refresh: keeping gas prices from block {self.block}: {e}")
+                return
+            self.block = block
+            self.l2_gas_price = l2_gas_price
+            self.l1_base_fee = l1_base_fee
+            self.refreshes += 1
+
+    # Update the typical gas used and l1 fee (in wei) of an action from its reciept,
+    # split evenly between the batch_size actions that shared the transaction
+    def observe(self, action: str, gas_used: int, l1_fee: int = None, batch_size: int = 1) -> None:
+        if gas_used:
+            gas_used //= batch_size
+            self.gas_used[action] = int((1 - self.alpha) * self.gas_used.get(action, gas_used) + self.alpha * gas_used)
+
+        if l1_fee and self.l1_base_fee:
+            # Store relative to the current base fee so it can be rescaled later
+            scaled = Decimal(l1_fee) / batch_size / Decimal(self.l1_base_fee)
+            previous = self.l1_fee.get(action, scaled)
+            self.l1_fee[action] = (1 - self.alpha) * previous + self.alpha * scaled
+
+    # Estimated cost of an action in dollars
+    def estimate_cost(self, action: str) -> Decimal:
+        self.refresh()
+        wei = Decimal(self.gas_used.get(action, default_gas_used["offer"])) * Decimal(self.l2_gas_price or 0)
+        if action in self.l1_fee and self.l1_base_fee:
+            wei += self.l1_fee[action] * Decimal(self.l1_base_fee)
+        return wei / Decimal(10**self.gas_decimal) * self.gas_price.price
+
+    # True if the rewards from volume (in dollars) cover the gas of the action,
+    # or of every action in a tuple such as the cancel and swap an offer needs first
+    def worth_it(self, actions, volume: Decimal) -> bool:
+        if self.gas_price.price is None:
+            return True
+        actions = (actions,) if isinstance(actions, str) else tuple(actions)
+        cost = sum(self.estimate_cost(action) for action in actions)
+        reward = volume * self.reward_rate
+        if reward < cost:
+            self.gated += 1
+            print(f"\t\tGasEstimator: {' + '.join(actions)} not worth it || reward = {reward} || cost = {cost}")
+            return False
+        return True
@@ -0,0 +1,404 @@
+import os, sys, json, time, random, argparse, threading, statistics, contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from decimal import Decimal
+
+# End to end latency harness. Runs app.py with --sim_chain against local
+# stand-ins for the Rubicon subgraph, the Coinbase price endpoints and SMTP,
+# injects scripted event storms, fills and price moves, and reports how long
+# each trigger took to turn into a transaction. Nothing leaves the machine.
+#
+#   python harness.py --pair weth_usdc --rate 20 --rpc_latency 250
+#
+# Latency is from the moment the event happened on the simulated chain (or the
+# price changed at the stand-in) to the first transaction it caused being sent,
+# so it includes --event_delay, the listener queue and the price poll interval.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pair', type=str, default="weth_usdc", help='which token pair to run on')
+parser.add_argument('--scenarios', type=str, default="storm,fills,price,alerts", help='comma separated scenarios to run in order: storm, fills, price, alerts, outage')
+parser.add_argument('--duration', type=float, default=20, help='seconds each scenario runs')
+parser.add_argument('--rate', type=float, default=10, help='competitor cancels per second during the storm')
+parser.add_argument('--fill_rate', type=float, default=1, help='fills of my orders per second during the fills scenario')
+parser.add_argument('--moves', type=int, default=4, help='price jumps during the price scenario')
+parser.add_argument('--move', type=float, default=1, help='size of each price jump in percent, alternating up and down')
+parser.add_argument('--alerts', type=int, default=20, help='error alerts in each burst of the alerts scenario')
+parser.add_argument('--levels', type=int, default=200, help='competitor orders per side in the starting book')
+parser.add_argument('--rpc_latency', type=int, default=100, help='milliseconds each simulated transaction takes')
+parser.add_argument('--event_delay', type=float, default=0.5, help='seconds between an event happening and the listener receiving it')
+parser.add_argument('--price_interval', type=float, default=1, help='seconds between market price polls')
+parser.add_argument('--arb_interval', type=float, default=1, help='seconds between arb_checker passes')
+parser.add_argument('--rate_limit', type=str, help='rate[/burst] requests per second to the stand-ins, shared like the real per-host limits')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--log', type=str, default=os.devnull, help='file for the bot output')
+parser.add_argument('--save', type=str, help='writes the report as json to this file')
+harness_args = parser.parse_args()
+
+##### Stand-ins #####
+
+# State shared by the stand-in servers, the exchange is set once app is imported
+class StandIn:
+    def __init__(self):
+        self.exchange = None
+        self.lock = threading.Lock()
+        self.prices = {"ETH-USD": Decimal(1800), "ETH-DAI": Decimal(1800), "OP-USD": Decimal("1.5")}
+        self.requests = {"subgraph": 0, "coinbase": 0, "smtp": 0}
+        self.down = set() # stand-ins answering 503
+        self.mails = 0
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.requests[name] += 1
+
+    def move_prices(self, factor: Decimal) -> None:
+        with self.lock:
+            self.prices = {product: price * factor for product, price in self.prices.items()}
+
+standin = StandIn()
+
+# Coinbase product of a price path, /v2/prices/ETH-USD/spot and /products/ETH-DAI/ticker
+def product_of(path: str) -> str:
+    parts = path.split("?")[0].strip("/").split("/")
+    return parts[2] if parts[0] == "v2" and len(parts) > 2 else parts[1] if len(parts) > 1 else None
+
+# Subgraph queries (POST) and the Coinbase spot and ticker endpoints (GET)
+class HttpStandIn(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        standin.count("subgraph")
+        if standin.exchange is None or "subgraph" in standin.down:
+            self.reply(503, {})
+            return
+        self.reply(200, standin.exchange.book_data())
+
+    def do_GET(self) -> None:
+        standin.count("coinbase")
+        if "coinbase" in standin.down:
+            self.reply(503, {})
+            return
+        product = product_of(self.path)
+        price = standin.prices.get(product)
+        if price is None:
+            self.reply(404, {"message": "not found"})
+        elif self.path.startswith("/v2"):
+            self.reply(200, {"data": {"amount": str(price), "base": product.split("-")[0], "currency": product.split("-")[1]}})
+        else:
+            self.reply(200, {"price": str(price)})
+
+    def reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+# Just enough SMTP for smtplib's login and sendmail, every message is accepted
+class SmtpStandIn(StreamRequestHandler):
+    def handle(self) -> None:
+        standin.count("smtp")
+        self.send("220 localhost stand-in")
+        in_data = False
+        for line in self.rfile:
+            line = line.decode(errors="replace").rstrip("\r\n")
+            if in_data:
+                if line == ".":
+                    in_data = False
+                    with standin.lock:
+                        standin.mails += 1
+                    self.send("250 queued")
+                continue
+            command = line.split(" ", 1)[0].upper()
+            match command:
+                case "EHLO":
+                    self.send("250-localhost")
+                    self.send("250 AUTH PLAIN LOGIN")
+                case "HELO" | "MAIL" | "RCPT" | "RSET" | "NOOP":
+                    self.send("250 ok")
+                case "AUTH":
+                    self.send("235 authenticated")
+                case "DATA":
+                    in_data = True
+                    self.send("354 end with .")
+                case "QUIT":
+                    self.send("221 bye")
+                    return
+                case _:
+                    self.send("502 not implemented")
+
+    def send(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+class ThreadingSmtpServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve(server) -> int:
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+http_port = serve(ThreadingHTTPServer(("127.0.0.1", 0), HttpStandIn))
+smtp_port = serve(ThreadingSmtpServer(("127.0.0.1", 0), SmtpStandIn))
+
+os.environ["RUBICON_SUBGRAPH_URL"] = f"http://127.0.0.1:{http_port}/subgraph"
+os.environ["COINBASE_URL"] = f"http://127.0.0.1:{http_port}"
+os.environ["SMTP_HOST"] = "127.0.0.1"
+os.environ["SMTP_PORT"] = str(smtp_port)
+os.environ["SMTP_SSL"] = "0"
+os.environ.setdefault("EMAIL_PASS", "stand-in")
+
+log = open(harness_args.log, 'w')
+sys.argv = ["app.py", "--pair", harness_args.pair, "--sim_chain", "--rpc_latency", str(harness_args.rpc_latency),
+            "--loop_time", "60", "--cancel"]
+if harness_args.rate_limit:
+    sys.argv += ["--rate_limits", f"127.0.0.1={harness_args.rate_limit}"]
+with contextlib.redirect_stdout(log):
+    import app
+
+from rubi import OrderSide, OrderType
+from utils import dispatcher
+from breaker import breakers
+from ratelimit import rate_limiter
+
+exchange = app.client
+exchange.event_delay = harness_args.event_delay
+standin.exchange = exchange
+wallet = os.getenv("WALLET")
+
+##### Attribution #####
+
+# Each handled trigger records the transactions sent while it ran on its thread
+current = threading.local()
+records = []
+records_lock = threading.Lock()
+pending_moves = [] # (time, price) of moves arb_checker has not acted on yet
+
+def on_transaction(action: str) -> None:
+    record = getattr(current, "record", None)
+    if record is not None:
+        record["transactions"].append((action, time.time()))
+
+exchange.on_transaction = on_transaction
+
+def classify(order) -> str:
+    mine = order.limit_order_owner == wallet
+    match order.order_type:
+        case OrderType.CANCEL:
+            return "own_cancel" if mine else "competitor_cancel"
+        case OrderType.LIMIT_TAKEN:
+            return "my_fill" if mine else "other_fill"
+        case OrderType.LIMIT_DELETED:
+            return "filled_out" if mine else "other_filled_out"
+        case OrderType.LIMIT:
+            return "own_limit_placed" if mine else "limit_placed"
+    return order.order_type.name.lower()
+
+def handled(kind: str, start: float, func, *args) -> None:
+    record = {"kind": kind, "start": start, "handled": time.time(), "transactions": [], "queue": app.my_queue.qsize()}
+    current.record = record
+    try:
+        func(*args)
+    except Exception as e:
+        print(f"ERROR - harness: {kind} raised {e}", file=sys.stderr)
+    finally:
+        record["done"] = time.time()
+        current.record = None
+        with records_lock:
+            records.append(record)
+
+app_on_order = app.on_order
+def timed_on_order(order) -> None:
+    handled(classify(order), order.created, app_on_order, order)
+app.on_order = timed_on_order
+
+# Attributed to the price move once market_price has picked it up, else a plain pass
+def timed_arb_checker() -> None:
+    kind, start = "arb_pass", time.time()
+    with records_lock:
+        if pending_moves and app.market_price.price == pending_moves[0][1]:
+            kind, start = "price_move", pending_moves.pop(0)[0]
+    handled(kind, start, app.arb_checker)
+
+def every(interval: float, func, stop: threading.Event) -> None:
+    def run():
+        while not stop.wait(interval):
+            try:
+                func()
+            except Exception as e:
+                print(f"ERROR - harness: {func.__name__} raised {e}", file=sys.stderr)
+    threading.Thread(target=run, daemon=True).start()
+
+##### Scenarios #####
+
+# The pair's price as the bot reads it from the stand-in
+def standin_price() -> Decimal:
+    prices = [standin.prices[product_of(url.split(".com", 1)[1])] for url in app.token.config.price_urls]
+    return prices[0] / prices[1] if len(prices) > 1 else prices[0]
+
+# Competitor levels every 0.1% out from the stand-in price
+def competitor_book(rng: random.Random) -> None:
+    price = standin_price()
+    size = app.base_allowance
+    asks = [[str(price * (1 + Decimal(i) / 1000)), str(size * Decimal(1 + rng.random()))] for i in range(1, harness_args.levels + 1)]
+    bids = [[str(price * (1 - Decimal(i) / 1000)), str(size * Decimal(1 + rng.random()))] for i in range(1, harness_args.levels + 1)]
+    exchange.set_book(asks=asks, bids=bids)
+
+# Competitors cancel random orders at --rate, each replaced by a new order so the book keeps its depth
+def storm(rng: random.Random, duration: float) -> None:
+    end = time.time() + duration
+    while time.time() < end:
+        with exchange.lock:
+            order_id = rng.choice(list(exchange.others.keys())) if exchange.others else None
+            order = exchange.others.get(order_id)
+        if order is not None:
+            side, price, size = order.side, exchange.price(order), Decimal(order.remaining_base()) / Decimal(10**app.base_erc20.decimal)
+            exchange.cancel_other(order_id)
+            exchange.place_other(side, price * Decimal(1 + (rng.random() - 0.5) / 1000), size)
+        time.sleep(rng.expovariate(harness_args.rate))
+
+# Takers fill part of one of my orders, after whatever other makers are ahead of it
+def fills(rng: random.Random, duration: float) -> None:
+    end = time.time() + duration
+    base_decimal = Decimal(10**app.base_erc20.decimal)
+    while time.time() < end:
+        with exchange.lock:
+            mine = list(exchange.mine.values())
+            if mine:
+                order = rng.choice(mine)
+                price = exchange.price(order)
+                ahead = sum(other.remaining_base() for other in exchange.others.values()
+                            if other.side == order.side and (exchange.price(other) <= price if order.side == OrderSide.SELL else exchange.price(other) >= price))
+                part = order.remaining_base() * Decimal(rng.choice([0.25, 0.5, 1]))
+                exchange.take(order.side, price, (Decimal(ahead) + part) / base_decimal)
+        time.sleep(rng.expovariate(harness_args.fill_rate))
+
+# Price jumps at the stand-in, alternating up and down. The competitors requote
+# around the new price straight away, without events.
+def price_moves(rng: random.Random, duration: float) -> None:
+    spacing = duration / max(harness_args.moves, 1)
+    for i in range(harness_args.moves):
+        factor = Decimal(1) + Decimal(str(harness_args.move / 100)) * (1 if i % 2 == 0 else -1)
+        with records_lock:
+            standin.move_prices(factor)
+            pending_moves.append((time.time(), standin_price()))
+        competitor_book(rng)
+        time.sleep(spacing)
+
+# Bursts of error alerts, the handle column is how long each caller was held up
+def alerts(rng: random.Random, duration: float) -> None:
+    bursts = 4
+    for burst in range(bursts):
+        for i in range(harness_args.alerts):
+            handled("alert", time.time(), app.error_notifier.send_notification, f"HARNESS ALERT {burst}.{i}", "stand-in alert")
+        time.sleep(duration / bursts)
+    dispatcher.flush()
+
+# The subgraph and Coinbase answer 503 for the first half while the storm goes
+# on, then recover. Shows the breakers failing fast and how long quoting takes to resume.
+def outage(rng: random.Random, duration: float) -> None:
+    with standin.lock:
+        standin.down = {"subgraph", "coinbase"}
+        before = dict(standin.requests)
+    storm(rng, duration / 2)
+    with standin.lock:
+        standin.down = set()
+        during = {name: standin.requests[name] - before[name] for name in ["subgraph", "coinbase"]}
+    print(f"harness: outage over, requests during it: {during}", file=sys.stderr)
+    handled("recovery", time.time(), app.order_loop)
+    storm(rng, duration / 2)
+
+scenarios = {"storm": storm, "fills": fills, "price": price_moves, "alerts": alerts, "outage": outage}
+
+##### Report #####
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize(records: list, elapsed: float) -> dict:
+    kinds = {}
+    for record in records:
+        kinds.setdefault(record["kind"], []).append(record)
+    summary = {}
+    for kind, group in sorted(kinds.items()):
+        latencies = [record["transactions"][0][1] - record["start"] for record in group if record["transactions"]]
+        handling = [record["done"] - record["handled"] for record in group]
+        actions = {}
+        for record in group:
+            for action, _ in record["transactions"]:
+                actions[action] = actions.get(action, 0) + 1
+        summary[kind] = {"count": len(group),
+                         "acted": len(latencies),
+                         "transactions": actions,
+                         "throughput": len(group) / elapsed,
+                         "handling_mean": statistics.mean(handling),
+                         "handling_p99": percentile(handling, 0.99),
+                         "max_queue": max(record["queue"] for record in group)}
+        if latencies:
+            summary[kind].update({"p50": percentile(latencies, 0.5), "p90": percentile(latencies, 0.9),
+                                  "p99": percentile(latencies, 0.99), "max": max(latencies)})
+    return summary
+
+def format_summary(name: str, summary: dict, elapsed: float) -> str:
+    lines = [f"{name} || {elapsed:.1f}s",
+             f"\t{'trigger':<20} {'count':>6} {'acted':>6} {'per s':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'handle':>8} {'queue':>6}"]
+    for kind, stats in summary.items():
+        latency = " ".join(f"{stats[key]*1000:>6.0f}ms" for key in ["p50", "p90", "p99", "max"]) if "p50" in stats else " ".join(f"{'-':>8}" for _ in range(4))
+        lines.append(f"\t{kind:<20} {stats['count']:>6} {stats['acted']:>6} {stats['throughput']:>7.2f} {latency} {stats['handling_mean']*1000:>6.0f}ms {stats['max_queue']:>6}")
+        if stats["transactions"]:
+            lines.append(f"\t\ttransactions: {stats['transactions']}")
+    return "\n".join(lines)
+
+if __name__ == '__main__':
+    rng = random.Random(harness_args.seed)
+    stop = threading.Event()
+    competitor_book(rng)
+    exchange.fund(base=10 * app.base_allowance, quote=10 * app.base_allowance * standin_price(), gas=Decimal("0.05"))
+
+    with contextlib.redirect_stdout(log):
+        threading.Thread(target=app.rubicon_listener, args=(app.my_queue,), daemon=True).start()
+        app.update_market_price()
+        every(harness_args.price_interval, app.update_market_price, stop)
+        handled("startup", time.time(), app.order_loop)
+        every(harness_args.arb_interval, timed_arb_checker, stop)
+
+        results = {}
+        for name in harness_args.scenarios.split(","):
+            with records_lock:
+                start_index = len(records)
+            start = time.time()
+            scenarios[name](rng, harness_args.duration)
+            # Let the queue drain and in flight events arrive
+            time.sleep(harness_args.event_delay + 1)
+            while app.my_queue.qsize() > 0:
+                time.sleep(0.1)
+            elapsed = time.time() - start
+            with records_lock:
+                results[name] = (summarize(records[start_index:], elapsed), elapsed)
+        stop.set()
+
+    print(f"Latency harness {app.token.sign()} || rpc latency {harness_args.rpc_latency}ms || event delay {harness_args.event_delay}s || price poll {harness_args.price_interval}s")
+    print("Latency is event to first transaction sent, handle is time spent in on_order/arb_checker.")
+    print("The listener sleeps 0.1s after every message, so it handles at most 10 events/s.\n")
+    for name, (summary, elapsed) in results.items():
+        print(format_summary(name, summary, elapsed) + "\n")
+    print(f"Stand-in requests: {standin.requests} || mails: {standin.mails}")
+    print(f"Notifications: {dispatcher.sent} sent || digests: {dispatcher.digests} || smtp logins: {dispatcher.connections} || failed: {dispatcher.failed} || dropped: {dispatcher.dropped}")
+    print(f"Transactions: {exchange.transactions} || failed: {exchange.failed_transactions} || my fills: {exchange.my_fills}")
+    print(breakers.report())
+    print(rate_limiter.report())
+
+    if harness_args.save:
+        with open(harness_args.save, 'w') as file:
+            json.dump({"args": vars(harness_args),
+                       "scenarios": {name: {"elapsed": elapsed, "triggers": summary} for name, (summary, elapsed) in results.items()},
+                       "requests": standin.requests,
+                       "transactions": exchange.transactions}, file, indent=2)
+
+    # The listener is still blocked on the multiprocessing queue, skip interpreter teardown
+    log.flush()
+    sys.stdout.flush()
+    os._exit(0)
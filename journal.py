@@ -0,0 +1,157 @@
+import os, re, json, mmap, time, zlib, pickle, struct, threading
+from contextlib import contextmanager
+from typing import Iterator
+
+# Record header: payload length and crc32. A zero length marks the end of a
+# segment's records, a bad crc a write torn by a crash.
+header = struct.Struct("<II")
+segment_pattern = re.compile(r"^journal-(\d{8})\.log$")
+
+# One preallocated, memory-mapped journal file. Appends are memory copies;
+# the kernel writes the pages back, so records survive the process crashing.
+class Segment:
+    def __init__(self, path: str, seq: int, size: int):
+        self.path = path
+        self.seq = seq
+        exists = os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self.file.truncate(size)
+        self.size = os.path.getsize(path)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.offset = 0
+        # Find the end of what earlier runs wrote
+        for _ in self.records():
+            pass
+
+    # Yields (offset after the record, payload) from the start, stopping at the end or a torn record
+    def records(self) -> Iterator[tuple]:
+        offset = 0
+        while offset + header.size <= self.size:
+            length, crc = header.unpack_from(self.map, offset)
+            end = offset + header.size + length
+            if length == 0 or end > self.size:
+                break
+            payload = bytes(self.map[offset + header.size:end])
+            if zlib.crc32(payload) != crc:
+                break
+            offset = end
+            self.offset = max(self.offset, offset)
+            yield offset, payload
+
+    def fits(self, payload: bytes) -> bool:
+        return self.offset + header.size + len(payload) <= self.size
+
+    def append(self, payload: bytes) -> None:
+        header.pack_into(self.map, self.offset, len(payload), zlib.crc32(payload))
+        self.map[self.offset + header.size:self.offset + header.size + len(payload)] = payload
+        self.offset += header.size + len(payload)
+
+    def flush(self) -> None:
+        self.map.flush()
+
+    def close(self) -> None:
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+# Append-only journal of consumed events and decisions, split into fixed size
+# memory-mapped segments, plus the latest snapshot of the state they update.
+# A snapshot records the journal position it was taken at, so a restart loads
+# it and replays only the entries written after. Segments wholly before the
+# snapshot are compacted away, keeping the last `retention` for inspection.
+class Journal:
+    def __init__(self, directory: str, segment_size: int = 16 * 2**20, retention: int = 2):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.retention = retention
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+        seqs = self._segments()
+        self.segment = self._open(seqs[-1] if seqs else 0)
+
+        # Stats
+        self.appended = 0
+        self.snapshots = 0
+        self.compacted = 0
+
+    def _open(self, seq: int) -> Segment:
+        return Segment(os.path.join(self.directory, f"journal-{seq:08d}.log"), seq, self.segment_size)
+
+    def _segments(self) -> list:
+        return sorted(int(match.group(1)) for match in map(segment_pattern.match, os.listdir(self.directory)) if match)
+
+    # Entries are small json objects, kind in "k" and wall time in "t"
+    def append(self, kind: str, **values) -> None:
+        values["k"] = kind
+        values["t"] = time.time()
+        payload = json.dumps(values, default=str, separators=(",", ":")).encode()
+        with self.lock:
+            if not self.segment.fits(payload):
+                self.segment.close()
+                self.segment = self._open(self.segment.seq + 1)
+            self.segment.append(payload)
+            self.appended += 1
+
+    # Appends an entry and holds snapshots off until the block applying it is
+    # done, so a snapshot has either both or neither
+    @contextmanager
+    def entry(self, kind: str, **values):
+        with self.lock:
+            self.append(kind, **values)
+            yield
+
+    # Entries written after (seq, offset), oldest first
+    def entries(self, after: tuple = (0, 0)) -> Iterator[dict]:
+        for seq in self._segments():
+            if seq < after[0]:
+                continue
+            segment = self.segment if seq == self.segment.seq else self._open(seq)
+            try:
+                for offset, payload in segment.records():
+                    if (seq, offset) > tuple(after):
+                        yield json.loads(payload)
+            finally:
+                if segment is not self.segment:
+                    segment.close()
+
+    # Writes collect()'s state with the current position, holding appends off
+    # until it is pickled so no entry is both in the state and after the position
+    def snapshot(self, collect) -> None:
+        with self.lock:
+            position = (self.segment.seq, self.segment.offset)
+            data = pickle.dumps({"position": position, "time": time.time(), "state": collect()})
+            self.segment.flush()
+        path = os.path.join(self.directory, "snapshot.pickle")
+        with open(f"{path}.tmp", "wb") as file:
+            file.write(data)
+        os.replace(f"{path}.tmp", path)
+        self.snapshots += 1
+        self.compact(position[0])
+
+    # Deletes segments before the snapshot's, beyond the newest `retention` of them
+    def compact(self, snapshot_seq: int) -> None:
+        old = [seq for seq in self._segments() if seq < snapshot_seq]
+        for seq in old[:max(len(old) - self.retention, 0)]:
+            os.remove(os.path.join(self.directory, f"journal-{seq:08d}.log"))
+            self.compacted += 1
+
+    # (snapshot, entries after it), snapshot None on a cold start
+    def recover(self) -> tuple:
+        path = os.path.join(self.directory, "snapshot.pickle")
+        snapshot = None
+        if os.path.exists(path):
+            try:
+                with open(path, "rb") as file:
+                    snapshot = pickle.load(file)
+            except Exception as e:
+                print(f"WARNING - Journal.recover: ignoring unreadable snapshot: {e}")
+        return snapshot, list(self.entries(snapshot["position"] if snapshot else (0, 0)))
+
+    def close(self) -> None:
+        with self.lock:
+            self.segment.close()
+
+    def __str__(self) -> str:
+        return f"Journal {self.directory} || segment {self.segment.seq} at {self.segment.offset} bytes || appended: {self.appended} || snapshots: {self.snapshots} || segments compacted: {self.compacted}"
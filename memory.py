@@ -0,0 +1,110 @@
+import gc, time, resource, threading, tracemalloc
+from typing import Callable
+
+# Object types always reported, by class name
+tracked_types = ["PolledOrder", "OrderEvent"]
+
+# Periodic tracemalloc snapshots for long runs. Each check diffs against the
+# previous snapshot to find which allocation sites grew, counts live objects by
+# type and sends an alarm through the notifier once traced memory has grown by
+# growth_alarm megabytes since the last alarm (or since start).
+class MemoryMonitor:
+    def __init__(self, notifier, token, growth_alarm: float = None, frames: int = 1, top: int = 10):
+        self.notifier = notifier            # ErrorNotification
+        self.token = token
+        self.growth_alarm = growth_alarm    # in MB
+        self.frames = frames
+        self.top = top
+
+        self.lock = threading.Lock()
+        self.sizes = {}                     # name: function returning a container's length
+
+        self.start_time = None
+        self.start_traced = 0
+        self.alarm_level = 0
+        self.last_snapshot = None
+
+        # Results of the last check
+        self.checks = 0
+        self.traced = 0
+        self.traced_peak = 0
+        self.top_growth = []
+        self.type_counts = {}
+        self.top_types = []
+        self.alarms = 0
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.start_time = time.time()
+        self.last_snapshot = self.take_snapshot()
+        self.start_traced = tracemalloc.get_traced_memory()[0]
+        self.alarm_level = self.start_traced
+
+    # Report the length of a container that is expected to grow, e.g. ErrorNotification.total_errors
+    def track(self, name: str, size: Callable) -> None:
+        self.sizes[name] = size
+
+    def take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def check(self) -> None:
+        if self.last_snapshot is None:
+            return
+        snapshot = self.take_snapshot()
+        top_growth = [stat for stat in snapshot.compare_to(self.last_snapshot, "lineno") if stat.size_diff > 0][:self.top]
+
+        # One pass over the heap for every type's count
+        type_counts = {}
+        for obj in gc.get_objects():
+            name = type(obj).__name__
+            type_counts[name] = type_counts.get(name, 0) + 1
+
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            self.last_snapshot = snapshot
+            self.checks += 1
+            self.traced = traced
+            self.traced_peak = traced_peak
+            self.top_growth = top_growth
+            self.type_counts = {name: type_counts.get(name, 0) for name in tracked_types}
+            self.top_types = sorted(type_counts.items(), key=lambda item: -item[1])[:self.top]
+
+        if self.growth_alarm is not None and traced - self.alarm_level >= self.growth_alarm * 2**20:
+            self.alarm_level = traced
+            self.alarms += 1
+            print(f"ERROR - MemoryMonitor: traced memory grew to {traced / 2**20:.1f} MB")
+            subject = f"MEMORY GROWTH in {self.token.sign()} account."
+            try:
+                self.notifier.send_notification(subject=subject, message=self.report())
+            except Exception as e:
+                print(f"ERROR - MemoryMonitor: could not send alarm {e}")
+
+    # Peak resident set size in MB
+    def max_rss(self) -> float:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def report(self) -> str:
+        with self.lock:
+            hours = (time.time() - self.start_time) / 3600 if self.start_time else 0
+            lines = [f"Memory || running {hours:.1f} hours || checks: {self.checks} || alarms: {self.alarms}",
+                     f"\tTraced: {self.traced / 2**20:.2f} MB (start {self.start_traced / 2**20:.2f} MB, peak {self.traced_peak / 2**20:.2f} MB)",
+                     f"\tMax RSS: {self.max_rss():.1f} MB"]
+            lines.append("\tObjects: " + " || ".join(f"{name} = {count}" for name, count in self.type_counts.items()))
+            for name, size in self.sizes.items():
+                try:
+                    lines.append(f"\t{name}: {size()}")
+                except Exception as e:
+                    lines.append(f"\t{name}: error {e}")
+            lines.append("\tTop growth since last check:")
+            for stat in self.top_growth:
+                frame = stat.traceback[0]
+                lines.append(f"\t\t{frame.filename}:{frame.lineno}: +{stat.size_diff / 1024:.1f} KB (+{stat.count_diff} blocks), total {stat.size / 1024:.1f} KB")
+            lines.append("\tMost common types:")
+            for name, count in self.top_types:
+                lines.append(f"\t\t{name}: {count}")
+        return "\n".join(lines) + "\n"
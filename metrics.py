@@ -0,0 +1,137 @@
+import time, threading
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable
+
+# Default latency buckets in seconds
+latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+def format_labels(labels: dict) -> str:
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self, const_labels: dict) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{format_labels({**const_labels, **dict(key)})} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: list):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        idx = bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = self.values[key]
+            counts[0][idx] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def render(self, const_labels: dict) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                labels = {**const_labels, **dict(key)}
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ["+Inf"], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': bound})} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+# Value read at scrape time from state the bot already keeps
+class Gauge:
+    def __init__(self, name: str, help: str, read: Callable):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self, const_labels: dict) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.read()
+        except Exception:
+            return lines
+        # read returns a number or a dict of {labels tuple: number}
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            lines.append(f"{self.name}{format_labels({**const_labels, **dict(key)})} {float(value)}")
+        return lines
+
+# Pre-aggregated metrics served in Prometheus text format
+class Metrics:
+    def __init__(self, prefix: str = "rubi_bot"):
+        self.prefix = prefix
+        self.const_labels = {}
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, name: str, create: Callable):
+        name = f"{self.prefix}_{name}"
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = create(name)
+            return self.metrics[name]
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self._get(name, lambda full_name: Counter(full_name, help))
+
+    def histogram(self, name: str, help: str = "", buckets: list = latency_buckets) -> Histogram:
+        return self._get(name, lambda full_name: Histogram(full_name, help, buckets))
+
+    def gauge(self, name: str, read: Callable, help: str = "") -> Gauge:
+        with self.lock:
+            gauge = Gauge(f"{self.prefix}_{name}", help, read)
+            self.metrics[gauge.name] = gauge
+            return gauge
+
+    # Records a call's duration in <name>_seconds and failures in <name>_errors_total
+    def timed(self, name: str) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start_time = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    self.counter(f"{name}_errors_total", f"Exceptions raised by {name}").inc()
+                    raise
+                finally:
+                    self.histogram(f"{name}_seconds", f"Duration of {name}").observe(time.perf_counter() - start_time)
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines += metric.render(self.const_labels)
+        return "\n".join(lines) + "\n"
+
+# Shared by every module in the process
+metrics = Metrics()
@@ -0,0 +1,141 @@
+import re, heapq, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from web3.exceptions import TimeExhausted, TransactionNotFound
+
+from batcher import BatchResult
+
+# web3 names the transaction it gave up waiting on in the TimeExhausted message
+tx_hash_pattern = re.compile(r"0x[0-9a-fA-F]{64}")
+
+# Reciept read straight from the node, in the shape of the client's transaction results
+class MinedReceipt:
+    def __init__(self, receipt):
+        self.status = receipt['status']
+        self.transaction_hash = receipt['transactionHash']
+        self.gas_used = receipt['gasUsed']
+        l1_fee = receipt.get('l1Fee', 0)
+        self.l1_fee = int(l1_fee, 16) if isinstance(l1_fee, str) else l1_fee
+
+    def __repr__(self):
+        return f"MinedReceipt(status={self.status}, transaction_hash={self.transaction_hash})"
+
+# Hands out nonces locally so several transactions can be in flight at once.
+# Every nonce handed out is released once its send is done, mined or failed.
+class NonceManager:
+    def __init__(self, w3, wallet: str):
+        self.w3 = w3
+        self.wallet = wallet
+        self.lock = threading.Lock()
+        self.nonce = None
+        self.assigned = set()   # handed out, send not done yet
+        self.gaps = []          # heap of nonces below self.nonce the node hasn't seen, handed out first
+        self.resyncs = 0
+
+    def next_nonce(self) -> int:
+        with self.lock:
+            if self.gaps:
+                nonce = heapq.heappop(self.gaps)
+            else:
+                if self.nonce is None:
+                    self.nonce = self.w3.eth.get_transaction_count(self.wallet, "pending")
+                nonce = self.nonce
+                self.nonce += 1
+            self.assigned.add(nonce)
+            return nonce
+
+    def release(self, nonce: int) -> None:
+        with self.lock:
+            self.assigned.discard(nonce)
+
+    # Re-reads the nonce from the node, used after any failed send. Nonces still
+    # assigned to queued sends are not handed out again, and the ones below them
+    # the node hasn't seen are, so the queued sends aren't stranded behind a gap.
+    def resync(self) -> None:
+        pending = self.w3.eth.get_transaction_count(self.wallet, "pending")
+        with self.lock:
+            self.nonce = max([pending] + [nonce + 1 for nonce in self.assigned])
+            self.gaps = [nonce for nonce in range(pending, self.nonce) if nonce not in self.assigned]
+            self.resyncs += 1
+        print(f"\t\tNonceManager: resynced nonce to {pending}, refilling {len(self.gaps)} gaps")
+
+    # True once a transaction with this nonce has been mined
+    def is_mined(self, nonce: int) -> bool:
+        return self.w3.eth.get_transaction_count(self.wallet, "latest") > nonce
+
+# Submits transactions without waiting on their reciepts. Each send runs on a
+# watcher thread with its own nonce and the caller gets a future back.
+# send is called as send(nonce, fees) where fees holds gas price overrides.
+class TransactionPipeline:
+    def __init__(self, nonce_manager: NonceManager, max_in_flight: int, max_replacements: int = 2, fee_bump: float = 1.25):
+        self.nonce_manager = nonce_manager
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="tx-watcher")
+        self.max_replacements = max_replacements
+        self.fee_bump = fee_bump
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+        # Stats
+        self.submitted = 0
+        self.replaced = 0
+        self.failed = 0
+
+    # Nonces are queued in the order they are taken, so no send waits on a
+    # lower nonce still sitting in the queue behind it
+    def submit(self, send: Callable, batch_size: int = 1) -> Future:
+        with self.lock:
+            self.in_flight += 1
+            self.submitted += 1
+            nonce = self.nonce_manager.next_nonce()
+            return self.executor.submit(self._watch, send, nonce, batch_size)
+
+    def _watch(self, send: Callable, nonce: int, batch_size: int) -> BatchResult:
+        try:
+            fees = {}
+            tx_hashes = [] # every attempt at this nonce
+            for attempt in range(self.max_replacements + 1):
+                try:
+                    return BatchResult(send(nonce, fees), batch_size)
+                except TimeExhausted as e:
+                    tx_hashes += tx_hash_pattern.findall(str(e))
+                    # Already mined means the reciept was just slow
+                    if self.nonce_manager.is_mined(nonce):
+                        receipt = self._mined_receipt(tx_hashes)
+                        if receipt is None:
+                            raise
+                        return BatchResult(receipt, batch_size)
+                    if attempt == self.max_replacements:
+                        raise
+                    fees = self._bumped_fees(attempt + 1)
+                    with self.lock:
+                        self.replaced += 1
+                    print(f"\t\tTransactionPipeline: replacing stuck transaction with nonce {nonce}, fees = {fees}")
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            self.nonce_manager.release(nonce)
+            self.nonce_manager.resync()
+            raise
+        finally:
+            self.nonce_manager.release(nonce)
+            with self.lock:
+                self.in_flight -= 1
+
+    # Reciept of whichever attempt was mined, None if none of them can be found
+    def _mined_receipt(self, tx_hashes: list):
+        for tx_hash in reversed(tx_hashes):
+            try:
+                return MinedReceipt(self.nonce_manager.w3.eth.get_transaction_receipt(tx_hash))
+            except TransactionNotFound:
+                continue
+        return None
+
+    # Replacement fees must beat the stuck transaction by at least 10%
+    def _bumped_fees(self, attempt: int) -> dict:
+        w3 = self.nonce_manager.w3
+        bump = self.fee_bump ** attempt
+        priority_fee = int(w3.eth.max_priority_fee * bump)
+        return {"max_priority_fee_per_gas": priority_fee,
+                "max_fee_per_gas": int(w3.eth.gas_price * 2 * bump) + priority_fee}
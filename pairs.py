@@ -1,18 +1,94 @@
 from rubi import OrderSide
 from enum import Enum
 from decimal import Decimal
+from dataclasses import dataclass
+from typing import Union
 from web3 import Web3
+import json, os
 
-# optimism
-weth = "0x4200000000000000000000000000000000000006"
-usdc = "0x7f5c764cbc14f9669b88837ca1490cca17c31607"
-usdt = "0x94b008aa00579c1307b0ef2c499ad98a8ce58e58"
-dai = "0xda10009cbd5d07dd0cecc66161fc93d7c9000da1"
-op = "0x4200000000000000000000000000000000000042"
+# Markets, their tokens and strategy parameters. PAIRS_CONFIG points at another file.
+pairs_config_path = os.getenv("PAIRS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pairs.json"))
 
-# arbitrum
-weth_arb = "0x82aF49447D8a07e3bd95BD0d56f35241523fBab1"
-usdc_arb = "0xaf88d065e77c8cC2239327C5EDb3A432268e5831"
+@dataclass(frozen=True, slots=True)
+class NetworkConfig:
+    name: str
+    subgraph_url: str
+    gas_token: str          # symbol gas is paid in
+    l1_fees: bool           # gas is measured from the transaction's l1 fee
+
+@dataclass(frozen=True, slots=True)
+class TokenConfig:
+    symbol: str
+    address: str            # as the subgraph's pay_gem/buy_gem filters take it
+    checksum: str
+    decimals: int
+
+# Everything the bot needs to know about a market, computed once at import
+@dataclass(frozen=True, slots=True)
+class PairConfig:
+    name: str               # TokenPairs member, e.g. WETH_USDC
+    arg: str                # --pair value
+    sign: str               # rubi pair name, e.g. WETH/USDC
+    port: int
+    network: NetworkConfig
+    base: TokenConfig
+    quote: TokenConfig
+    base_allowance: Decimal
+    quote_allowance: Decimal
+    target_allowance: Decimal
+    alpha: Decimal          # Rubicon maximum arbitrage allowed
+    gamma: Decimal          # Rubicon percentage that "tack" argument operates at, must be less than alpha
+    beta: Decimal           # Uniswap max arbitrage allowed
+    uniswap_fee: int
+    fee_tiers: tuple
+    price_urls: tuple       # Coinbase price, divided by the second url's if there is one
+    price_fallback: Union[None, Decimal]
+    gas_price_pair: str     # pair whose price values gas, its own name if the base is priced in ETH
+    reference_price: Decimal # starting price of synthetic backtests
+    log_path: str
+    env_file: str
+
+    # pay_gem, buy_gem of a bid
+    @property
+    def gems(self) -> tuple:
+        return self.base.address, self.quote.address
+
+def load_pairs(path: str) -> dict:
+    with open(path) as file:
+        config = json.load(file)
+    networks = {name: NetworkConfig(name=name, **network) for name, network in config["networks"].items()}
+    tokens = {network: {symbol: TokenConfig(symbol=symbol, address=token["address"], checksum=Web3.to_checksum_address(token["address"]), decimals=token["decimals"])
+                        for symbol, token in network_tokens.items()}
+              for network, network_tokens in config["tokens"].items()}
+
+    pairs = {}
+    for name, pair in config["pairs"].items():
+        network_tokens = tokens[pair["network"]]
+        base, quote = network_tokens[pair["base"]], network_tokens[pair["quote"]]
+        pairs[name] = PairConfig(name=name,
+                                 arg=pair["arg"],
+                                 sign=f"{base.symbol}/{quote.symbol}",
+                                 port=pair["port"],
+                                 network=networks[pair["network"]],
+                                 base=base,
+                                 quote=quote,
+                                 base_allowance=Decimal(pair["allowances"]["base"]),
+                                 quote_allowance=Decimal(pair["allowances"]["quote"]),
+                                 target_allowance=Decimal(pair["target_allowance"]),
+                                 alpha=Decimal(pair["alpha"]),
+                                 gamma=Decimal(pair["gamma"]),
+                                 beta=Decimal(pair["beta"]),
+                                 uniswap_fee=pair["uniswap_fee"],
+                                 fee_tiers=tuple(pair["fee_tiers"]),
+                                 price_urls=tuple(pair["price_urls"]),
+                                 price_fallback=Decimal(pair["price_fallback"]) if "price_fallback" in pair else None,
+                                 gas_price_pair=pair.get("gas_price_pair", name),
+                                 reference_price=Decimal(pair["reference_price"]),
+                                 log_path=pair.get("log_path", f"{pair['arg']}.txt"),
+                                 env_file=pair.get("env_file", f".{pair['arg']}_env"))
+    return pairs
+
+pair_configs = load_pairs(pairs_config_path)
 
 class BestPrices:
     def __init__(self):
@@ -27,180 +103,54 @@ class OrderComparison(Enum):
     ERROR_RETRIEVING = "ERROR_RETRIEVING"
     THRESHOLD_PRICES = "THRESHOLD_PRICES"
 
-class TokenPairs(Enum):
-    """Enumeration representing an order comparison."""
-    WETH_USDC = "WETH_USDC"
-    WETH_USDT = "WETH_USDT"
-    USDC_DAI = "USDC_DAI"
-    WETH_DAI = "WETH_DAI"
-    OP_USDC = "OP_USDC"
-    WETH_USDC_ARB = "WETH_USDC_ARB"
+# Members are the markets in pairs.json, each with its PairConfig as .config.
+# The methods are kept for existing callers, hot paths read token.config directly.
+class PairEnum(Enum):
+    def __init__(self, value):
+        self.config = pair_configs[value]
+
+    @classmethod
+    def from_arg(cls, arg: str):
+        for pair in cls:
+            if pair.config.arg == arg:
+                return pair
+        return None
+
+    @property
+    def network(self) -> NetworkConfig:
+        return self.config.network
 
     def sign(self) -> str:
-        match self:
-            case TokenPairs.WETH_USDC:
-                return "WETH/USDC"
-            case TokenPairs.WETH_USDT:
-                return "WETH/USDT"
-            case TokenPairs.USDC_DAI:
-                return "USDC/DAI"
-            case TokenPairs.WETH_DAI:
-                return "WETH/DAI"
-            case TokenPairs.OP_USDC:
-                return "OP/USDC"
-            case TokenPairs.WETH_USDC_ARB:
-                return "WETH/USDC"
-            
+        return self.config.sign
+
     def sign_list(self) -> list[str]:
-        match self:
-            case TokenPairs.WETH_USDC:
-                return ["WETH","USDC"]
-            case TokenPairs.WETH_USDT:
-                return ["WETH","USDT"]
-            case TokenPairs.USDC_DAI:
-                return ["USDC","DAI"]
-            case TokenPairs.WETH_DAI:
-                return ["WETH","DAI"]
-            case TokenPairs.OP_USDC:
-                return ["OP","USDC"]
-            case TokenPairs.WETH_USDC_ARB:
-                return ["WETH","USDC"]
-            
+        return [self.config.base.symbol, self.config.quote.symbol]
+
     def allowances(self):
-        match self:
-            case TokenPairs.WETH_USDC:
-                return {"base":1000, "quote":2000000}
-            case TokenPairs.WETH_USDT:
-                return {"base":1000, "quote":2000000}
-            case TokenPairs.USDC_DAI:
-                return {"base":2000000, "quote":2000000}
-            case TokenPairs.WETH_DAI:
-                return {"base":1000, "quote":200000}
-            case TokenPairs.OP_USDC:
-                return {"base":1400000, "quote":2000000}
-            case TokenPairs.WETH_USDC_ARB:
-                return {"base":100000, "quote":200000000}
-            
+        return {"base": self.config.base_allowance, "quote": self.config.quote_allowance}
+
     def target_allowances(self):
-        match self:
-            case TokenPairs.WETH_USDC:
-                return Decimal("0.025")
-            case TokenPairs.WETH_USDT:
-                return Decimal("0.05")
-            case TokenPairs.USDC_DAI:
-                return Decimal("1000")
-            case TokenPairs.WETH_DAI:
-                return Decimal("0.05")
-            case TokenPairs.OP_USDC:
-                return Decimal("75")
-            case TokenPairs.WETH_USDC_ARB:
-                return Decimal("0.17 ")
-            
-    # Rubicon maximum arbitrage allowed
+        return self.config.target_allowance
+
     def alpha(self):
-        match self:
-            case TokenPairs.WETH_USDC:
-                return Decimal("0.007")
-            case TokenPairs.WETH_USDT:
-                return Decimal("0.0007")
-            case TokenPairs.USDC_DAI:
-                return Decimal("0.007")
-            case TokenPairs.WETH_DAI:
-                return Decimal("0.0007")
-            case TokenPairs.OP_USDC:
-                return Decimal("0.0007")
-            case TokenPairs.WETH_USDC_ARB:
-                return Decimal("0.012")
-    
-    # Rubicon percentage that "tack" argument operates at
-    # Must be less than alpha
+        return self.config.alpha
+
     def gamma(self):
-        match self:
-            case TokenPairs.WETH_USDC:
-                return Decimal("0.005")
-            case TokenPairs.WETH_USDT:
-                return Decimal("0")
-            case TokenPairs.USDC_DAI:
-                return Decimal("0.005")
-            case TokenPairs.WETH_DAI:
-                return Decimal("0.0007")
-            case TokenPairs.OP_USDC:
-                return Decimal("0.0007")
-            case TokenPairs.WETH_USDC_ARB:
-                return Decimal("0.012")
-            
-    # Uniswap max arbitrage allowed
+        return self.config.gamma
+
     def beta(self):
-        match self:
-            case TokenPairs.WETH_USDC:
-                return Decimal('0.0007')
-            case TokenPairs.WETH_USDT:
-                return Decimal('0.0006')
-            case TokenPairs.USDC_DAI:
-                return Decimal('0.0005')
-            case TokenPairs.WETH_DAI:
-                return Decimal('0.0006')
-            case TokenPairs.OP_USDC:
-                return Decimal('0.0006')
-            case TokenPairs.WETH_USDC_ARB:
-                return Decimal('0.005')
+        return self.config.beta
 
     def poll_orderside(self):
-        match self:
-            case TokenPairs.WETH_USDC:
-                return {weth: OrderSide.BUY, usdc: OrderSide.SELL }
-            case TokenPairs.WETH_USDT:
-                return {weth: OrderSide.BUY, usdt: OrderSide.SELL }
-            case TokenPairs.USDC_DAI:
-                return {usdc: OrderSide.BUY, dai: OrderSide.SELL }
-            case TokenPairs.WETH_DAI:
-                return {weth: OrderSide.BUY, dai: OrderSide.SELL }
-            case TokenPairs.OP_USDC:
-                return {op: OrderSide.BUY, usdc: OrderSide.SELL }
-            case TokenPairs.WETH_USDC_ARB:
-                return {weth_arb: OrderSide.BUY, usdc_arb: OrderSide.SELL }
+        return {self.config.base.address: OrderSide.BUY, self.config.quote.address: OrderSide.SELL}
 
     def get_checksum_addresses(self):
-        match self:
-            case TokenPairs.WETH_USDC:
-                return [Web3.to_checksum_address(weth), Web3.to_checksum_address(usdc)]
-            case TokenPairs.WETH_USDT:
-                return [Web3.to_checksum_address(weth), Web3.to_checksum_address(usdt)]
-            case TokenPairs.USDC_DAI:
-                return [Web3.to_checksum_address(usdc), Web3.to_checksum_address(dai)]
-            case TokenPairs.WETH_DAI:
-                return [Web3.to_checksum_address(weth), Web3.to_checksum_address(dai)]
-            case TokenPairs.OP_USDC:
-                return [Web3.to_checksum_address(op), Web3.to_checksum_address(usdc)]
-            case TokenPairs.WETH_USDC_ARB:
-                return [Web3.to_checksum_address(weth_arb), Web3.to_checksum_address(usdc_arb)]
-            
+        return [self.config.base.checksum, self.config.quote.checksum]
+
     def get_log_path(self):
-        match self:
-            case TokenPairs.WETH_USDC:
-                return "weth_usdc.txt"
-            case TokenPairs.WETH_USDT:
-                return "weth_usdt.txt"
-            case TokenPairs.USDC_DAI:
-                return "usdc_dai.txt"
-            case TokenPairs.WETH_DAI:
-                return "weth_dai.txt"
-            case TokenPairs.OP_USDC:
-                return "op_usdc.txt"
-            case TokenPairs.WETH_USDC_ARB:
-                return "weth_usdc_arb.txt"
+        return self.config.log_path
 
     def get_uniswap_fee(self):
-        match self:
-            case TokenPairs.WETH_USDC:
-                return 500
-            case TokenPairs.WETH_USDT:
-                return 0
-            case TokenPairs.USDC_DAI:
-                return 100
-            case TokenPairs.WETH_DAI:
-                return 0
-            case TokenPairs.OP_USDC:
-                return 0
-            case TokenPairs.WETH_USDC_ARB:
-                return 500
+        return self.config.uniswap_fee
+
+TokenPairs = PairEnum("TokenPairs", {name: name for name in pair_configs}, module=__name__)
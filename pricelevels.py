@@ -0,0 +1,221 @@
+import random, threading
+from decimal import Decimal
+from rubi import OrderSide
+
+# One offer in the index. Each node also carries the offer count and the size
+# of its subtree, so depth and queue position are one walk from the root.
+class Node:
+    __slots__ = ("key", "priority", "offer_id", "price", "size", "mine", "left", "right", "count", "depth", "other_depth")
+
+    def __init__(self, key: tuple, offer_id: str, price: Decimal, size: Decimal, mine: bool):
+        self.key = key
+        self.priority = random.random()
+        self.offer_id = offer_id
+        self.price = price
+        self.size = size
+        self.mine = mine
+        self.left = None
+        self.right = None
+        self.update()
+
+    def update(self) -> None:
+        self.count = 1
+        self.depth = self.size
+        self.other_depth = Decimal(0) if self.mine else self.size
+        for child in (self.left, self.right):
+            if child is not None:
+                self.count += child.count
+                self.depth += child.depth
+                self.other_depth += child.other_depth
+
+# Splits a treap into keys < key and keys >= key, or <= and > if inclusive
+def split(node: Node, key: tuple, inclusive: bool = False) -> tuple:
+    if node is None:
+        return None, None
+    if node.key < key or (inclusive and node.key == key):
+        node.right, right = split(node.right, key, inclusive)
+        node.update()
+        return node, right
+    left, node.left = split(node.left, key, inclusive)
+    node.update()
+    return left, node
+
+# Joins two treaps where every key in left is below every key in right
+def merge(left: Node, right: Node) -> Node:
+    if left is None or right is None:
+        return left or right
+    if left.priority > right.priority:
+        left.right = merge(left.right, right)
+        left.update()
+        return left
+    right.left = merge(left, right.left)
+    right.update()
+    return right
+
+# Open offers on one side of the book sorted best price first, then by queue
+# priority (older offers first). A treap keyed on (price, priority) with a dict
+# from offer id to key, so insert, remove and update by offer id are O(log n)
+# expected, and depth and queue position are answered from subtree sums.
+# Polls sync it from several threads while others query it, so every public
+# method holds the index's lock.
+class PriceLevelIndex:
+    def __init__(self, side: OrderSide):
+        self.side = side
+        self.root = None
+        self.keys = {}  # offer id: key
+        self.lock = threading.RLock()
+
+    # Pickled in journal snapshots, without the lock
+    def __getstate__(self) -> dict:
+        with self.lock:
+            state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def _key(self, price: Decimal, priority) -> tuple:
+        # Asks best lowest, bids best highest
+        return (price if self.side == OrderSide.SELL else -price, priority)
+
+    # Inserts or updates an offer. Priority breaks ties at a price, a resting
+    # offer keeps its place in the queue when only its size changes.
+    def insert(self, offer_id: str, price: Decimal, size: Decimal, priority=0, mine: bool = False) -> None:
+        key = self._key(price, priority)
+        with self.lock:
+            if offer_id in self.keys:
+                self.remove(offer_id)
+            left, right = split(self.root, key)
+            self.root = merge(merge(left, Node(key, offer_id, price, size, mine)), right)
+            self.keys[offer_id] = key
+
+    def update(self, offer_id: str, price: Decimal, size: Decimal, mine: bool = False) -> None:
+        with self.lock:
+            self.insert(offer_id, price, size, priority=self.keys[offer_id][1], mine=mine)
+
+    def remove(self, offer_id: str) -> bool:
+        with self.lock:
+            key = self.keys.pop(offer_id, None)
+            if key is None:
+                return False
+            left, right = split(self.root, key)
+            _, right = split(right, key, inclusive=True)
+            self.root = merge(left, right)
+            return True
+
+    def __contains__(self, offer_id: str) -> bool:
+        with self.lock:
+            return offer_id in self.keys
+
+    def __len__(self) -> int:
+        with self.lock:
+            return 0 if self.root is None else self.root.count
+
+    def best_price(self) -> Decimal:
+        with self.lock:
+            node = self.root
+            if node is None:
+                return None
+            while node.left is not None:
+                node = node.left
+            return node.price
+
+    # [(price, size, offers)] of the n best price levels
+    def levels(self, n: int) -> list:
+        with self.lock:
+            levels = []
+            stack = []
+            node = self.root
+            while stack or node is not None:
+                while node is not None:
+                    stack.append(node)
+                    node = node.left
+                node = stack.pop()
+                if levels and levels[-1][0] == node.price:
+                    price, size, offers = levels[-1]
+                    levels[-1] = (price, size + node.size, offers + 1)
+                elif len(levels) == n:
+                    break
+                else:
+                    levels.append((node.price, node.size, 1))
+                node = node.right
+            return levels
+
+    # Size of every offer priced at price or better
+    def depth(self, price: Decimal) -> Decimal:
+        with self.lock:
+            # Sorts after every offer at price whatever its priority
+            key = (self._key(price, 0)[0], float("inf"))
+            total = Decimal(0)
+            node = self.root
+            while node is not None:
+                if node.key < key:
+                    total += node.size + (node.left.depth if node.left is not None else 0)
+                    node = node.right
+                else:
+                    node = node.left
+            return total
+
+    # (offers, size) ahead of an offer in the queue, None if it isn't in the index
+    def queue_position(self, offer_id: str) -> tuple:
+        with self.lock:
+            key = self.keys.get(offer_id)
+            if key is None:
+                return None
+            offers, size = 0, Decimal(0)
+            node = self.root
+            while node.key != key:
+                if node.key < key:
+                    offers += 1 + (node.left.count if node.left is not None else 0)
+                    size += node.size + (node.left.depth if node.left is not None else 0)
+                    node = node.right
+                else:
+                    node = node.left
+            if node.left is not None:
+                offers += node.left.count
+                size += node.left.depth
+            return offers, size
+
+    # Price of the best offer at which other makers' size, counted from the
+    # best price, reaches size. None if the whole side holds less.
+    def price_at_depth(self, size: Decimal) -> Decimal:
+        if size <= 0:
+            return self.best_price()
+        with self.lock:
+            node = self.root
+            if node is None or node.other_depth < size:
+                return None
+            found = None
+            while node is not None:
+                left_depth = node.left.other_depth if node.left is not None else 0
+                if left_depth >= size:
+                    node = node.left
+                elif left_depth + (0 if node.mine else node.size) >= size:
+                    found = node
+                    break
+                else:
+                    size -= left_depth + (0 if node.mine else node.size)
+                    node = node.right
+            return found.price
+
+    # Makes the index hold exactly offers, [(offer_id, price, size, priority, mine)].
+    # Offers already in the index are only touched when their price or size changed.
+    def sync(self, offers: list) -> None:
+        with self.lock:
+            seen = set()
+            for offer_id, price, size, priority, mine in offers:
+                seen.add(offer_id)
+                key = self.keys.get(offer_id)
+                if key is None or key != self._key(price, priority) or self._size(offer_id) != size:
+                    self.insert(offer_id, price, size, priority=priority, mine=mine)
+            for offer_id in [offer_id for offer_id in self.keys if offer_id not in seen]:
+                self.remove(offer_id)
+
+    def _size(self, offer_id: str) -> Decimal:
+        key = self.keys[offer_id]
+        node = self.root
+        while node.key != key:
+            node = node.right if node.key < key else node.left
+        return node.size
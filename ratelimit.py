@@ -0,0 +1,148 @@
+import os, time, fcntl, struct, threading, tempfile
+from urllib.parse import urlparse
+
+from metrics import metrics
+from breaker import NotAttempted
+
+# Requests per second and burst for each upstream host. Coinbase allows about
+# 10 public requests per second per IP, shared by every pair process on the machine.
+default_budgets = {
+    "api.coinbase.com": (5, 10),
+    "api.pro.coinbase.com": (5, 10),
+    "api.rubicon.finance": (5, 10),
+}
+
+bucket_format = "<dd" # tokens, last refill time
+
+# A request skipped because the wait for our own budget was longer than max_wait.
+# Breakers don't count it against the host, it was never asked.
+class RateLimited(NotAttempted):
+    pass
+
+# Token bucket kept in a small file so every bot process on the machine draws
+# from the same budget. The file is locked with flock while it is read and
+# updated. A caller that finds the bucket empty reserves the next token, which
+# can take the balance below zero, and sleeps until it is due, so requests from
+# all processes are spread out at the rate instead of arriving together.
+class SharedTokenBucket:
+    def __init__(self, host: str, rate: float, burst: float, directory: str):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.path = os.path.join(directory, f"{host}.bucket")
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        # flock excludes other processes, not threads sharing the fd
+        self.lock = threading.Lock()
+
+        # Stats for this process
+        self.requests = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.waited = 0
+
+    # Seconds until the reserved token is due, None if that is longer than max_wait
+    def reserve(self, max_wait: float) -> float:
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                data = os.pread(self.fd, struct.calcsize(bucket_format), 0)
+                if len(data) == struct.calcsize(bucket_format):
+                    tokens, last = struct.unpack(bucket_format, data)
+                    tokens = min(self.burst, tokens + max(now - last, 0) * self.rate)
+                else:
+                    tokens = self.burst
+                wait = max(1 - tokens, 0) / self.rate
+                if wait > max_wait:
+                    return None
+                os.pwrite(self.fd, struct.pack(bucket_format, tokens - 1, now), 0)
+                return wait
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    # Empties the bucket for every process, after the host answered 429
+    def penalize(self, seconds: float) -> None:
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                os.pwrite(self.fd, struct.pack(bucket_format, -seconds * self.rate, time.time()), 0)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def acquire(self, max_wait: float) -> bool:
+        wait = self.reserve(max_wait)
+        self.requests += 1
+        metrics.counter("rate_limit_requests_total", "Requests to rate limited hosts").inc(host=self.host)
+        if wait is None:
+            self.rejected += 1
+            metrics.counter("rate_limit_rejected_total", "Requests skipped because the wait was too long").inc(host=self.host)
+            return False
+        if wait > 0:
+            self.throttled += 1
+            self.waited += wait
+            metrics.counter("rate_limit_throttled_total", "Requests delayed to stay under the rate limit").inc(host=self.host)
+            metrics.histogram("rate_limit_wait_seconds", "Time requests were held back").observe(wait, host=self.host)
+            time.sleep(wait)
+        return True
+
+    def __str__(self) -> str:
+        return f"{self.host}: {self.rate:g}/s burst {self.burst:g} || requests: {self.requests} || throttled: {self.throttled} || rejected: {self.rejected} || waited: {self.waited:.1f}s"
+
+# One shared bucket per rate limited host, hosts without a budget are not limited
+class RateLimiter:
+    def __init__(self, budgets: dict = default_budgets, directory: str = None, max_wait: float = 5):
+        self.lock = threading.Lock()
+        self.budgets = dict(budgets)
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "rubicon-rate-limits")
+        self.max_wait = max_wait
+        self.buckets = {}
+
+    # Budgets as "host=rate[/burst],...", e.g. "api.coinbase.com=3/6"
+    def configure(self, limits: str = None, directory: str = None) -> None:
+        with self.lock:
+            if directory is not None:
+                self.directory = directory
+            for limit in (limits or "").split(","):
+                if limit.strip() == "":
+                    continue
+                host, budget = limit.strip().split("=")
+                rate, _, burst = budget.partition("/")
+                self.budgets[host] = (float(rate), float(burst or rate))
+            self.buckets = {}
+
+    def bucket(self, url: str) -> SharedTokenBucket:
+        host = urlparse(url).hostname
+        with self.lock:
+            if host not in self.budgets:
+                return None
+            if host not in self.buckets:
+                os.makedirs(self.directory, exist_ok=True)
+                rate, burst = self.budgets[host]
+                self.buckets[host] = SharedTokenBucket(host, rate, burst, self.directory)
+            return self.buckets[host]
+
+    # Blocks until a request to url is within budget. False if that would take
+    # longer than max_wait, the caller should skip the request.
+    def acquire(self, url: str) -> bool:
+        bucket = self.bucket(url)
+        return bucket is None or bucket.acquire(self.max_wait)
+
+    # Backs every process off a host that answered 429
+    def throttled(self, url: str, response) -> None:
+        bucket = self.bucket(url)
+        if bucket is None:
+            return
+        try:
+            seconds = float(response.headers.get("Retry-After", 1))
+        except ValueError:
+            seconds = 1
+        print(f"WARNING - RateLimiter: {bucket.host} answered 429, backing off {seconds:g}s")
+        bucket.penalize(seconds)
+
+    def report(self) -> str:
+        with self.lock:
+            buckets = list(self.buckets.values())
+        return "\n".join(["Rate limits"] + [f"\t{bucket}" for bucket in buckets]) + "\n"
+
+# Shared by every module in the process
+rate_limiter = RateLimiter()
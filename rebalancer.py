@@ -0,0 +1,69 @@
+import os
+from _decimal import Decimal
+from rubi import ERC20, OrderSide
+
+from swap import Uniswapper
+from utils import TokenPrice
+from transactionLogging import Logger
+
+# Swaps inventory back towards 50/50 ahead of time so set_limit rarely has to
+# swap inline. Runs as a scheduler job, off the quoting path.
+class InventoryRebalancer:
+    def __init__(self, uniswapper: Uniswapper,
+                    baseERC20: ERC20,
+                    quoteERC20: ERC20,
+                    market_price: TokenPrice,
+                    base_allowance: Decimal,
+                    logger: Logger,
+                    trigger: Decimal = Decimal("2")):
+
+        self.uniswapper = uniswapper
+        self.baseERC20 = baseERC20
+        self.quoteERC20 = quoteERC20
+        self.market_price = market_price
+        self.base_allowance = base_allowance
+        self.logger = logger
+
+        # Rebalance once a side drops below this many orders worth
+        self.trigger = trigger
+
+    def check(self) -> int:
+        if self.market_price.price is None or self.uniswapper.swap_pending():
+            return 0
+
+        base_balance = self.baseERC20.to_decimal(number=self.baseERC20.balance_of(account=os.getenv("WALLET")))
+        quote_balance = self.quoteERC20.to_decimal(number=self.quoteERC20.balance_of(account=os.getenv("WALLET")))
+        # Everything in units of base
+        quote_in_base = quote_balance / self.market_price.price
+        half = (base_balance + quote_in_base) / 2
+        threshold = self.base_allowance * self.trigger
+
+        # Can't help if both sides can't stay above the threshold
+        if half < threshold:
+            return 0
+
+        # Short on base, swap quote for base (needed to place asks)
+        if base_balance < threshold:
+            side = OrderSide.SELL
+            swap_in_base = half - base_balance
+            trade_amt = int(swap_in_base * self.market_price.price * Decimal(10 ** self.quoteERC20.decimal))
+
+        # Short on quote, swap base for quote (needed to place bids)
+        elif quote_in_base < threshold:
+            side = OrderSide.BUY
+            swap_in_base = half - quote_in_base
+            trade_amt = int(swap_in_base * Decimal(10 ** self.baseERC20.decimal))
+
+        else:
+            return 0
+
+        print(f"\t\tInventoryRebalancer: base = {base_balance} | quote in base = {quote_in_base} | rebalancing {swap_in_base} base for {side}")
+        # set_closest so only trade_amt has to be in the wallet, the threshold check above covers the rest
+        result = self.uniswapper.swap(side=side, trade_amt=trade_amt, base_allowance=self.base_allowance, set_closest=True, grow=False)
+        if result == 1:
+            self.logger.rebalance_swaps += 1
+        elif result == -2:
+            self.logger.rebalance_bad_price += 1
+        elif result == -1:
+            self.logger.swap_error += 1
+        return result
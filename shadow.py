@@ -0,0 +1,338 @@
+import os, json, time, threading, itertools
+from collections import deque
+from decimal import Decimal
+from functools import wraps
+from typing import Callable, Union
+
+from rubi import OrderSide, OrderType
+from hexbytes import HexBytes
+
+from pairs import TokenPairs
+from events import OrderBookRequester
+from gas import GasEstimator
+from swap import Uniswapper
+from metrics import metrics
+from backtest import SimOrder, SimOrderEvent, SimReceipt, token_decimals
+
+# Keeps would-be order ids clear of real offer ids
+shadow_id_offset = 2**128
+
+# Rough l1 fee per action relative to the l1 base fee (calldata gas times the fee
+# scalar), used until the estimator would have seen real reciepts
+default_l1_gas = {
+    "offer": 2000,
+    "update": 2000,
+    "batch_cancel": 1500,
+    "swap": 2500,
+}
+
+# Stands in for the transaction layer in --shadow mode. Reads still go to the
+# live client; offers, updates and cancels are recorded instead of sent and kept
+# as a would-be book that ShadowOrderBookRequester merges into every subgraph
+# response, so order_loop sees its own orders. Each would-be transaction is
+# attributed to the pass (order_loop or arb_checker run) that decided it.
+class ShadowExchange:
+    def __init__(self, client, token: TokenPairs, gas_price, path: str = None, on_event: Callable = None, passes: int = 1000):
+        self.client = client
+        self.network = client.network
+        self.wallet = client.wallet
+        self.market = self
+        self.token = token
+        self.path = path                        # .jsonl file every pass and fill is appended to
+        self.on_event = on_event                # gets the events would-be transactions and fills would have caused
+        self.lock = threading.RLock()
+        self.local = threading.local()
+
+        self.base, self.quote = token.config.base.symbol, token.config.quote.symbol
+        self.base_gem, self.quote_gem = [address.lower() for address in token.config.gems]
+        gas = token.network.gas_token
+        self.estimator = GasEstimator(w3=client.network.w3,
+                                      gas_decimal=token_decimals[gas],
+                                      gas_price=gas_price,
+                                      reward_rate=Decimal(0),
+                                      l1_oracle=token.network.l1_fees)
+        for action, l1_gas in default_l1_gas.items():
+            self.estimator.l1_fee[action] = Decimal(l1_gas)
+
+        self.mine = {}                          # order_id: SimOrder
+        self.next_id = itertools.count(shadow_id_offset + 1)
+        self.hashes = itertools.count(1)
+
+        # Stats
+        self.passes = 0
+        self.recent_passes = deque(maxlen=passes)
+        self.transactions = {}                  # action: count
+        self.gas_dollars = Decimal(0)
+        self.offered = {OrderSide.BUY: 0, OrderSide.SELL: 0}    # base ints offered
+        self.filled = {OrderSide.BUY: 0, OrderSide.SELL: 0}     # base ints filled
+        self.fills = 0
+
+    # Anything that isn't a transaction goes to the live client
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+    ##### Passes #####
+
+    # Decorator starting a pass, or running inside the pass already active on this thread
+    def shadow_pass(self, name: str) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if getattr(self.local, "record", None) is not None:
+                    return func(*args, **kwargs)
+                self.local.record = {"type": "pass", "pass": name, "ts": time.time(), "transactions": []}
+                self.local.start_time = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    record = self.local.record
+                    record["seconds"] = time.perf_counter() - self.local.start_time
+                    self.local.record = None
+                    self.end_pass(record)
+            return wrapper
+        return decorator
+
+    def end_pass(self, record: dict) -> None:
+        with self.lock:
+            self.passes += 1
+            self.recent_passes.append(record)
+        metrics.histogram("shadow_pass_seconds", "Duration of each shadow pass").observe(record["seconds"], name=record["pass"])
+        self.write(record)
+
+    def write(self, record: dict) -> None:
+        if self.path is None:
+            return
+        with self.lock:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(record, default=str) + "\n")
+
+    # Estimated gas of an action as (gas used, l1 fee in wei, dollars)
+    def estimate(self, action: str) -> tuple:
+        estimator = self.estimator
+        try:
+            estimator.refresh()
+            dollars = estimator.estimate_cost(action) if estimator.gas_price.price is not None else None
+        except Exception as e:
+            print(f"WARNING - ShadowExchange: could not estimate gas {e}")
+            dollars = None
+        l1_fee = int(estimator.l1_fee.get(action, 0) * Decimal(estimator.l1_base_fee or 0))
+        return estimator.gas_used[action], l1_fee, dollars
+
+    # Records a would-be transaction on the running pass and returns a reciept for it
+    def record(self, action: str, details: dict) -> SimReceipt:
+        gas_used, l1_fee, dollars = self.estimate(action)
+        record = getattr(self.local, "record", None)
+        decision_seconds = time.perf_counter() - self.local.start_time if record is not None else None
+        with self.lock:
+            self.transactions[action] = self.transactions.get(action, 0) + 1
+            if dollars is not None:
+                self.gas_dollars += dollars
+            transaction_hash = f"0x{next(self.hashes):064x}"
+        metrics.counter("shadow_transactions_total", "Transactions shadow mode would have sent").inc(action=action)
+        if decision_seconds is not None:
+            metrics.histogram("shadow_decision_seconds", "Time from the start of a pass to each would-be transaction").observe(decision_seconds, action=action)
+
+        transaction = {"action": action, "decision_seconds": decision_seconds, "gas_dollars": dollars, **details}
+        if record is not None:
+            record["transactions"].append(transaction)
+        else:
+            self.write({"type": "transaction", "ts": time.time(), **transaction})
+        print(f"\t\tShadowExchange: would send {action} {details}")
+        return SimReceipt(status=1, transaction_hash=transaction_hash, gas_used=gas_used, l1_fee=l1_fee)
+
+    ##### Transactions #####
+
+    def _open(self, pay_amt: int, pay_gem: str, buy_amt: int) -> dict:
+        side = OrderSide.SELL if pay_gem.lower() == self.base_gem else OrderSide.BUY
+        with self.lock:
+            order = SimOrder(next(self.next_id), side, pay_amt, buy_amt, os.getenv("WALLET").lower())
+            self.mine[order.order_id] = order
+            self.offered[side] += order.remaining_base()
+        self.emit(OrderType.LIMIT, order, self.base_size(order.remaining_base()))
+        return {"id": hex(order.order_id), "side": side.name, "price": str(self.price(order)), "size": str(self.base_size(order.remaining_base()))}
+
+    def _close(self, order_id: int) -> dict:
+        with self.lock:
+            order = self.mine.pop(order_id, None)
+        if order is None:
+            return {"id": hex(order_id), "unknown": True}
+        self.emit(OrderType.CANCEL, order, self.base_size(order.remaining_base()))
+        return {"id": hex(order_id), "side": order.side.name, "price": str(self.price(order))}
+
+    def offer(self, pay_amt: int, pay_gem: str, buy_amt: int, buy_gem: str, nonce: int = None, **fees) -> SimReceipt:
+        return self.record("offer", {"orders": [self._open(pay_amt, pay_gem, buy_amt)]})
+
+    def batch_offer(self, pay_amts: list, pay_gems: list, buy_amts: list, buy_gems: list, nonce: int = None, **fees) -> SimReceipt:
+        orders = [self._open(pay_amt, pay_gem, buy_amt) for pay_amt, pay_gem, buy_amt in zip(pay_amts, pay_gems, buy_amts)]
+        return self.record("offer", {"orders": orders})
+
+    def batch_cancel_limit_orders(self, transaction) -> SimReceipt:
+        return self.record("batch_cancel", {"orders": [self._close(order.order_id) for order in transaction.orders]})
+
+    def batch_update_limit_orders(self, transaction) -> SimReceipt:
+        orders = []
+        for update in transaction.orders:
+            closed = self._close(update.order_id)
+            base_amt = int(update.size * Decimal(10**token_decimals[self.base]))
+            quote_amt = int(update.size * update.price * Decimal(10**token_decimals[self.quote]))
+            if update.order_side == OrderSide.SELL:
+                opened = self._open(base_amt, self.base_gem, quote_amt)
+            else:
+                opened = self._open(quote_amt, self.quote_gem, base_amt)
+            orders.append({"replaced": closed["id"], **opened})
+        return self.record("update", {"orders": orders})
+
+    def record_swap(self, token_in: str, token_out: str, qty: int, fee: int) -> HexBytes:
+        receipt = self.record("swap", {"token_in": token_in, "token_out": token_out, "qty": qty, "fee": fee})
+        return HexBytes(receipt.transaction_hash)
+
+    ##### Would-be book #####
+
+    def base_size(self, base_amt: int) -> Decimal:
+        return Decimal(base_amt) / Decimal(10**token_decimals[self.base])
+
+    def price(self, order: SimOrder) -> Decimal:
+        base_decimal = Decimal(10**token_decimals[self.base])
+        quote_decimal = Decimal(10**token_decimals[self.quote])
+        if order.side == OrderSide.SELL:
+            return (Decimal(order.buy_amt) / quote_decimal) / (Decimal(order.pay_amt) / base_decimal)
+        return (Decimal(order.pay_amt) / quote_decimal) / (Decimal(order.buy_amt) / base_decimal)
+
+    # Would-be orders in the subgraph's response format
+    def book_offers(self) -> tuple:
+        asks, bids = [], []
+        with self.lock:
+            orders = list(self.mine.values())
+        for order in orders:
+            pay_gem, buy_gem = (self.base_gem, self.quote_gem) if order.side == OrderSide.SELL else (self.quote_gem, self.base_gem)
+            offer = {"id": hex(order.order_id),
+                     "pay_gem": pay_gem,
+                     "buy_gem": buy_gem,
+                     "pay_amt": str(order.pay_amt),
+                     "buy_amt": str(order.buy_amt),
+                     "paid_amt": str(order.paid_amt),
+                     "bought_amt": str(order.bought_amt),
+                     "price": str(self.price(order)),
+                     "maker": {"id": order.maker}}
+            (asks if order.side == OrderSide.SELL else bids).append(offer)
+        return asks, bids
+
+    # A taker took base_amt from another maker's offer at price. Would-be orders
+    # priced better on that side would have filled first, up to the same size.
+    def taken(self, side: OrderSide, price: Decimal, base_amt: int) -> None:
+        events = []
+        with self.lock:
+            if side == OrderSide.SELL:
+                ahead = sorted([order for order in self.mine.values() if order.side == side and self.price(order) < price], key=self.price)
+            else:
+                ahead = sorted([order for order in self.mine.values() if order.side == side and self.price(order) > price], key=self.price, reverse=True)
+            for order in ahead:
+                if base_amt <= 0:
+                    break
+                fill = min(order.remaining_base(), base_amt)
+                base_amt -= fill
+                if order.side == OrderSide.SELL:
+                    order.paid_amt += fill
+                    order.bought_amt += fill * order.buy_amt // order.pay_amt
+                else:
+                    order.bought_amt += fill
+                    order.paid_amt += fill * order.pay_amt // order.buy_amt
+                self.filled[side] += fill
+                self.fills += 1
+                events.append((OrderType.LIMIT_TAKEN, order, self.base_size(fill)))
+                if order.remaining_base() <= 0:
+                    del self.mine[order.order_id]
+                    events.append((OrderType.LIMIT_DELETED, order, Decimal(0)))
+
+        for order_type, order, size in events:
+            if order_type == OrderType.LIMIT_TAKEN:
+                metrics.counter("shadow_fills_total", "Would-be fills of shadow orders").inc(side=order.side.name)
+            self.write({"type": "fill", "ts": time.time(), "order_type": order_type.name, "id": hex(order.order_id),
+                        "side": order.side.name, "price": str(self.price(order)), "size": str(size), "level_price": str(price)})
+            self.emit(order_type, order, size)
+
+    # Hands the listener the event the chain would have emitted, right away rather than once mined
+    def emit(self, order_type: OrderType, order: SimOrder, size: Decimal) -> None:
+        if self.on_event is None:
+            return
+        self.on_event(SimOrderEvent(order_type=order_type,
+                                    pair_name=self.token.sign(),
+                                    order_side=order.side,
+                                    price=self.price(order),
+                                    size=size,
+                                    limit_order_id=hex(order.order_id),
+                                    limit_order_owner=os.getenv("WALLET")))
+
+    def report(self) -> str:
+        with self.lock:
+            passes = list(self.recent_passes)
+            lines = [f"Shadow || passes: {self.passes} || would-be transactions: {self.transactions} || estimated gas: {self.gas_dollars:.4f} USD"]
+            for side in [OrderSide.BUY, OrderSide.SELL]:
+                offered, filled = self.offered[side], self.filled[side]
+                rate = filled / offered if offered else 0
+                lines.append(f"\t{side.name}: offered {self.base_size(offered)} || filled {self.base_size(filled)} || fill rate {rate:.2%}")
+            lines.append(f"\tWould-be fills: {self.fills} || open would-be orders: {len(self.mine)}")
+
+        for name in sorted({record["pass"] for record in passes}):
+            seconds = sorted(record["seconds"] for record in passes if record["pass"] == name)
+            decisions = sorted(transaction["decision_seconds"] for record in passes if record["pass"] == name for transaction in record["transactions"])
+            line = f"\t{name}: {len(seconds)} recent passes || p50 {seconds[len(seconds) // 2]:.4f}s || max {seconds[-1]:.4f}s"
+            if decisions:
+                line += f" || decision p50 {decisions[len(decisions) // 2]:.4f}s || max {decisions[-1]:.4f}s"
+            lines.append(line)
+        return "\n".join(lines) + "\n"
+
+# Polls the live subgraph and merges in the would-be orders. Other makers' offers
+# that were taken from since the last poll are passed to ShadowExchange.taken.
+# Offers that disappear between polls are not counted since they may have been
+# cancelled, so fill rates err low. The wallet's live offers are left out.
+class ShadowOrderBookRequester(OrderBookRequester):
+    def __init__(self, exchange: ShadowExchange, token: TokenPairs, base_erc20=None, quote_erc20=None, recorder=None):
+        super().__init__(client=exchange, token=token, base_erc20=base_erc20, quote_erc20=quote_erc20, recorder=recorder)
+        self.exchange = exchange
+        self.last_paid = {} # offer id: paid_amt at the last poll
+
+    def fetch_book(self) -> Union[None, dict]:
+        data = super().fetch_book()
+        if data is None:
+            return None
+        wallet = os.getenv("WALLET").lower()
+        base_decimal = Decimal(10**self.base_erc20.decimal)
+        quote_decimal = Decimal(10**self.quote_erc20.decimal)
+
+        paid = {}
+        book = {"asks": [], "bids": []}
+        for side, key in [(OrderSide.SELL, "asks"), (OrderSide.BUY, "bids")]:
+            for offer in data['data'][key]:
+                if offer['maker']['id'] == wallet:
+                    continue
+                book[key].append(offer)
+                paid[offer['id']] = int(offer['paid_amt'])
+                taken = paid[offer['id']] - self.last_paid.get(offer['id'], paid[offer['id']])
+                if taken <= 0:
+                    continue
+                pay_amt, buy_amt = int(offer['pay_amt']), int(offer['buy_amt'])
+                if side == OrderSide.SELL:
+                    price = (Decimal(buy_amt) / quote_decimal) / (Decimal(pay_amt) / base_decimal)
+                    base_amt = taken
+                else:
+                    price = (Decimal(pay_amt) / quote_decimal) / (Decimal(buy_amt) / base_decimal)
+                    base_amt = taken * buy_amt // pay_amt
+                self.exchange.taken(side, price, base_amt)
+        self.last_paid = paid
+
+        asks, bids = self.exchange.book_offers()
+        return {"data": {"asks": book["asks"] + asks, "bids": book["bids"] + bids}}
+
+# Uniswapper that quotes live but records the swap instead of sending it
+class ShadowUniswapper(Uniswapper):
+    def __init__(self, shadow: ShadowExchange, **kwargs):
+        super().__init__(**kwargs)
+        self.shadow = shadow
+
+    def make_trade(self, token_in: str, token_out: str, qty: int, fee: int) -> HexBytes:
+        return self.shadow.record_swap(token_in, token_out, qty, fee)
+
+    # Nothing was sent, so there is no reciept to wait for
+    def confirm(self, tx_hash, side: OrderSide, market_price: Decimal):
+        return None
@@ -0,0 +1,118 @@
+import os, json, time, threading
+from typing import Callable
+
+# Token decimals and addresses learned from the chain, per network. Later
+# starts answer them from disk instead of reading name, symbol and decimals
+# over RPC before anything else can happen.
+class ChainMetadataCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.networks = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.networks = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"WARNING - ChainMetadataCache: ignoring unreadable {path}: {e}")
+
+    def get(self, network: str, symbol: str) -> dict:
+        with self.lock:
+            return self.networks.get(network, {}).get(symbol)
+
+    def put(self, network: str, symbol: str, address: str, decimals: int) -> None:
+        with self.lock:
+            self.networks.setdefault(network, {})[symbol] = {"address": address, "decimals": decimals}
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as file:
+                json.dump(self.networks, file, indent=2)
+            os.replace(temp_path, self.path)
+
+    # A LazyERC20 when the token is cached, else builds the ERC20 now and caches it
+    def erc20(self, network: str, symbol: str, build: Callable):
+        metadata = self.get(network, symbol)
+        if metadata is not None:
+            return LazyERC20(symbol, metadata, build)
+        erc20 = build()
+        self.put(network, symbol, erc20.address, erc20.decimal)
+        return erc20
+
+# ERC20 whose decimal and address come from the metadata cache. The real ERC20
+# is built on first use of anything else, or ahead of time by warm().
+class LazyERC20:
+    def __init__(self, symbol: str, metadata: dict, build: Callable):
+        self.symbol = symbol
+        self.address = metadata["address"]
+        self.decimal = metadata["decimals"]
+        self._build = build
+        self._erc20 = None
+        self._lock = threading.Lock()
+
+    def warm(self):
+        if self._erc20 is None:
+            with self._lock:
+                if self._erc20 is None:
+                    self._erc20 = self._build()
+        return self._erc20
+
+    def __getattr__(self, name: str):
+        return getattr(self.warm(), name)
+
+# Startup phase timings, the readiness barrier the first order_loop waits on
+# and time to first quote, all measured from process start.
+class Startup:
+    def __init__(self, started: float = None):
+        self.started = started or time.time()
+        self.phases = []        # (phase, seconds since start)
+        self.ready = {}         # name: threading.Event
+        self.first_quote = None # seconds from start to the first offer sent or orders found best
+
+    def elapsed(self) -> float:
+        return time.time() - self.started
+
+    def mark(self, phase: str) -> None:
+        elapsed = self.elapsed()
+        self.phases.append((phase, elapsed))
+        print(f"\t\tstartup: {phase} at {elapsed:.2f}s")
+
+    def requires(self, *names: str) -> None:
+        for name in names:
+            self.ready[name] = threading.Event()
+
+    def set(self, name: str) -> None:
+        if not self.ready[name].is_set():
+            self.ready[name].set()
+            self.mark(f"{name} ready")
+
+    # Runs func on its own thread and marks name ready once it returns True
+    def prepare(self, name: str, func: Callable) -> None:
+        def run():
+            try:
+                if func():
+                    self.set(name)
+            except Exception as e:
+                print(f"WARNING - startup: preparing {name} raised {e}")
+        threading.Thread(target=run, daemon=True, name=f"startup-{name}").start()
+
+    # Waits for everything required, returns what still wasn't ready after timeout seconds
+    def wait(self, timeout: float) -> list:
+        deadline = time.time() + timeout
+        for event in self.ready.values():
+            event.wait(max(deadline - time.time(), 0))
+        missing = [name for name, event in self.ready.items() if not event.is_set()]
+        if missing:
+            print(f"WARNING - startup: {missing} not ready after {timeout}s, starting anyway")
+        self.mark("ready")
+        return missing
+
+    def quoted(self) -> None:
+        if self.first_quote is None:
+            self.first_quote = self.elapsed()
+            self.mark("first quote")
+
+    def report(self) -> str:
+        out = "Startup\n"
+        for phase, elapsed in self.phases:
+            out += f"\t{phase}: {elapsed:.2f}s\n"
+        return out
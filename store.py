@@ -0,0 +1,215 @@
+import os, time, calendar, threading, queue
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Columns of each table, every table also has a leading "ts" column
+tables = {
+    "fills": ["side", "price", "size", "market_price", "volume", "arb"],
+    "gas": ["action", "fee"],
+    "cancels": ["side", "count"],
+    "swaps": ["loss"],
+    "prices": ["price"],
+}
+
+# Numeric codes for non numeric values
+side_codes = {"BUY": 1, "SELL": -1}
+action_codes = {"offer": 0, "batch_cancel": 1, "update": 2, "swap": 3}
+
+partition_seconds = 24 * 3600
+
+# Append-only columnar store for fills, gas, cancels, swap losses and prices.
+# Rows go to <root>/<table>/<YYYYMMDD>/<column>.f64 as raw float64, written in
+# batches by a background thread. Each column also has a running sum file
+# (<column>.cum.f64) so windowed sums are two binary searches per partition.
+class ColumnarStore:
+    def __init__(self, root: str, flush_interval: float = 5, cached_partitions: int = 32):
+        self.root = root
+        self.flush_interval = flush_interval # seconds
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()        # cached columns
+        self.disk_lock = threading.RLock()  # partition files, held while writing or loading them
+        self.cache = OrderedDict()
+        self.cached_partitions = cached_partitions
+
+        self.rows_written = 0
+
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    ##### Writing #####
+
+    # Queues a row, never blocks the caller
+    def append(self, table: str, ts: float = None, **values) -> None:
+        row = [time.time() if ts is None else ts]
+        row += [float(values[column]) for column in tables[table]]
+        self.queue.put_nowait((table, row))
+
+    # Blocks until everything queued so far is on disk
+    def flush(self) -> None:
+        done = threading.Event()
+        self.queue.put(("flush", done))
+        done.wait()
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = {}
+            deadline = time.time() + self.flush_interval
+            flushed = None
+            while time.time() < deadline and flushed is None:
+                try:
+                    table, row = self.queue.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if table == "flush":
+                    flushed = row
+                    break
+                batch.setdefault((table, partition_name(row[0])), []).append(row)
+
+            for (table, partition), rows in batch.items():
+                try:
+                    self._write_rows(table, partition, rows)
+                except Exception as e:
+                    print(f"ERROR - ColumnarStore: failed writing {len(rows)} rows to {table}/{partition}: {e}")
+            if flushed is not None:
+                flushed.set()
+
+    def _write_rows(self, table: str, partition: str, rows: list) -> None:
+        with self.disk_lock:
+            self._append_rows(table, partition, rows)
+
+    def _append_rows(self, table: str, partition: str, rows: list) -> None:
+        columns = self._load(table, partition)
+        path = os.path.join(self.root, table, partition)
+        os.makedirs(path, exist_ok=True)
+
+        # Rows are stamped on the callers' threads and can be queued out of order.
+        # ts must stay sorted for the window searches, so late rows take the last ts.
+        rows.sort(key=lambda row: row[0])
+        last = columns["ts"][-1] if len(columns["ts"]) > 0 else rows[0][0]
+        for row in rows:
+            last = row[0] = max(row[0], last)
+
+        for idx, column in enumerate(["ts"] + tables[table]):
+            values = array('d', [row[idx] for row in rows])
+            with open(os.path.join(path, column + ".f64"), 'ab') as file:
+                values.tofile(file)
+
+            if column == "ts":
+                new_columns = {"ts": values}
+                continue
+            cum = columns[column + ".cum"]
+            total = cum[-1] if len(cum) > 0 else 0.0
+            sums = array('d')
+            for value in values:
+                total += value
+                sums.append(total)
+            with open(os.path.join(path, column + ".cum.f64"), 'ab') as file:
+                sums.tofile(file)
+            new_columns[column] = values
+            new_columns[column + ".cum"] = sums
+
+        with self.lock:
+            for name, values in new_columns.items():
+                columns[name].extend(values)
+        self.rows_written += len(rows)
+
+    ##### Reading #####
+
+    # Columns of one partition, loaded from disk once and kept up to date by the writer
+    def _load(self, table: str, partition: str) -> dict:
+        key = (table, partition)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        with self.disk_lock:
+            # Loaded by another reader meanwhile
+            with self.lock:
+                if key in self.cache:
+                    return self.cache[key]
+
+            path = os.path.join(self.root, table, partition)
+            columns = {}
+            for column in ["ts"] + tables[table]:
+                for name in [column, column + ".cum"] if column != "ts" else [column]:
+                    values = array('d')
+                    file_path = os.path.join(path, name + ".f64")
+                    if os.path.exists(file_path):
+                        with open(file_path, 'rb') as file:
+                            data = file.read()
+                        values.frombytes(data[:len(data) - len(data) % 8])
+                    columns[name] = values
+
+            # A crash can leave columns with different lengths, keep complete rows only.
+            # The files are cut too, new rows are appended to them and must line up.
+            rows = min(len(values) for values in columns.values())
+            for name in columns:
+                file_path = os.path.join(path, name + ".f64")
+                if os.path.exists(file_path) and os.path.getsize(file_path) > rows * 8:
+                    os.truncate(file_path, rows * 8)
+                del columns[name][rows:]
+
+            with self.lock:
+                self.cache[key] = columns
+                while len(self.cache) > self.cached_partitions:
+                    self.cache.popitem(last=False)
+            return columns
+
+    def _partitions(self, table: str, start: float, end: float) -> list:
+        path = os.path.join(self.root, table)
+        if not os.path.isdir(path):
+            return []
+        partitions = []
+        for partition in sorted(os.listdir(path)):
+            partition_start = calendar.timegm(time.strptime(partition, "%Y%m%d"))
+            if partition_start < end and partition_start + partition_seconds > start:
+                partitions.append(partition)
+        return partitions
+
+    # Sum of a column over [start, end)
+    def window_sum(self, table: str, column: str, start: float, end: float) -> float:
+        total = 0.0
+        for partition in self._partitions(table, start, end):
+            columns = self._load(table, partition)
+            # The writer extends ts before the sums, read them together
+            with self.lock:
+                lo = bisect_left(columns["ts"], start)
+                hi = bisect_left(columns["ts"], end)
+                if hi > lo:
+                    cum = columns[column + ".cum"]
+                    total += cum[hi - 1] - (cum[lo - 1] if lo > 0 else 0.0)
+        return total
+
+    # Number of rows over [start, end)
+    def window_count(self, table: str, start: float, end: float) -> int:
+        count = 0
+        for partition in self._partitions(table, start, end):
+            columns = self._load(table, partition)
+            with self.lock:
+                count += bisect_left(columns["ts"], end) - bisect_left(columns["ts"], start)
+        return count
+
+    def volume(self, start: float, end: float) -> float:
+        return self.window_sum("fills", "volume", start, end)
+
+    def arb(self, start: float, end: float) -> float:
+        return self.window_sum("fills", "arb", start, end)
+
+    def gas(self, start: float, end: float) -> float:
+        return self.window_sum("gas", "fee", start, end)
+
+    def swap_loss(self, start: float, end: float) -> float:
+        return self.window_sum("swaps", "loss", start, end)
+
+    # Arb, gas and swap loss per dollar of volume over [start, end)
+    def loss_per_volume(self, start: float, end: float) -> float:
+        volume = self.volume(start, end)
+        if volume == 0:
+            return 0.0
+        return (self.arb(start, end) + self.gas(start, end) + self.swap_loss(start, end)) / volume
+
+def partition_name(ts: float) -> str:
+    return time.strftime("%Y%m%d", time.gmtime(ts))
@@ -1,11 +1,91 @@
-import os, requests, time
-from uniswap import Uniswap
+import os, requests, time, math, threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable
+from web3.exceptions import TransactionNotFound, ContractLogicError
 from _decimal import Decimal
 from rubi import ERC20, OrderSide
 from hexbytes import HexBytes
 from events import TokenPairs
 from utils import TokenPrice
 from transactionLogging import Logger
+from metrics import metrics
+from tracing import tracer
+from breaker import breakers, CircuitOpen
+
+# Swap sizes quoted, as multiples of the amount needed
+ladder_multipliers = [Decimal("0.5"), Decimal("1"), Decimal("1.5"), Decimal("2"), Decimal("3")]
+
+# ERC20 Transfer(address,address,uint256) topic
+transfer_topic = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+# Quoter output as a function of input size, interpolated between quoted sizes
+class PriceImpactCurve:
+    def __init__(self, points: list):
+        self.points = sorted(dict(points).items())
+        self.sizes = [size for size, _ in self.points]
+
+    def output(self, qty: int) -> int:
+        points = self.points
+        if len(points) == 1 or qty <= points[0][0]:
+            size, output = points[0]
+            return output * qty // size
+        for (size_a, output_a), (size_b, output_b) in zip(points, points[1:]):
+            if qty <= size_b:
+                return output_a + (output_b - output_a) * (qty - size_a) // (size_b - size_a)
+        # Past the last size, extend the last segment's marginal rate
+        (size_a, output_a), (size_b, output_b) = points[-2], points[-1]
+        return output_b + (output_b - output_a) * (qty - size_b) // (size_b - size_a)
+
+# Caches quoter results for the current block, keyed by (direction, fee tier, size bucket).
+# Sizes within the same ~1% bucket are answered by scaling the cached quote.
+class QuoteCache:
+    def __init__(self, get_w3: Callable, bucket_width: float = 0.01, block_time: float = 2):
+        self.get_w3 = get_w3 # the w3 is only built once quotes are needed
+        self.bucket_log = math.log(1 + bucket_width)
+        self.block_time = block_time # seconds between block number checks
+
+        self.lock = threading.Lock()
+        self.block = None
+        self.block_checked = 0
+        self.quotes = {}
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+
+    # Drops every quote once a new block is seen
+    def refresh_block(self) -> None:
+        now = time.time()
+        if now < self.block_checked + self.block_time:
+            return
+        block = self.get_w3().eth.block_number
+        with self.lock:
+            self.block_checked = now
+            if block != self.block:
+                self.block = block
+                self.quotes = {}
+
+    def key(self, token_in: str, token_out: str, qty: int, fee: int):
+        return (token_in, token_out, fee, round(math.log(qty) / self.bucket_log))
+
+    # Non-positive sizes have no bucket and are never cached
+    def get(self, token_in: str, token_out: str, qty: int, fee: int):
+        if qty <= 0:
+            return None
+        with self.lock:
+            cached = self.quotes.get(self.key(token_in, token_out, qty, fee))
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        cached_qty, cached_output = cached
+        return cached_output * qty // cached_qty
+
+    def put(self, token_in: str, token_out: str, qty: int, fee: int, output: int) -> None:
+        if qty <= 0:
+            return
+        with self.lock:
+            self.quotes[self.key(token_in, token_out, qty, fee)] = (qty, output)
 
 class Uniswapper:
     def __init__(self, pair: TokenPairs,
@@ -15,7 +95,11 @@ class Uniswapper:
                     market_price: TokenPrice, 
                     gas_price: TokenPrice, 
                     beta: Decimal,
-                    logger: Logger):
+                    logger: Logger,
+                    on_confirmed: Callable = None,
+                    confirm_deadline: float = 60,
+                    quote_deadline: float = 2,
+                    nonce_manager=None):
         
         self.pair = pair
         self.quoteERC20 = quoteERC20
@@ -24,19 +108,14 @@ class Uniswapper:
         self.market_price = market_price
         self.gas_price = gas_price
 
-        address = os.getenv("WALLET")         # or None if you're not going to make transactions
-        private_key = os.getenv("KEY") # or None if you're not going to make transactions
-        version = 3              # specify which version of Uniswap to use
-        provider = os.getenv("HTTP_NODE_URL")    # can also be set through the environment variable `PROVIDER`
+        # Uniswap client, connected on first use so runs without --swap never build it
+        self._uniswap = None
+        self.uniswap_lock = threading.Lock()
 
-        self.uniswap = Uniswap(address=address, private_key=private_key, version=version, provider=provider)
+        # With --pipeline swaps take their nonce from the same NonceManager as orders
+        self.nonce_manager = nonce_manager
 
-        self.swap_gas = []
-        self.swap_price = []
-        self.swap_amt = []
-
-        # Hold the loss on each
-        self.swap_losses = []
+        # Loss on each swap is recorded in logger.uniswapper_losses
         # TODO: 2. use hex to get gas spend and value of trade for uniswap
         # track uniswap gas spend here
         # market price at time of trade and trade value, should be able to track % loss per swap
@@ -48,113 +127,299 @@ class Uniswapper:
         # Logger object
         self.logger = logger
 
-    def swap(self, side: OrderSide, trade_amt: int, base_allowance: Decimal, set_closest: bool, next_fee: bool = False) -> int:
+        # Swaps are confirmed in the background; on_confirmed(receipt) is called once mined
+        self.on_confirmed = on_confirmed
+        self.confirm_deadline = confirm_deadline # seconds
+        self.confirmer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="swap-confirm")
+        self.pending = None
+        # Held from the pending check until the swap is submitted, set_limit and the rebalancer swap from different threads
+        self.swap_lock = threading.Lock()
+
+        # Every fee tier and ladder size is quoted at once, under one deadline
+        self.quote_deadline = quote_deadline # seconds
+        self.quoter = ThreadPoolExecutor(max_workers=len(self.pair.config.fee_tiers)*len(ladder_multipliers), thread_name_prefix="uni-quote")
+        self.quote_cache = QuoteCache(lambda: self.uniswap.w3)
+        self.dead_tiers = {}            # fee tier: time every size reverted
+        self.dead_tier_ttl = 3600       # seconds before a dead tier is quoted again, a pool may have been created
+
+    @property
+    def uniswap(self):
+        if self._uniswap is None:
+            with self.uniswap_lock:
+                if self._uniswap is None:
+                    from uniswap import Uniswap
+
+                    address = os.getenv("WALLET")         # or None if you're not going to make transactions
+                    private_key = os.getenv("KEY") # or None if you're not going to make transactions
+                    version = 3              # specify which version of Uniswap to use
+                    provider = os.getenv("HTTP_NODE_URL")    # can also be set through the environment variable `PROVIDER`
+
+                    self._uniswap = Uniswap(address=address, private_key=private_key, version=version, provider=provider)
+        return self._uniswap
+
+    # Quoter call answered from the block cache when possible
+    def get_price_input(self, token_in: str, token_out: str, qty: int, fee: int) -> int:
+        output = self.quote_cache.get(token_in, token_out, qty, fee)
+        if output is None:
+            output = self.uniswap.get_price_input(token_in, token_out, qty, fee=fee)
+            self.quote_cache.put(token_in, token_out, qty, fee, output)
+        return output
+
+    # Quotes every (fee tier, size) at once under one deadline and returns a curve per fee tier.
+    # Fails fast with CircuitOpen while the quoter breaker is open.
+    def quote_ladder(self, token_in: str, token_out: str, sizes: list) -> dict:
+        breaker = breakers.get("quoter")
+        if not breaker.allow():
+            raise CircuitOpen("swap: quoter circuit open")
+        # Any error counts against the breaker, a half open probe must always report back
+        try:
+            points = self.quote_points(token_in, token_out, sizes)
+        except Exception:
+            breaker.record(False)
+            raise
+        breaker.record(len(points) > 0)
+        if len(points) == 0:
+            raise Exception(f"swap: no fee tier quoted within {self.quote_deadline}s")
+        return {fee: PriceImpactCurve(fee_points) for fee, fee_points in points.items()}
+
+    # {fee tier: [(size, output)]} of the quotes that came back in time
+    def quote_points(self, token_in: str, token_out: str, sizes: list) -> dict:
+        start_time = time.time()
+        self.quote_cache.refresh_block()
+        futures = {}
+        for fee in self.pair.config.fee_tiers:
+            marked = self.dead_tiers.get(fee)
+            if marked is not None and start_time < marked + self.dead_tier_ttl:
+                continue
+            for size in sizes:
+                futures[self.quoter.submit(self.get_price_input, token_in, token_out, size, fee)] = (fee, size)
+        done, not_done = wait(futures, timeout=self.quote_deadline)
+
+        points = {}
+        reverted = {}
+        for future in done:
+            fee, size = futures[future]
+            if future.exception() is None:
+                points.setdefault(fee, []).append((size, future.result()))
+            # Tiers without a pool revert, other errors (node, rate limits) say nothing about the tier
+            elif isinstance(future.exception(), ContractLogicError):
+                reverted[fee] = reverted.get(fee, 0) + 1
+        self.logger.uni_quote_latency.append(time.time() - start_time)
+
+        # Stop quoting tiers where every size reverted for a while
+        for fee, count in reverted.items():
+            if count == len(sizes):
+                self.dead_tiers[fee] = start_time
+        return points
+
+    # Price of base in quote for a swap of qty in to output out
+    def swap_price(self, side: OrderSide, qty: int, output: int) -> Decimal:
+        if side == OrderSide.BUY:
+            return self.quoteERC20.to_decimal(number=output) / self.baseERC20.to_decimal(number=qty)
+        return self.quoteERC20.to_decimal(number=qty) / self.baseERC20.to_decimal(number=output)
+
+    def within_beta(self, side: OrderSide, qty: int, output: int) -> bool:
+        if side == OrderSide.BUY:
+            return self.swap_price(side, qty, output) >= (Decimal('1') - self.beta) * self.market_price.price
+        return self.swap_price(side, qty, output) <= (Decimal('1') + self.beta) * self.market_price.price
+
+    # Value given up on a swap, in quote
+    def expected_loss(self, side: OrderSide, qty: int, output: int) -> Decimal:
+        if side == OrderSide.BUY:
+            return self.market_price.price * self.baseERC20.to_decimal(number=qty) - self.quoteERC20.to_decimal(number=output)
+        return self.quoteERC20.to_decimal(number=qty) - self.baseERC20.to_decimal(number=output) * self.market_price.price
+
+    # Sends the swap and returns its transaction hash
+    def make_trade(self, token_in: str, token_out: str, qty: int, fee: int) -> HexBytes:
+        if self.nonce_manager is None:
+            return self.uniswap.make_trade(token_in, token_out, qty=qty, fee=fee)
+        # The Uniswap client counts nonces itself, hand it the next one of the
+        # pipeline's so the swap can't collide with orders in flight
+        nonce = self.nonce_manager.next_nonce()
+        try:
+            self.uniswap.last_nonce = nonce
+            return self.uniswap.make_trade(token_in, token_out, qty=qty, fee=fee)
+        except Exception:
+            self.nonce_manager.release(nonce)
+            self.nonce_manager.resync()
+            raise
+        finally:
+            self.nonce_manager.release(nonce)
+
+    # True while a submitted swap hasn't been confirmed yet
+    def swap_pending(self) -> bool:
+        return self.pending is not None and not self.pending.done()
+
+    # grow lets the swap go above trade_amt when a larger size still meets beta
+    @metrics.timed("swap")
+    @tracer.traced("swap")
+    def swap(self, side: OrderSide, trade_amt: int, base_allowance: Decimal, set_closest: bool, next_fee: bool = False, grow: bool = True) -> int:
+        with self.swap_lock:
+            result = self._swap(side, trade_amt, base_allowance, set_closest, next_fee, grow)
+            pending = self.pending
+        # Outside the lock, a swap confirmed already calls back on this thread
+        if result == 1:
+            pending.add_done_callback(self.confirmed)
+        return result
+
+    def _swap(self, side: OrderSide, trade_amt: int, base_allowance: Decimal, set_closest: bool, next_fee: bool, grow: bool) -> int:
         # Where side is the trade that I'm trying to make on the rubicon end, so this
         # will be the opposite. I.e. I want to make a bid (buy weth with usdc), but I'm out of USDC,
         # so need to trade WETH for USDC first.
-        base = self.pair.get_checksum_addresses()[0]
-        quote = self.pair.get_checksum_addresses()[1]
+        base = self.pair.config.base.checksum
+        quote = self.pair.config.quote.checksum
 
-        pre_value = self.calculate_wallet_value()
+        if self.swap_pending():
+            print(f"\t\tswap: previous swap still confirming, not swapping on {side}")
+            return 0
 
         # Trying to buy base w/ quote on rubicon, but not enough quote
         # trade base I have for quote on uniswap
         if side == OrderSide.BUY:
-            try:
-                # Amount for a full trade
-                amt = int(base_allowance * Decimal(10 ** self.baseERC20.decimal) * Decimal("1.05")) # plus 5 %
-                amt_check = trade_amt if set_closest else amt + trade_amt
-                print(f"{side} | amt = {amt} | amt_check = {amt_check} | trade_amt = {trade_amt}")
-                base_balance = self.baseERC20.balance_of(account=os.getenv("WALLET"))
-                if base_balance >= amt_check:
-                    
-                    ### Check Price
-                    min_swap_price = (Decimal('1') - self.beta) * self.market_price.price
-                    # quote
-                    max_output = self.uniswap.get_price_input(base, quote, qty=trade_amt,fee=self.pair.get_uniswap_fee())
-                    # base
-                    readable_amt = (trade_amt / Decimal(10**self.baseERC20.decimal))
-                    # quote
-                    readable_max_output = (Decimal(str(max_output))) / Decimal(10**self.quoteERC20.decimal)
-                    swap_price = readable_max_output/readable_amt
-
-                    expected_loss = self.market_price.price * readable_amt - readable_max_output
-                    # print(f"{side} - swap_price is {swap_price}, min_swap_price is {min_swap_price}")
-                    # print(f"{side} - expected loss is {expected_loss}")
-                    if swap_price < min_swap_price:
-                        self.logger.expected_uni_losses_not_taken.append(expected_loss)
-                        print(f"\t\tswap: bad price - swap on {side} for price {swap_price}")
-                        return -2
-                    else:
-                        self.logger.expected_uni_losses_taken.append(expected_loss)
-
-                    # Make Swap
-                    hex = self.uniswap.make_trade(base , quote, qty=trade_amt,fee=self.pair.get_uniswap_fee())
-                    print(f"swap: Uniswap result hex = {hex.hex}")
-                    time.sleep(10)
-                    post_value = self.calculate_wallet_value()
-                    print(f"\t\tswap: Value lost on uniswap = {pre_value - post_value}")
-                    self.swap_losses.append(pre_value - post_value)
-                    return 1
-                else:
-                    print(f"swap: Not enough funds to execute swap on {side}. amt = {amt}")
-                    return 0
-            except Exception as e:
-                print(f"ERROR - swap: traceback")
-                print(e)
-                return -1
-        
-        # Trying to buy base w/ quote on rubicon, but not enough quote
-        # trade base I have for quote on uniswap
+            token_in, token_out, erc20_in = base, quote, self.baseERC20
+            # Amount for a full trade
+            amt = int(base_allowance * Decimal(10 ** self.baseERC20.decimal) * Decimal("1.05")) # plus 5 %
+
+        # Trying to sell base for quote on rubicon, but not enough base
+        # trade quote I have for base on uniswap
         elif side == OrderSide.SELL:
-            try:
-                amt = int(self.market_price.price * base_allowance * Decimal(10 ** self.quoteERC20.decimal) * Decimal("1.05"))
-                amt_check = trade_amt if set_closest else amt + trade_amt
-                print(f"{side} | amt = {amt} | amt_check = {amt_check} | trade_amt = {trade_amt}")
-                quote_balance = self.quoteERC20.balance_of(account=os.getenv("WALLET"))
-                if quote_balance >= amt_check:
-
-                    ## Check Price
-                    max_swap_price = (Decimal('1') + self.beta) * self.market_price.price
-                    # base
-                    max_output = self.uniswap.get_price_input(quote, base, qty=trade_amt,fee=self.pair.get_uniswap_fee())
-                    # quote
-                    readable_amt = (trade_amt / Decimal(10**self.quoteERC20.decimal))
-                    # base
-                    readable_max_output = (Decimal(str(max_output))) / Decimal(10**self.baseERC20.decimal)
-                    swap_price = readable_amt/readable_max_output
-                    expected_loss = readable_amt-readable_max_output * self.market_price.price
-                    # print(f"{side} - swap_price is {swap_price}, max_swap_price is {max_swap_price}")
-                    # print(f"{side} - expected loss is {expected_loss}")
-                    if swap_price > max_swap_price:
-                        self.logger.expected_uni_losses_not_taken.append(expected_loss)
-                        print(f"\t\tswap: bad price - swap on {side} for price {swap_price}")
-                        return -2
-                    else:
-                        self.logger.expected_uni_losses_taken.append(expected_loss)
-
-
-                    # Make Swap
-                    hex = self.uniswap.make_trade(quote, base, qty=trade_amt,fee=self.pair.get_uniswap_fee())
-                    print(f"swap: Uniswap result hex = {hex.hex}")
-                    time.sleep(10)
-                    post_value = self.calculate_wallet_value()
-                    print(f"\t\tswap: Value lost on uniswap = {pre_value - post_value}")
-                    self.swap_losses.append(pre_value - post_value)
-                    return 1
+            token_in, token_out, erc20_in = quote, base, self.quoteERC20
+            amt = int(self.market_price.price * base_allowance * Decimal(10 ** self.quoteERC20.decimal) * Decimal("1.05"))
+
+        try:
+            # Keep a full trade's worth unless set_closest
+            reserve = 0 if set_closest else amt
+            print(f"{side} | amt = {amt} | amt_check = {trade_amt + reserve} | trade_amt = {trade_amt}")
+            with tracer.stage("balance"):
+                balance = erc20_in.balance_of(account=os.getenv("WALLET"))
+            if balance < trade_amt + reserve:
+                print(f"swap: Not enough funds to execute swap on {side}. amt = {amt}")
+                return 0
+
+            ### Check Price
+            # Quote a ladder of sizes around trade_amt; a bigger swap now means fewer swaps later
+            # Small trades can round the lower sizes down to nothing
+            sizes = [int(trade_amt * multiplier) for multiplier in ladder_multipliers if grow or multiplier <= 1]
+            sizes = [size for size in sizes if size > 0]
+            with tracer.stage("quote"):
+                curves = self.quote_ladder(token_in, token_out, sizes)
+            best_fee = max(curves, key=lambda fee: curves[fee].output(trade_amt))
+            expected_loss = self.expected_loss(side, trade_amt, curves[best_fee].output(trade_amt))
+
+            # Largest size that covers trade_amt, fits the balance and still meets beta
+            swap_amt = None
+            for size in sorted(set(sizes), reverse=True):
+                if size < trade_amt or size + reserve > balance:
+                    continue
+                fee = max(curves, key=lambda fee: curves[fee].output(size))
+                if self.within_beta(side, size, curves[fee].output(size)):
+                    swap_amt = size
+                    break
+
+            if swap_amt is None:
+                self.logger.expected_uni_losses_not_taken.append(expected_loss)
+                print(f"\t\tswap: bad price - swap on {side} for price {self.swap_price(side, trade_amt, curves[best_fee].output(trade_amt))}")
+                return -2
+
+            output = curves[fee].output(swap_amt)
+            self.logger.expected_uni_losses_taken.append(self.expected_loss(side, swap_amt, output))
+            self.logger.uni_route_fees.append(fee)
+            default_fee = self.pair.config.uniswap_fee
+            if default_fee in curves:
+                improvement = output - curves[default_fee].output(swap_amt)
+                if side == OrderSide.BUY:
+                    self.logger.uni_route_improvement.append(self.quoteERC20.to_decimal(number=improvement))
                 else:
-                    print(f"swap: Not enough funds to execute swap on {side}. amt = {amt}")
-                    return 0
-            except Exception as e:
-                print(f"ERROR - swap: traceback")
-                print(e)
-                return -1
-    
+                    self.logger.uni_route_improvement.append(self.baseERC20.to_decimal(number=improvement) * self.market_price.price)
+            print(f"\t\tswap: swapping {swap_amt} (needed {trade_amt}) on fee {fee} for price {self.swap_price(side, swap_amt, output)}")
+
+            # Make Swap
+            with tracer.stage("trade"):
+                hex = self.make_trade(token_in, token_out, qty=swap_amt, fee=fee)
+            print(f"swap: Uniswap result hex = {hex.hex()}")
+            self.pending = self.confirmer.submit(self.confirm, hex, side, self.market_price.price)
+            return 1
+
+        except Exception as e:
+            print(f"ERROR - swap: traceback")
+            print(e)
+            return -1
+
+    # Waits for a swap's reciept and records the realised loss. Runs on the confirmer thread.
+    def confirm(self, tx_hash, side: OrderSide, market_price: Decimal):
+        receipt = self.wait_for_receipt(tx_hash)
+        if receipt is None:
+            print(f"ERROR - swap: no reciept for {tx_hash.hex()} after {self.confirm_deadline}s")
+            self.logger.swap_timeouts += 1
+            metrics.counter("swap_confirmations_total", "Swap outcomes once confirmed").inc(status="timeout")
+            return None
+        if receipt['status'] != 1:
+            print(f"ERROR - swap: swap {tx_hash.hex()} reverted")
+            self.logger.swap_error += 1
+            metrics.counter("swap_confirmations_total", "Swap outcomes once confirmed").inc(status="reverted")
+            return receipt
+
+        loss = self.realised_loss(receipt, side, market_price)
+        print(f"\t\tswap: Value lost on uniswap = {loss}")
+        self.logger.record_swap_loss(loss)
+        metrics.counter("swap_confirmations_total", "Swap outcomes once confirmed").inc(status="success")
+        return receipt
+
+    # Calls on_confirmed for a mined swap. Runs once the confirm future is done,
+    # so the order_loop it starts no longer sees the swap as pending.
+    def confirmed(self, future: Future) -> None:
+        receipt = None if future.exception() is not None else future.result()
+        if receipt is not None and receipt['status'] == 1 and self.on_confirmed is not None:
+            self.on_confirmed(receipt)
+
+    # Polls for a reciept with exponential backoff until the deadline, None if it never arrives
+    def wait_for_receipt(self, tx_hash, poll_time: float = 0.25, max_poll_time: float = 4):
+        deadline = time.time() + self.confirm_deadline
+        while time.time() < deadline:
+            try:
+                return self.uniswap.w3.eth.get_transaction_receipt(tx_hash)
+            except TransactionNotFound:
+                time.sleep(min(poll_time, max(deadline - time.time(), 0)))
+                poll_time = min(poll_time * 2, max_poll_time)
+        return None
+
+    # Loss in quote from the token transfers in the reciept plus gas paid
+    def realised_loss(self, receipt, side: OrderSide, market_price: Decimal) -> Decimal:
+        base_delta = self.transfer_delta(receipt, self.pair.config.base.checksum)
+        quote_delta = self.transfer_delta(receipt, self.pair.config.quote.checksum)
+        base_change = self.baseERC20.to_decimal(number=base_delta)
+        quote_change = self.quoteERC20.to_decimal(number=quote_delta)
+        loss = -(base_change * market_price + quote_change)
+
+        if self.pair.network.l1_fees:
+            gas_wei = receipt['gasUsed'] * receipt['effectiveGasPrice']
+            l1_fee = receipt.get('l1Fee', 0)
+            gas_wei += int(l1_fee, 16) if isinstance(l1_fee, str) else l1_fee
+            loss += self.gasERC20.to_decimal(number=gas_wei) * self.gas_price.price
+        return loss
+
+    # Net amount of a token moved into the wallet by a reciept's Transfer logs
+    def transfer_delta(self, receipt, token_address: str) -> int:
+        wallet = HexBytes(os.getenv("WALLET"))
+        delta = 0
+        for log in receipt['logs']:
+            if log['address'].lower() != token_address.lower() or len(log['topics']) < 3:
+                continue
+            if HexBytes(log['topics'][0]) != HexBytes(transfer_topic):
+                continue
+            amount = int.from_bytes(HexBytes(log['data']), 'big')
+            # Topics are the addresses left padded to 32 bytes
+            if HexBytes(log['topics'][1])[-20:] == wallet:
+                delta -= amount
+            if HexBytes(log['topics'][2])[-20:] == wallet:
+                delta += amount
+        return delta
+
     # Calculates value of wallet
     def calculate_wallet_value(self) -> Decimal:
         base_value = self.baseERC20.to_decimal(number=self.baseERC20.balance_of(account=os.getenv("WALLET")))*self.market_price.price
         quote_value = self.quoteERC20.to_decimal(number=self.quoteERC20.balance_of(account=os.getenv("WALLET")))
-        if self.pair == TokenPairs.WETH_USDC_ARB:
+        if not self.pair.network.l1_fees:
             gas_value = 0
         else:
             gas_value = self.gasERC20.to_decimal(number=self.gasERC20.balance_of(account=os.getenv("WALLET")))*self.gas_price.price
@@ -0,0 +1,55 @@
+import os, sys, pickle, random, threading
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rubi import OrderSide
+from pricelevels import PriceLevelIndex
+
+def book(seed: int, offers: int = 200) -> list:
+    rng = random.Random(seed)
+    return [(f"0x{i:x}", Decimal(1800 + rng.randint(0, 50)), Decimal(rng.randint(1, 10)), i, i % 7 == 0)
+            for i in rng.sample(range(offers * 2), offers)]
+
+# Polls sync the index from several threads at once, it must end up holding
+# exactly one of the books with every subtree sum intact
+def test_sync_from_threads_keeps_the_index_whole():
+    index = PriceLevelIndex(OrderSide.SELL)
+    books = [book(seed) for seed in range(4)]
+    errors = []
+
+    def sync(offers: list) -> None:
+        try:
+            for _ in range(50):
+                index.sync(offers)
+                index.levels(5)
+                index.price_at_depth(Decimal(20))
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=sync, args=(offers,)) for offers in books]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert errors == []
+    last = [offers for offers in books if {offer[0] for offer in offers} == set(index.keys)]
+    assert len(last) == 1
+    assert len(index) == len(last[0])
+    assert index.depth(Decimal(10**6)) == sum(offer[2] for offer in last[0])
+
+def test_price_at_no_depth_is_the_best_price():
+    index = PriceLevelIndex(OrderSide.BUY)
+    index.sync(book(0))
+    assert index.price_at_depth(Decimal(0)) == index.best_price()
+    assert PriceLevelIndex(OrderSide.BUY).price_at_depth(Decimal(0)) is None
+
+def test_index_survives_a_snapshot():
+    index = PriceLevelIndex(OrderSide.SELL)
+    index.sync(book(1))
+    restored = pickle.loads(pickle.dumps(index))
+    restored.sync(book(2))
+    fresh = PriceLevelIndex(OrderSide.SELL)
+    fresh.sync(book(2))
+    assert restored.levels(10) == fresh.levels(10)
@@ -0,0 +1,56 @@
+import os, sys, struct, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ratelimit
+from ratelimit import SharedTokenBucket, RateLimited, bucket_format
+from breaker import Breakers
+
+def tokens_left(bucket: SharedTokenBucket) -> float:
+    return struct.unpack(bucket_format, os.pread(bucket.fd, struct.calcsize(bucket_format), 0))[0]
+
+# Threads sharing one bucket, and a second bucket on the same file standing in
+# for another process, all draw from the same balance. The clock is frozen so
+# nothing refills and every reservation has to show up in the file.
+def test_reservations_from_threads_and_processes_are_all_counted(tmp_path, monkeypatch):
+    monkeypatch.setattr(ratelimit.time, "time", lambda: 1000.0)
+    burst, threads, calls = 100000.0, 8, 10000
+    bucket = SharedTokenBucket("example.com", 1, burst, str(tmp_path))
+    other = SharedTokenBucket("example.com", 1, burst, str(tmp_path))
+
+    # Asserts in a worker thread don't fail the test, the waits are checked below
+    waits = []
+    def reserve(bucket: SharedTokenBucket) -> None:
+        waits.extend(bucket.reserve(max_wait=float("inf")) for _ in range(calls))
+
+    workers = [threading.Thread(target=reserve, args=(bucket if i % 2 else other,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(waits) == threads * calls
+    assert None not in waits
+    assert tokens_left(bucket) == burst - threads * calls
+
+# Requests our own limit holds back never reached the host, so they neither
+# open its breaker nor use up a half open probe
+def test_rate_limited_calls_do_not_count_against_the_breaker():
+    breaker = Breakers().get("example")
+
+    def limited():
+        raise RateLimited("over the rate limit")
+
+    for _ in range(breaker.failure_threshold + 1):
+        try:
+            breaker.call(limited)
+        except RateLimited:
+            pass
+    assert breaker.state == "closed"
+
+    breaker.state, breaker.retry_at = "open", 0
+    try:
+        breaker.call(limited)
+    except RateLimited:
+        pass
+    assert breaker.state == "half_open" and breaker.allow()
@@ -0,0 +1,86 @@
+import os, sys, threading
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hexbytes import HexBytes
+from rubi import OrderSide
+from pairs import TokenPairs
+from swap import Uniswapper
+from transactionLogging import Logger
+
+token = TokenPairs.WETH_USDC
+wallet = "0x" + "11" * 20
+tx_hash = HexBytes("0x" + "ab" * 32)
+
+class FakeERC20:
+    def __init__(self, decimal: int, balance: int):
+        self.decimal = decimal
+        self.balance = balance
+
+    def balance_of(self, account: str) -> int:
+        return self.balance
+
+    def to_decimal(self, number: int) -> Decimal:
+        return Decimal(number) / Decimal(10 ** self.decimal)
+
+class FakePrice:
+    def __init__(self, price: Decimal):
+        self.price = price
+
+class FakeEth:
+    block_number = 1
+
+    def get_transaction_receipt(self, tx_hash):
+        return {"status": 1, "logs": [], "gasUsed": 100000, "effectiveGasPrice": 1, "l1Fee": 0}
+
+class FakeW3:
+    eth = FakeEth()
+
+# Quoter pricing every tier at the market price less the tier's fee
+class FakeUniswap:
+    def __init__(self, price: Decimal, base: FakeERC20, quote: FakeERC20):
+        self.price = price
+        self.base = base
+        self.quote = quote
+        self.w3 = FakeW3()
+        self.trades = []
+
+    def get_price_input(self, token_in: str, token_out: str, qty: int, fee: int) -> int:
+        keep = 1 - Decimal(fee) / Decimal(10**6)
+        if token_in == token.config.base.checksum:
+            return int(self.base.to_decimal(qty) * self.price * keep * 10 ** self.quote.decimal)
+        return int(self.quote.to_decimal(qty) / self.price * keep * 10 ** self.base.decimal)
+
+    def make_trade(self, token_in: str, token_out: str, qty: int, fee: int) -> HexBytes:
+        self.trades.append((token_in, token_out, qty, fee))
+        return tx_hash
+
+def uniswapper(beta: Decimal, on_confirmed=None) -> Uniswapper:
+    price = FakePrice(Decimal(2000))
+    base, quote, gas = FakeERC20(18, 10 * 10**18), FakeERC20(6, 100000 * 10**6), FakeERC20(18, 10**18)
+    swapper = Uniswapper(pair=token, quoteERC20=quote, baseERC20=base, gasERC20=gas, market_price=price,
+                         gas_price=price, beta=beta, logger=Logger(token), on_confirmed=on_confirmed)
+    swapper._uniswap = FakeUniswap(price.price, base, quote)
+    return swapper
+
+def test_swap_trades_on_the_cheapest_tier_and_confirms(monkeypatch):
+    monkeypatch.setenv("WALLET", wallet)
+    confirmed = threading.Event()
+    swapper = uniswapper(Decimal("0.01"), on_confirmed=lambda receipt: confirmed.set())
+    trade_amt = 1000 * 10**6
+
+    assert swapper.swap(OrderSide.SELL, trade_amt, Decimal("0.1"), set_closest=True) == 1
+    assert confirmed.wait(5)
+    assert not swapper.swap_pending()
+
+    (token_in, token_out, qty, fee), = swapper.uniswap.trades
+    assert (token_in, token_out, fee) == (token.config.quote.checksum, token.config.base.checksum, min(token.config.fee_tiers))
+    assert qty >= trade_amt
+
+def test_swap_refuses_a_price_beyond_beta(monkeypatch):
+    monkeypatch.setenv("WALLET", wallet)
+    swapper = uniswapper(Decimal("0.00001"))
+
+    assert swapper.swap(OrderSide.BUY, 10**17, Decimal("0.1"), set_closest=True) == -2
+    assert swapper.uniswap.trades == []
@@ -0,0 +1,180 @@
+import sys, time, threading
+from collections import deque
+from functools import wraps
+from typing import Callable
+
+from metrics import metrics
+
+# Stand-in returned while tracing is off so a stage costs one attribute check
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+null_stage = NullStage()
+
+class Stage:
+    def __init__(self, tracer, name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.tracer.local.stack.append(self.name)
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start_time
+        local = self.tracer.local
+        key = "/".join(local.stack)
+        local.stack.pop()
+        local.stages[key] = local.stages.get(key, 0) + duration
+        return False
+
+# Records how long each stage of a pass (one order_loop or arb_checker run) took.
+# Stages are keyed by their nesting, e.g. "set_limit/swap/quote". Passes slower
+# than slow_threshold are printed and kept with their full breakdown.
+class Tracer:
+    def __init__(self, slow_passes: int = 50):
+        self.enabled = False
+        self.slow_threshold = None # seconds
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        self.slow_passes = deque(maxlen=slow_passes)
+        self.stage_totals = {} # stage: [total seconds, count]
+        self.passes = 0
+
+        self.profiler = None
+
+    def enable(self, slow_threshold: float) -> None:
+        self.slow_threshold = slow_threshold
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def stage(self, name: str):
+        if not self.enabled or getattr(self.local, "stages", None) is None:
+            return null_stage
+        return Stage(self, name)
+
+    # Decorator timing a function as a stage of whatever pass is running
+    def traced(self, name: str) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Decorator starting a pass, or acting as a stage if a pass is already running on this thread
+    def trace_pass(self, name: str) -> Callable:
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or getattr(self.local, "stages", None) is not None:
+                    with self.stage(name):
+                        return func(*args, **kwargs)
+
+                self.local.stages = {}
+                self.local.stack = []
+                start_time = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    total = time.perf_counter() - start_time
+                    stages = self.local.stages
+                    self.local.stages = None
+                    self.end_pass(name, total, stages)
+            return wrapper
+        return decorator
+
+    def end_pass(self, name: str, total: float, stages: dict) -> None:
+        with self.lock:
+            self.passes += 1
+            for key, duration in stages.items():
+                stage_total = self.stage_totals.setdefault(f"{name}/{key}", [0, 0])
+                stage_total[0] += duration
+                stage_total[1] += 1
+        for key, duration in stages.items():
+            metrics.histogram("stage_seconds", "Time spent per stage of a pass").observe(duration, stage=f"{name}/{key}")
+
+        if self.slow_threshold is not None and total >= self.slow_threshold:
+            self.slow_passes.append((time.time(), name, total, stages))
+            print(f"WARNING - {name}: slow pass took {total:.3f}s")
+            print(format_stages(stages))
+
+    def report(self) -> str:
+        lines = [f"passes traced: {self.passes} || tracing enabled: {self.enabled} || slow threshold: {self.slow_threshold}s", "", "Average per stage:"]
+        with self.lock:
+            for key, (total, count) in sorted(self.stage_totals.items()):
+                lines.append(f"\t{key}: {total / count:.4f}s avg over {count}")
+        lines += ["", "Slow passes:"]
+        for ts, name, total, stages in list(self.slow_passes):
+            lines.append(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts))} {name} {total:.3f}s")
+            lines.append(format_stages(stages))
+        return "\n".join(lines) + "\n"
+
+    ##### Sampling profiler #####
+
+    def start_profile(self, interval: float = 0.005) -> bool:
+        with self.lock:
+            if self.profiler is not None:
+                return False
+            self.profiler = SamplingProfiler(interval)
+        self.profiler.start()
+        return True
+
+    def stop_profile(self) -> str:
+        with self.lock:
+            profiler = self.profiler
+            self.profiler = None
+        if profiler is None:
+            return ""
+        profiler.stop()
+        return profiler.collapsed()
+
+def format_stages(stages: dict) -> str:
+    return "\n".join(f"\t\t{key}: {duration:.4f}s" for key, duration in sorted(stages.items()))
+
+# Samples every other thread's stack at a fixed interval until stopped.
+# Output is in collapsed stack format (one "frame;frame;frame count" per line).
+class SamplingProfiler:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = {}
+        self.sample_count = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_filename.split('/')[-1]}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.sample_count += 1
+
+    def collapsed(self) -> str:
+        lines = [f"{stack} {count}" for stack, count in sorted(self.samples.items(), key=lambda item: -item[1])]
+        return "\n".join(lines) + "\n"
+
+# Shared by every module in the process
+tracer = Tracer()
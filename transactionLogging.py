@@ -1,16 +1,108 @@
 import time
 
+from array import array
+from contextlib import nullcontext
 from rubi import OrderSide
 from _decimal import Decimal
+from store import action_codes, side_codes
+
+# Fixed size, array backed history of the most recent values
+class RingBuffer:
+    def __init__(self, size: int):
+        self.values = array('d', bytes(8 * size))
+        self.size = size
+        self.index = 0
+        self.count = 0
+
+    def append(self, value) -> None:
+        self.values[self.index] = float(value)
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    # Oldest to newest
+    def recent(self) -> list:
+        if self.count < self.size:
+            return self.values[:self.count].tolist()
+        return (self.values[self.index:] + self.values[:self.index]).tolist()
+
+    def __len__(self):
+        return self.count
+
+# Running sum/count of a stream of values, with optional bounded recent history
+class RunningStat:
+    def __init__(self, history: int = 0):
+        self.total = 0
+        self.count = 0
+        self.history = RingBuffer(history) if history else None
+
+    def append(self, value) -> None:
+        self.total += value
+        self.count += 1
+        if self.history is not None:
+            self.history.append(value)
+
+    def average(self):
+        return self.total / self.count if self.count > 0 else 0
+
+    def __len__(self):
+        return self.count
+
+# Counts occurrences of each key (order sides, fee tiers)
+class Tally:
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+
+    def append(self, key) -> None:
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+
+    def get(self, key) -> int:
+        return self.counts.get(key, 0)
+
+    def __len__(self):
+        return self.count
+
+# Running volume and arb of fills on one side
+class FillStats:
+    def __init__(self, history: int = 0):
+        self.volume = Decimal(0)    # in dollars
+        self.arb = Decimal(0)       # in dollars, positive is a loss
+        self.count = 0
+        self.my_price = RingBuffer(history) if history else None
+        self.size = RingBuffer(history) if history else None
+        self.market_price = RingBuffer(history) if history else None
+
+    # Returns the fill's (volume, arb)
+    def record(self, side: OrderSide, price: Decimal, size: Decimal, market_price: Decimal):
+        volume = size * market_price
+        if side == OrderSide.BUY:
+            arb = (price - market_price) * size
+        else:
+            arb = (market_price - price) * size
+        self.volume += volume
+        self.arb += arb
+        self.count += 1
+        if self.my_price is not None:
+            self.my_price.append(price)
+            self.size.append(size)
+            self.market_price.append(market_price)
+        return volume, arb
 
 class Logger:
-    def __init__(self, token):
+    def __init__(self, token, history: int = 10000, store=None, journal=None):
         self.token = token
         self.times_printed = 0
 
+        # Optional ColumnarStore every fill, gas fee, cancel, swap loss and price is written to
+        self.store = store
+
+        # Optional Journal the record_* calls are written to before they are applied
+        self.journal = journal
+
         self.set_limit = 0
         self.best_offer = 0
-        self.insufficient_balance = []
+        self.insufficient_balance = Tally()
         self.insufficient_gas = 0
         self.spread_small = 0
         self.rubi_api_error = 0
@@ -19,46 +111,154 @@ class Logger:
         self.offer_fail = 0
         self.no_offer = 0
         self.not_best = 0
-        self.cancel = []
+        self.cancel = Tally()
         self.thresholds = 0
 
-        self.uniswap_sides = []
+        self.uniswap_sides = Tally()
         self.cancel_then_swaps = 0
         self.swap_error = 0
+        self.swap_pending = 0
+        self.swap_timeouts = 0
+        self.rebalance_swaps = 0
+        self.rebalance_bad_price = 0
 
-        self.insufficient_swaps_again = []
-        self.insufficient_swaps = []
+        self.insufficient_swaps_again = Tally()
+        self.insufficient_swaps = Tally()
 
 
         self.cancel_prevented = 0
         self.cancel_failed = 0
         self.update_placed = 0
         self.update_fail = 0
+        self.gas_gated = 0
 
         # Amount of eth (in dollars) paid on each transaction
-        self.offers_gas_fees = []
+        self.offers_gas_fees = RunningStat(history)
+        self.cancel_gas_fees = RunningStat(history)
+        self.update_gas_fees = RunningStat(history)
+
+        # Seconds spent waiting on each transaction reciept
+        self.offer_latency = RunningStat(history)
+        self.cancel_latency = RunningStat(history)
+        self.update_latency = RunningStat(history)
+
+        # Transaction batcher data
+        self.batched_actions = 0
+        self.batch_transactions = 0
+
+        # Transaction pipeline data
+        self.transactions_replaced = 0
+        self.nonce_resyncs = 0
 
         # Used to calculate % loss per order, total loss, 
-        self.ask_my_price = []
-        self.ask_volume = []
-        self.ask_market_price = []
-        self.bid_my_price = []
-        self.bid_volume = []
-        self.bid_market_price = []
+        self.ask_fills = FillStats(history)
+        self.bid_fills = FillStats(history)
 
         self.arb_cancel = 0
 
         # Uniswap trade data
         self.wallet_value = 0
         self.orders_value = 0
-        self.uniswapper_losses = []
+        self.uniswapper_losses = RunningStat(history)
 
         # Uniswap price query data
-        self.expected_uni_losses_taken = []
-        self.expected_uni_losses_not_taken = []
+        self.expected_uni_losses_taken = RunningStat(history)
+        self.expected_uni_losses_not_taken = RunningStat(history)
+
+        # Uniswap routing data
+        self.uni_route_fees = Tally()
+        self.uni_quote_latency = RunningStat(history)
+        self.uni_route_improvement = RunningStat(history)
+        self.uni_quote_hits = 0
+        self.uni_quote_misses = 0
 
         # Self takes
-        self.self_takes = []
+        self.self_takes = RunningStat(history)
+
+    # Records one of my orders being filled
+    def record_fill(self, side: OrderSide, price: Decimal, size: Decimal, market_price: Decimal) -> None:
+        if side not in (OrderSide.BUY, OrderSide.SELL):
+            raise ValueError("logger unexpected side")
+        with self.journaling("fill", side=side.value, price=price, size=size, market_price=market_price):
+            if side == OrderSide.BUY:
+                volume, arb = self.bid_fills.record(side, price, size, market_price)
+            else:
+                volume, arb = self.ask_fills.record(side, price, size, market_price)
+        if self.store is not None:
+            self.store.append("fills", side=store_side(side), price=price, size=size, market_price=market_price, volume=volume, arb=arb)
+
+    # Records gas (in dollars) paid by an offer, update, batch_cancel or swap
+    def record_gas(self, action: str, fee: Decimal) -> None:
+        if fee is None:
+            return
+        with self.journaling("gas", action=action, fee=fee):
+            match action:
+                case "offer":
+                    self.offers_gas_fees.append(fee)
+                case "update":
+                    self.update_gas_fees.append(fee)
+                case "batch_cancel":
+                    self.cancel_gas_fees.append(fee)
+        if self.store is not None:
+            self.store.append("gas", action=action_codes[action], fee=fee)
+
+    def record_cancel(self, side: OrderSide, count: int) -> None:
+        with self.journaling("cancel", side=side.value, count=count):
+            self.cancel.append(side)
+        if self.store is not None:
+            self.store.append("cancels", side=store_side(side), count=count)
+
+    # Orders cancelled by the anti-arb loop, on either side
+    def record_arb_cancel(self, count: int) -> None:
+        with self.journaling("arb_cancel", count=count):
+            self.arb_cancel += count
+        if self.store is not None:
+            self.store.append("cancels", side=0, count=count)
+
+    def record_swap_loss(self, loss: Decimal) -> None:
+        with self.journaling("swap_loss", loss=loss):
+            self.uniswapper_losses.append(loss)
+        if self.store is not None:
+            self.store.append("swaps", loss=loss)
+
+    def record_price(self, price: Decimal) -> None:
+        if self.store is not None and price is not None:
+            self.store.append("prices", price=price)
+
+    ##### Journal #####
+
+    def journaling(self, kind: str, **values):
+        return nullcontext() if self.journal is None else self.journal.entry(kind, **values)
+
+    # Counters and stats, everything but the token and where records are written
+    def snapshot(self) -> dict:
+        return {name: value for name, value in vars(self).items() if name not in ("token", "store", "journal")}
+
+    def restore(self, state: dict) -> None:
+        self.__dict__.update(state)
+
+    # Re-applies a journaled record_* call without writing it to the store or journal again.
+    # Counters bumped directly by app.py only come back from the snapshot.
+    def replay(self, entry: dict) -> bool:
+        store, journal = self.store, self.journal
+        self.store, self.journal = None, None
+        try:
+            match entry["k"]:
+                case "fill":
+                    self.record_fill(OrderSide(entry["side"]), Decimal(entry["price"]), Decimal(entry["size"]), Decimal(entry["market_price"]))
+                case "gas":
+                    self.record_gas(entry["action"], Decimal(entry["fee"]))
+                case "cancel":
+                    self.record_cancel(OrderSide(entry["side"]), entry["count"])
+                case "arb_cancel":
+                    self.record_arb_cancel(entry["count"])
+                case "swap_loss":
+                    self.record_swap_loss(Decimal(entry["loss"]))
+                case _:
+                    return False
+            return True
+        finally:
+            self.store, self.journal = store, journal
 
     def __str__(self):
         insuff_quote, insuff_base = parse_side(self.insufficient_balance)
@@ -68,29 +268,15 @@ class Logger:
         cancel_ask, cancel_bid = parse_side(self.cancel)
 
         # Get gas spend stats
-        total_gas_spent_rubi = sum(self.offers_gas_fees)
+        total_gas_spent_rubi = self.offers_gas_fees.total
         total_gasses_rubi = len(self.offers_gas_fees)
-        if total_gasses_rubi > 0:
-            avg_gas_rubi = total_gas_spent_rubi/Decimal(str(total_gasses_rubi))
-        else:
-            avg_gas_rubi = 0
+        avg_gas_rubi = self.offers_gas_fees.average()
 
         # in dollars
-        total_bid_volume = Decimal(0)
-        for idx in range(len(self.bid_volume)):
-            total_bid_volume += self.bid_volume[idx] * self.bid_market_price[idx]
-
-        total_ask_volume = Decimal(0)
-        for idx in range(len(self.ask_volume)):
-            total_ask_volume += self.ask_volume[idx]* self.ask_market_price[idx]
-
-        bid_arb = Decimal(0)
-        for idx in range(len(self.bid_my_price)):
-            bid_arb += (self.bid_my_price[idx] - self.bid_market_price[idx]) * self.bid_volume[idx]
-
-        ask_arb = Decimal(0)
-        for idx in range(len(self.ask_my_price)):
-            ask_arb += (self.ask_market_price[idx] - self.ask_my_price[idx]) * self.ask_volume[idx]
+        total_bid_volume = self.bid_fills.volume
+        total_ask_volume = self.ask_fills.volume
+        bid_arb = self.bid_fills.arb
+        ask_arb = self.ask_fills.arb
 
         if total_bid_volume > Decimal('0'):
             bid_arb_per_vol = bid_arb / total_bid_volume
@@ -111,16 +297,22 @@ class Logger:
             loss_per_vol = 0
 
         # uniswap
-        total_uni_loss = sum(self.uniswapper_losses)
+        total_uni_loss = self.uniswapper_losses.total
         uni_loss_per_volume = Decimal("0") if total_volume == 0 else total_uni_loss/total_volume
         
         gas_per_volume = Decimal("0") if total_volume == 0 else total_gas_spent_rubi/total_volume
 
+        # Requote in place vs cancel + new offer
+        avg_update_gas = self.update_gas_fees.average()
+        avg_cancel_offer_gas = self.cancel_gas_fees.average() + self.offers_gas_fees.average()
+        avg_update_latency = self.update_latency.average()
+        avg_cancel_offer_latency = self.cancel_latency.average() + self.offer_latency.average()
+
         losses_combined = total_uni_loss + total_arb + total_gas_spent_rubi
         losses_combined_per_volume = Decimal("0") if total_volume == 0 else losses_combined/total_volume
         
         # Self Takes
-        total_self_taken = sum(self.self_takes)
+        total_self_taken = self.self_takes.total
         actual_total_volume = total_volume - total_self_taken
         actual_losses_combeined_per_volume = Decimal("0") if total_volume == 0 else losses_combined/actual_total_volume
         
@@ -133,7 +325,7 @@ class Logger:
 
         out = f"\n\t\t-- Summary: {nice_date_time} CST --\n"
         out += f"\t\tTotal times set_limit called: {self.set_limit} \n"
-        out += f"\t\tTotal times NO action taken: {self.best_offer + insuff_quote + insuff_base + self.insufficient_gas + self.spread_small + self.rubi_api_error + self.price_api_error} \n"
+        out += f"\t\tTotal times NO action taken: {self.best_offer + insuff_quote + insuff_base + self.insufficient_gas + self.spread_small + self.rubi_api_error + self.price_api_error + self.gas_gated} \n"
         out += f"\t\t~ Best Offer: {self.best_offer} \n"
         out += f"\t\t~ Insufficiant quote: {insuff_quote} \n"
         out += f"\t\t~ Insufficiant base: {insuff_base} \n"
@@ -142,11 +334,16 @@ class Logger:
         out += f"\t\t~ Absurd Threshold Price: {self.thresholds} \n"
         out += f"\t\t~ Rubi API Error: {self.rubi_api_error} \n"
         out += f"\t\t~ Coinbase API Error: {self.price_api_error} \n"
+        out += f"\t\t~ Not worth gas: {self.gas_gated} \n"
         out += f"\t\tTotal times offer attempted: {self.no_offer+self.not_best} \n"
         out += f"\t\t~ No offer: {self.no_offer} \n"
         out += f"\t\t~ Not best: {self.not_best} \n"
         out += f"\t\tTotal times offer placed: {self.offer_placed} \n"
         out += f"\t\tTotal times offer failure occurred: {self.offer_fail} \n"
+        out += f"\t\tTotal times update placed: {self.update_placed} \n"
+        out += f"\t\tTotal times update failure occurred: {self.update_fail} \n"
+        out += f"\t\tTotal actions batched: {self.batched_actions} || in this many transactions: {self.batch_transactions} \n"
+        out += f"\t\tTotal stuck transactions replaced: {self.transactions_replaced} || nonce resyncs: {self.nonce_resyncs} \n"
         out += f"\t\tTotal times cancel placed: {len(self.cancel)} \n"
         out += f"\t\t~ Asks: {cancel_ask} \n"
         out += f"\t\t~ Bids: {cancel_bid} \n"
@@ -162,7 +359,11 @@ class Logger:
         out += f"\t\t~ Asks: {swap_insuff_ask_again} \n"
         out += f"\t\t~ Bids: {swap_insuff_bid_again} \n"
         out += f"\t\tTotal times cancelled then uniswap occurred: {self.cancel_then_swaps} \n"
-        out += f"\t\tTotal times swap error occured: {self.swap_error} \n\n"
+        out += f"\t\tTotal times swap error occured: {self.swap_error} \n"
+        out += f"\t\tTotal times waited on pending swap: {self.swap_pending} \n"
+        out += f"\t\tTotal times swap reciept timed out: {self.swap_timeouts} \n"
+        out += f"\t\tTotal background rebalance swaps: {self.rebalance_swaps} \n"
+        out += f"\t\t~ Skipped for bad price: {self.rebalance_bad_price} \n\n"
 
         out += f"\t\tTotal volume: ${total_volume} \n"
         out += f"\t\tActual Total volume (minus self-takes): ${actual_total_volume} \n"
@@ -181,7 +382,14 @@ class Logger:
         out += f"\t\tTotal Gas Spend: {total_gas_spent_rubi} \n"
         out += f"\t\t~ Over this many orders: {total_gasses_rubi} \n"        
         out += f"\t\t~ Avg Spend per Order: {avg_gas_rubi} \n"
-        out += f"\t\t~ Avg Spend per Volume: {gas_per_volume} \n\n"
+        out += f"\t\t~ Avg Spend per Volume: {gas_per_volume} \n"
+        out += f"\t\t~ Total Spend on updates: {self.update_gas_fees.total} \n"
+        out += f"\t\t~ Total Spend on cancels: {self.cancel_gas_fees.total} \n\n"
+
+        out += f"\t\tAvg update gas: {avg_update_gas} || Avg cancel + offer gas: {avg_cancel_offer_gas} \n"
+        out += f"\t\t~ Gas saved per requote: {avg_cancel_offer_gas - avg_update_gas if self.update_gas_fees else 0} \n"
+        out += f"\t\tAvg update latency: {avg_update_latency:.3f}s || Avg cancel + offer latency: {avg_cancel_offer_latency:.3f}s \n"
+        out += f"\t\t~ Latency saved per requote: {avg_cancel_offer_latency - avg_update_latency if self.update_latency else 0:.3f}s \n\n"
 
         out += f"\t\tTotal value of wallet: ${self.wallet_value+self.orders_value} \n"
         out += f"\t\t~ Wallet value: ${self.wallet_value} \n"
@@ -189,10 +397,14 @@ class Logger:
 
         out += f"\t\tTotal value lost on Uniswap: ${total_uni_loss} \n"  
         out += f"\t\t~ Uniswap loss per volume: ${uni_loss_per_volume} \n"
-        out += f"\t\tUsing uniswap fee of: {self.token.get_uniswap_fee()} \n"
+        out += f"\t\tDefault uniswap fee of: {self.token.get_uniswap_fee()} \n"
+        out += f"\t\t~ Fee tiers chosen: {self.uni_route_fees.counts} \n"
+        out += f"\t\t~ Avg quote latency: {self.uni_quote_latency.average():.3f}s \n"
+        out += f"\t\t~ Quote cache hits: {self.uni_quote_hits} || misses: {self.uni_quote_misses} \n"
+        out += f"\t\t~ Total improvement over default tier: ${self.uni_route_improvement.total} \n"
         out += f"\t\tTotal number of uniswaps: {len(self.uniswapper_losses)} \n"
-        out += f"\t\tTotal expected uniswap loss taken = ${sum(self.expected_uni_losses_taken)}\n"
-        out += f"\t\tTotal expected uniswap loss NOT taken = ${sum(self.expected_uni_losses_not_taken)}\n"
+        out += f"\t\tTotal expected uniswap loss taken = ${self.expected_uni_losses_taken.total}\n"
+        out += f"\t\tTotal expected uniswap loss NOT taken = ${self.expected_uni_losses_not_taken.total}\n"
         out += f"\t\tTotal # of orders not taken = {len(self.expected_uni_losses_not_taken)}\n\n"
 
 
@@ -203,20 +415,20 @@ class Logger:
         out += f"\t\t~ Total loss (gas, arb, and swap) per volume = ${losses_combined_per_volume}\n"
         out += f"\t\t~ Actual Total loss (gas, arb, and swap) per volume (minus self take) = ${actual_losses_combeined_per_volume}\n"
 
+        if self.store is not None:
+            day_ago = current_utc_time - 24 * 3600
+            out += f"\n\t\tLast 24h volume: ${self.store.volume(day_ago, current_utc_time):.2f} \n"
+            out += f"\t\t~ Last 24h arb: ${self.store.arb(day_ago, current_utc_time):.4f} \n"
+            out += f"\t\t~ Last 24h loss per volume: ${self.store.loss_per_volume(day_ago, current_utc_time):.6f} \n"
+
         # TODO: add # of own orders eaten
         
         self.times_printed += 1
         return out
 
 
-def parse_side(orders: list):
-    ask = 0
-    bid = 0
-    for side in orders:
-        if side == OrderSide.BUY:
-            bid += 1
-        elif side == OrderSide.SELL:
-            ask += 1
-        else:
-            raise ValueError("logger unexpected side")
-    return ask, bid
\ No newline at end of file
+def store_side(side: OrderSide) -> int:
+    return side_codes[side.value]
+
+def parse_side(orders: Tally):
+    return orders.get(OrderSide.SELL), orders.get(OrderSide.BUY)
\ No newline at end of file
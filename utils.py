@@ -4,8 +4,13 @@ from dotenv import load_dotenv
 from rubi import Client, EmitOfferEvent, EmitTakeEvent, EmitCancelEvent, EmitDeleteEvent
 from decimal import Decimal
 from events import TokenPairs
+from metrics import metrics
+from breaker import breakers, CircuitOpen
+from ratelimit import rate_limiter, RateLimited
 import time
 import sys
+import queue
+import threading
 
 import smtplib
 from email.mime.text import MIMEText
@@ -16,70 +21,56 @@ class TokenPrice:
     def __init__(self, token: TokenPairs):
         self.price = None
         self.token = token
-        match token:
-            case TokenPairs.WETH_USDC:
-                self.url = "https://api.coinbase.com/v2/prices/ETH-USD/spot"
-            case TokenPairs.WETH_USDT:
-                self.url = "https://api.coinbase.com/v2/prices/ETH-USD/spot"
-            case TokenPairs.USDC_DAI:
-                self.url_weth_usdc = "https://api.coinbase.com/v2/prices/ETH-USD/spot"
-                self.url_weth_dai = "https://api.pro.coinbase.com/products/ETH-DAI/ticker"
-            case TokenPairs.WETH_DAI:
-                self.url = "https://api.pro.coinbase.com/products/ETH-DAI/ticker"
-            case TokenPairs.OP_USDC:
-                self.url = "https://api.coinbase.com/v2/prices/OP-USD/spot"
-            case TokenPairs.WETH_USDC_ARB:
-                self.url = "https://api.coinbase.com/v2/prices/ETH-USD/spot"
-
-        # TODO: create an error if API fails more then X times in a row
+        self.urls = list(token.config.price_urls)
 
-    def update_price(self) -> None:
-        if self.token == TokenPairs.USDC_DAI:
-            response_usdc = requests.get(self.url_weth_usdc)
-            response_dai = requests.get(self.url_weth_dai)
-
-            if response_usdc.status_code == 200 and response_dai.status_code == 200:
-                data_usdc = response_usdc.json()
-                data_dai = response_dai.json()
-
-                weth_dai_price = Decimal(str(data_dai['price']))
-                weth_usdc_price = Decimal(str(data_usdc['data']['amount']))
-                # print(f"usdc_dai price = {weth_dai_price/weth_usdc_price}")
-                self.price = weth_dai_price/weth_usdc_price
-            else:
-                self.price = Decimal(1)
-            return
+        # COINBASE_URL points the price requests at another host, e.g. a local stand-in
+        if os.getenv("COINBASE_URL"):
+            self.urls = [os.getenv("COINBASE_URL").rstrip("/") + url.split(".com", 1)[1] for url in self.urls]
 
-        response = requests.get(self.url)
-        data = response.json()
+    # Leaves price None while Coinbase is failing so order_loop holds off quoting
+    @metrics.timed("update_price")
+    def update_price(self) -> None:
+        try:
+            breakers.get("coinbase").call(self.request_price)
+        except CircuitOpen:
+            self.price = None
+        except RateLimited as e:
+            print(f"\tWARNING - update_price: {e}")
+            self.price = None
+        except Exception as e:
+            print(f"\tERROR - update_price: Error occurred retrieving {self.token.sign()}  price: {e}")
+            self.price = None
 
-        if response.status_code == 200:
-            if self.token == TokenPairs.WETH_DAI:
-                coin_price = Decimal(str(data['price']))
-            else:
-                coin_price = Decimal(str(data['data']['amount']))
-            self.price = coin_price
+    # Raises when Coinbase does not answer so the breaker counts the failure.
+    # A second url is the price the first is divided by, e.g. ETH-DAI / ETH-USD for USDC/DAI.
+    def request_price(self) -> None:
+        prices = []
+        for url in self.urls:
+            response = self.get(url)
+            if response.status_code != 200:
+                # Pegged pairs fall back to their peg
+                if self.token.config.price_fallback is not None:
+                    self.price = self.token.config.price_fallback
+                    return
+                raise Exception(f"coinbase returned {response.status_code}")
+            data = response.json()
+            # Exchange tickers have price, the v2 spot endpoint data.amount
+            prices.append(Decimal(str(data['price'])) if 'price' in data else Decimal(str(data['data']['amount'])))
+        self.price = prices[0] / prices[1] if len(prices) > 1 else prices[0]
 
-        else:
-            print(f"\tERROR - update_price: Error occurred retrieving {self.token.sign()}  price")
-            self.price = None
+    # GET within the shared per-host rate limit
+    def get(self, url: str):
+        if not rate_limiter.acquire(url):
+            raise RateLimited(f"over the rate limit for {url}")
+        response = requests.get(url, timeout=10)
+        if response.status_code == 429:
+            rate_limiter.throttled(url, response)
+        return response
 
 def get_client(queue: Queue, pair: TokenPairs) -> Client:
 
     # Read in environment information
-    match pair:
-        case TokenPairs.WETH_USDC:
-            load_dotenv(".weth_usdc_env")
-        case TokenPairs.WETH_USDT:
-            load_dotenv(".weth_usdt_env")
-        case TokenPairs.WETH_DAI:
-            load_dotenv(".weth_dai_env")
-        case TokenPairs.USDC_DAI:
-            load_dotenv(".usdc_dai_env")
-        case TokenPairs.OP_USDC:
-            load_dotenv(".op_usdc_env")
-        case TokenPairs.WETH_USDC_ARB:
-            load_dotenv(".weth_usdc_arb_env")
+    load_dotenv(pair.config.env_file)
 
     # Create Client
     print(os.getenv("HTTP_NODE_URL"))
@@ -113,8 +104,133 @@ def get_client(queue: Queue, pair: TokenPairs) -> Client:
     return client
 
 
+# Mail server connection, SMTP_HOST/SMTP_PORT/SMTP_SSL override gmail for local testing
+def smtp_connection() -> smtplib.SMTP:
+    host = os.getenv("SMTP_HOST", "smtp.gmail.com")
+    port = int(os.getenv("SMTP_PORT", "465"))
+    if os.getenv("SMTP_SSL", "1") == "1":
+        return smtplib.SMTP_SSL(host, port)
+    return smtplib.SMTP(host, port)
+
+# Sends notification emails from a background thread so callers never wait on
+# SMTP. The logged in connection is kept open between emails and reopened once
+# after a failure or after sitting idle. Notifications queued within
+# digest_window seconds of each other are merged into one digest email.
+class NotificationDispatcher:
+    def __init__(self, digest_window: float = 5, idle_timeout: float = 120, max_queued: int = 1000):
+        self.digest_window = digest_window  # seconds
+        self.idle_timeout = idle_timeout    # seconds before an unused connection is closed
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock) # notified as queued notifications finish
+        self.thread = None
+        self.server = None
+
+        # Email server settings
+        self.sender_email = 'rubiscriptlistener@gmail.com'  # Replace with your email address
+        self.recipients = ['rubiscriptlistener@gmail.com']  # Replace with the recipient's email address
+
+        # Stats
+        self.pending = 0
+        self.sent = 0
+        self.digests = 0
+        self.connections = 0
+        self.failed = 0
+        self.dropped = 0
+
+    # Queues a notification and returns right away. final ones skip the digest window.
+    def send(self, subject: str, message: str, final: bool = False) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True, name="notifier")
+                self.thread.start()
+            self.pending += 1
+        try:
+            self.queue.put_nowait((subject, message, final))
+        except queue.Full:
+            print(f"ERROR - NotificationDispatcher: queue full, dropping {subject}")
+            metrics.counter("notifications_total", "Notification emails by outcome").inc(status="dropped")
+            with self.lock:
+                self.pending -= 1
+                self.dropped += 1
+                self.idle.notify_all()
+
+    # Waits until everything queued so far has been sent or given up on
+    def flush(self, timeout: float = 30) -> bool:
+        with self.lock:
+            return self.idle.wait_for(lambda: self.pending == 0, timeout=timeout)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.idle_timeout)]
+            except queue.Empty:
+                self._close()
+                continue
+            # Collect whatever else arrives within the window
+            deadline = time.time() + self.digest_window
+            while not batch[-1][2] and time.time() < deadline:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+
+            if len(batch) == 1:
+                subject, message = batch[0][0], batch[0][1]
+            else:
+                subject = f"{len(batch)} alerts: {batch[0][0]}"
+                message = "\n\n".join(f"{item_subject}\n{item_message}" for item_subject, item_message, _ in batch)
+            self._deliver(subject, message, len(batch))
+
+            with self.lock:
+                self.pending -= len(batch)
+                self.idle.notify_all()
+
+    def _deliver(self, subject: str, message: str, count: int) -> None:
+        msg = MIMEText(message)
+        msg['Subject'] = subject
+        msg['From'] = self.sender_email
+        msg['To'] = ', '.join(self.recipients)
+        for attempt in range(2):
+            try:
+                if self.server is None:
+                    self._connect()
+                self.server.sendmail(self.sender_email, self.recipients, msg.as_string())
+                self.sent += count
+                if count > 1:
+                    self.digests += 1
+                metrics.counter("notifications_total", "Notification emails by outcome").inc(amount=count, status="sent")
+                print(f"\t\tNotificationDispatcher: sent {subject}")
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                print(f"WARNING - NotificationDispatcher: send failed {e}")
+                self._close()
+        self.failed += count
+        metrics.counter("notifications_total", "Notification emails by outcome").inc(amount=count, status="failed")
+        print(f"ERROR - NotificationDispatcher: could not send {subject}")
+
+    def _connect(self) -> None:
+        self._close()
+        server = smtp_connection()
+        server.login(self.sender_email, os.getenv("EMAIL_PASS"))
+        self.server = server
+        self.connections += 1
+
+    def _close(self) -> None:
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self.server = None
+
+# Shared by every notifier in the process
+dispatcher = NotificationDispatcher()
+
 class BalanceNotification():
-    def __init__(self, wait_time):
+    def __init__(self, wait_time, dispatcher: NotificationDispatcher = dispatcher):
+        self.dispatcher = dispatcher
         self.last_notification_time = 0
         self.min_wait = 60*wait_time # seconds
 
@@ -122,30 +238,17 @@ class BalanceNotification():
         if self.last_notification_time + self.min_wait > time.time():
             print("\t\tNotification.send_notification() - suppressing email")
             return
-        
-        # Email server settings
-        smtp_server = 'smtp.gmail.com'
-        sender_email = 'rubiscriptlistener@gmail.com'  # Replace with your email address
-        sender_password = os.getenv("EMAIL_PASS")  # Replace with your email password
-
-        # Recipient email address
-        recipients = ['rubiscriptlistener@gmail.com']  # Replace with the recipient's email address
 
-        msg = MIMEText(message)
-        msg['Subject'] = subject
-        msg['From'] = sender_email
-        msg['To'] = ', '.join(recipients)
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp_server:
-            smtp_server.login(sender_email, sender_password)
-            smtp_server.sendmail(sender_email, recipients, msg.as_string())
-        print("\t\tBalance Notification sent")
+        self.dispatcher.send(subject=subject, message=message)
+        print("\t\tBalance Notification queued")
         self.last_notification_time = time.time()
 
 class ErrorNotification():
-    def __init__(self):
+    def __init__(self, dispatcher: NotificationDispatcher = dispatcher):
+        self.dispatcher = dispatcher
         self.last_notification_time = 0
         self.total_errors = []
-        self.min_wait = 1 # seconds
+        self.min_wait = 0 # seconds, bursts are merged into digests by the dispatcher
         self.max_errors = 10
 
     def error_occured(self, hash, token) -> None:
@@ -165,22 +268,11 @@ class ErrorNotification():
         if self.last_notification_time + self.min_wait > time.time() and not final:
             print("\t\tNotification.send_notification() - suppressing email")
             return
-        
-        # Email server settings
-        smtp_server = 'smtp.gmail.com'
-        sender_email = 'rubiscriptlistener@gmail.com'  # Replace with your email address
-        sender_password = os.getenv("EMAIL_PASS")  # Replace with your email password
-
-        # Recipient email address
-        recipients = ['rubiscriptlistener@gmail.com']  # Replace with the recipient's email address
 
-        msg = MIMEText(message)
-        msg['Subject'] = subject
-        msg['From'] = sender_email
-        msg['To'] = ', '.join(recipients)
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp_server:
-            smtp_server.login(sender_email, sender_password)
-            smtp_server.sendmail(sender_email, recipients, msg.as_string())
-        print("\t\tError notification sent")
+        self.dispatcher.send(subject=subject, message=message, final=final)
+        # Sent before the bot shuts down
+        if final:
+            self.dispatcher.flush()
+        print("\t\tError notification queued")
         self.last_notification_time = time.time()
 